@@ -0,0 +1,243 @@
+"""
+Hosts many independent agents in one process behind a small HTTP API, sharing one LLM quota.
+
+    POST /agents/<agent id>/stimulus  {"description": "...", "stimulus": ["...", ...], "weight": 1.0}
+        -> {"agent": "<agent id>", "response": "...", "latency": seconds}
+    DELETE /agents/<agent id>
+    GET /stats -> number of agents and the scheduler's per tenant queue waits and request latencies
+
+An agent is created by its first stimulus. Every agent is a tenant of one FairScheduler installed as the LLM scheduler,
+so the LLM calls of all agents queue for the same capacity and a chatty agent only ever gets its weight's share of it.
+Agents make blocking calls, so ticks run on worker threads while the event loop keeps serving requests. The ticks of one
+agent run one at a time, in the order they arrived.
+
+Every agent interns its stimuli in an information table of its own. Agents give the stimuli they see context (eagerly
+or with a resolver over their own memories), so sharing one Information object between agents would let one agent's
+context overwrite another's.
+
+    python Simulation.py serve --port 8080 --capacity 8
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import LLM_Controller as llm
+from Information_Table import InformationTable
+from LLM_Scheduler import FairScheduler, tenant_context
+from State_Control import Agent
+
+_HOST = "127.0.0.1"
+_PORT = 8080
+_MAX_WORKERS = 64  # Agent ticks running at once, their LLM calls still queue for the scheduler's capacity
+_MAX_BODY_BYTES = 1024 ** 2
+
+
+class ServiceError(Exception):
+    """
+    A request the service can't handle, answered with the status
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class AgentService:
+    """
+    Agents by id, ticked on worker threads with their LLM calls fairly scheduled
+    """
+
+    def __init__(self, scheduler=None, agent_factory=Agent, max_workers=_MAX_WORKERS):
+        """
+        :param scheduler: Optional FairScheduler, one with the default capacity by default
+        :param agent_factory: Callable returning a new agent
+        :param max_workers: Agent ticks running at once
+        """
+        self.scheduler = scheduler if scheduler is not None else FairScheduler()
+        self.agent_factory = agent_factory
+        self.agents = {}  # Agent id -> agent
+        self._information_tables = {}  # Agent id -> InformationTable the agent's stimuli are interned in
+        self._agent_locks = {}  # Agent id -> asyncio.Lock, so an agent's ticks don't overlap
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+        self._previous_scheduler = None
+
+    async def process_stimulus(self, agent_id, description, stimulus, weight=None):
+        """
+        Run one tick of an agent, creating it on first use
+        :param agent_id: Agent (and tenant) id
+        :param description: Description of the stimulus
+        :param stimulus: List of information values
+        :param weight: Optional new scheduling weight of the agent
+        :return: The agent's response
+        """
+        if agent_id not in self.agents:
+            self.agents[agent_id] = self.agent_factory()
+            self._information_tables[agent_id] = InformationTable()
+            self._agent_locks[agent_id] = asyncio.Lock()
+        if weight is not None:
+            self.scheduler.set_weight(agent_id, weight)
+        agent = self.agents[agent_id]
+        information_table = self._information_tables[agent_id]
+
+        start_time = time.perf_counter()
+        async with self._agent_locks[agent_id]:
+            response = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._tick, agent_id, agent, information_table, description, stimulus)
+        self.scheduler.record_request(agent_id, time.perf_counter() - start_time)
+        return response
+
+    @staticmethod
+    def _tick(agent_id, agent, information_table, description, stimulus):
+        stimulus_list = [information_table.intern(value) for value in stimulus]
+        # Information values are interned in the agent's table, so what it already saw last tick is the same object
+        seen = {id(information) for information in agent.stimulus_list}
+        new_stimulus_list = [information for information in stimulus_list if id(information) not in seen]
+        with tenant_context(agent_id):
+            return agent.process_stimulus(description, stimulus_list, new_stimulus_list=new_stimulus_list)
+
+    async def remove_agent(self, agent_id):
+        """
+        Remove an agent once its running tick (if any) is done, and stop its stage threads
+        :param agent_id: Agent id
+        """
+        agent = self.agents.pop(agent_id, None)
+        if agent is None:
+            raise ServiceError(HTTPStatus.NOT_FOUND, f"No agent '{agent_id}'")
+        self._information_tables.pop(agent_id, None)
+        async with self._agent_locks.pop(agent_id):
+            close = getattr(agent, "close", None)
+            if close is not None:
+                close()
+
+    def get_stats(self):
+        return {"agents": len(self.agents), "scheduler": self.scheduler.get_stats()}
+
+    async def handle(self, method, path, body):
+        """
+        :param method: HTTP method
+        :param path: Request path
+        :param body: Request body bytes
+        :return: (HTTPStatus, JSON serializable body) tuple
+        """
+        parts = [part for part in path.split("?", 1)[0].split("/") if part]
+        if parts == ["stats"] and method == "GET":
+            return HTTPStatus.OK, self.get_stats()
+        if len(parts) == 3 and parts[0] == "agents" and parts[2] == "stimulus" and method == "POST":
+            try:
+                request = json.loads(body or b"{}")
+                description = str(request.get("description", ""))
+                stimulus = request.get("stimulus", [])
+                if not isinstance(stimulus, list):
+                    raise TypeError(f"'stimulus' must be a list, not {type(stimulus).__name__}")
+                stimulus = [str(value) for value in stimulus]
+                weight = float(request["weight"]) if request.get("weight") is not None else None
+                if weight is not None and not (math.isfinite(weight) and weight > 0):
+                    raise ValueError(f"'weight' must be a positive number, not {request['weight']}")
+            except (ValueError, TypeError, AttributeError) as e:
+                raise ServiceError(HTTPStatus.BAD_REQUEST, f"Invalid stimulus request: {e}")
+            start_time = time.perf_counter()
+            response = await self.process_stimulus(parts[1], description, stimulus, weight)
+            return HTTPStatus.OK, {"agent": parts[1], "response": response,
+                                   "latency": time.perf_counter() - start_time}
+        if len(parts) == 2 and parts[0] == "agents" and method == "DELETE":
+            await self.remove_agent(parts[1])
+            return HTTPStatus.OK, {"agent": parts[1], "removed": True}
+        raise ServiceError(HTTPStatus.NOT_FOUND, f"No route for {method} {path}")
+
+    async def _serve_connection(self, reader, writer):
+        """
+        Answer the HTTP/1.1 requests of one connection until the client closes it
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > _MAX_BODY_BYTES:
+                    status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    try:
+                        status, payload = await self.handle(method, path, body)
+                    except ServiceError as e:
+                        status, payload = e.status, {"error": str(e)}
+                    except RuntimeError as e:
+                        print(f"Agent service request {method} {path} failed: {e}")
+                        status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+                    keep_alive = headers.get("connection", "").lower() != "close"
+
+                encoded = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(encoded)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + encoded)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # Client went away or sent something that isn't HTTP
+        finally:
+            writer.close()
+
+    async def start(self, host=_HOST, port=_PORT):
+        """
+        Install the scheduler and start listening
+        :return: The asyncio server
+        """
+        self._previous_scheduler = llm.set_llm_scheduler(self.scheduler)
+        return await asyncio.start_server(self._serve_connection, host, port)
+
+    def close(self):
+        llm.set_llm_scheduler(self._previous_scheduler)
+        self._executor.shutdown(wait=False)
+        for agent in self.agents.values():
+            close = getattr(agent, "close", None)
+            if close is not None:
+                close()
+
+    async def serve_forever(self, host=_HOST, port=_PORT):
+        server = await self.start(host, port)
+        print(f"Agent service listening on http://{host}:{server.sockets[0].getsockname()[1]}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve many agents sharing one LLM quota")
+    parser.add_argument("--host", default=_HOST)
+    parser.add_argument("--port", type=int, default=_PORT)
+    parser.add_argument("--capacity", type=int, default=None, help="LLM calls running at once across all agents")
+    parser.add_argument("--workers", type=int, default=_MAX_WORKERS, help="Agent ticks running at once")
+    args = parser.parse_args(argv)
+
+    scheduler = FairScheduler(args.capacity) if args.capacity is not None else FairScheduler()
+    service = AgentService(scheduler, max_workers=args.workers)
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,638 @@
+"""
+Offline benchmark suite for the agent tick pipeline.
+
+Runs Agent.process_stimulus / WorldState loops against a deterministic local stand-in for the LLM so that results are
+repeatable and cost nothing. For every run it records ticks/sec, LLM calls per tick by call site, prompt and response
+token volume, Python side overhead per tick and RSS growth. Results are written to a JSON file that a later run can be
+compared against to catch regressions.
+
+Usage:
+    python Benchmark.py --ticks 10 100 1000 --memory-sizes 0 100 --output benchmark_results.json
+    python Benchmark.py --compare benchmark_baseline.json
+    python Benchmark.py --ticks 10 --trace trace.json
+    python Benchmark.py --ticks 10 --import-budget 150
+    python Benchmark.py --ticks 20 --latency 0.01 --llm-capacity 4 --background-load 8
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import LLM_Controller as llm
+import Prompt_Templates as prompt_templates
+import State_Control as st
+import Tracer
+import World_Generator as wg
+from Memory_Profiler import MemoryProfiler, get_rss_bytes
+from Prompt_Assembler import count_tokens
+from LLM_Scheduler import FairScheduler, priority_context
+from Semantic_Cache import SemanticCache
+
+_DEFAULT_TICKS = [10, 100, 1000]
+_DEFAULT_MEMORY_SIZES = [0, 100]
+_DEFAULT_SCENARIOS = ["agent", "world"]
+# 'delta' gives the agent only what changed in the world each tick, 'full' gives it the whole information list
+_STIMULUS_MODES = ["delta", "full"]
+# Stop a run once it has taken this long so quadratic behaviour can't hang the suite. The run is marked as truncated
+_DEFAULT_MAX_SECONDS = 120
+# How many RSS samples to take over the course of a run
+_RSS_SAMPLES = 20
+# How much longer a slow stand-in call takes than a normal one
+_SLOW_CALL_FACTOR = 20
+# A metric that moves in the wrong direction by more than this fraction of the baseline is a regression
+_REGRESSION_THRESHOLD = 0.10
+# Modules timed by measure_import_time, and the slow optional dependencies that must not be loaded by importing them
+_IMPORT_TIMED_MODULES = ["State_Control", "World_Generator"]
+_HEAVY_MODULES = ["openai", "tkinter", "numpy", "tiktoken", "httpx"]
+# Run in a fresh interpreter by measure_import_time, so nothing is imported already
+_IMPORT_TIME_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"ms": (time.perf_counter() - start) * 1000,
+                  "heavy_modules": [name for name in {heavy_modules!r} if name in sys.modules]}}))
+"""
+
+# Metrics compared against a baseline, True if a higher value is better
+_COMPARED_METRICS = {
+    "ticks_per_sec": True,
+    "llm_calls_per_tick": False,
+    "prompt_tokens_per_tick": False,
+    "response_tokens_per_tick": False,
+    "python_overhead_ms_per_tick": False,
+    "rss_growth_bytes": False,
+}
+
+# A numbered task of a batch prompt, up to the next task or the end of the prompt
+_BATCH_TASK_PATTERN = re.compile(r"^Task (\d+):\n(.*?)(?=\n\nTask \d+:\n|\Z)", re.DOTALL | re.MULTILINE)
+_CATEGORIES = ["Understood", "Spatial", "Internal", "Emotional", "Social"]
+_WORLD_INFORMATION = ["a person standing", "underneath a tree", "an acorn on the ground", "a cold breeze",
+                      "a large empty white room", "a closed door", "sunlight through a window", "a wooden chair",
+                      "a distant sound", "footsteps on gravel", "a colorful pattern on the walls", "a small bird"]
+_ACTIONS = ["walk forward", "look around", "sit down", "pick up the acorn", "open the door", "wait", "call out",
+            "touch the wall", "do nothing"]
+
+
+class StandInLLM:
+    """
+    Deterministic local replacement for the chat completion API. Responses only depend on the seed, the call site and
+    the prompt so every run of the benchmark makes the same calls.
+    """
+
+    def __init__(self, seed=0, latency=0.0, slow_fraction=0.0):
+        self.seed = seed
+        self.latency = latency  # Simulated seconds per call, included in the LLM time of a tick
+        # Fraction of calls that take _SLOW_CALL_FACTOR times longer, to simulate provider tail latency. Which calls are
+        # slow follows a seeded sequence, independent of the prompt, so a hedged duplicate is usually fast
+        self.slow_fraction = slow_fraction
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def __call__(self, model=None, messages=None, tools=None, tool_choice=None, call_site="default", **request_options):
+        prompt = "\n".join(message["content"] for message in messages)
+        digest = hashlib.sha256(f"{self.seed}:{call_site}:{prompt}".encode()).digest()
+        if self.latency:
+            with self._random_lock:
+                slow = self._random.random() < self.slow_fraction
+            time.sleep(self.latency * (_SLOW_CALL_FACTOR if slow else 1))
+
+        if call_site.startswith("batch."):  # Numbered tasks of one call site, see LlmQuery.batch
+            return _make_response(json.dumps(self._respond_batch(call_site.split(".", 1)[1], prompt)))
+        return _make_response(self._respond(call_site, prompt, digest))
+
+    def _respond_batch(self, call_site, prompt):
+        """
+        :return: Dictionary of task number -> the answer the task would get on its own
+        """
+        answers = {}
+        for number, task in _BATCH_TASK_PATTERN.findall(prompt):
+            digest = hashlib.sha256(f"{self.seed}:{call_site}:{task}".encode()).digest()
+            answers[number] = self._respond(call_site, task, digest)
+        return answers
+
+    @staticmethod
+    def _respond(call_site, prompt, digest):
+        if call_site == "category":
+            return _CATEGORIES[digest[0] % len(_CATEGORIES)]
+        if call_site == "relevance":
+            return "Yes" if digest[0] % 3 else "No"
+        if call_site == "world_parse":
+            return ", ".join(_pick(_WORLD_INFORMATION, digest, 2 + digest[1] % 3))
+        if call_site == "generate_responses":
+            return ", ".join(_pick(_ACTIONS, digest, 3 + digest[1] % 3))
+        if call_site == "choose_response":
+            candidates = prompt.rsplit("Possible responses:\n", 1)[-1].split(", ")
+            return candidates[digest[0] % len(candidates)].strip("[]'\" ")
+        if call_site == "decide":
+            candidates = _pick(_ACTIONS, digest, 3 + digest[1] % 3)
+            return json.dumps({"candidates": candidates, "choice": candidates[digest[0] % len(candidates)]})
+        if call_site == "world_next_state":
+            return f"The world shifts. There is {' and '.join(_pick(_WORLD_INFORMATION, digest, 2))}."
+        if call_site in ("contextualize", "compress"):
+            return f"I remember {' and '.join(_pick(_WORLD_INFORMATION, digest, 2))}."
+        return "Okay."
+
+
+class StandInServer:
+    """
+    Serves a StandInLLM as a local OpenAI compatible HTTP endpoint, so the benchmark can also exercise the pooled
+    transport. Use as a context manager, base_url is set once the server is running.
+    """
+
+    def __init__(self, stand_in):
+        self.stand_in = stand_in
+        self.base_url = ""
+        self._server = None
+
+    def __enter__(self):
+        stand_in = self.stand_in
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive
+            disable_nagle_algorithm = True
+            wbufsize = -1  # Send headers and body together, flushed at the end of the request
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                response = stand_in(model=payload.get("model"), messages=payload["messages"],
+                                    call_site=self.headers.get("X-Call-Site", "default"))
+                body = json.dumps({"choices": [{"index": 0, "finish_reason": "stop", "message": {
+                    "role": "assistant", "content": response.choices[0].message.content}}]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+        return False
+
+
+def _pick(options, digest, count):
+    picked = []
+    for byte in digest[2:]:
+        option = options[byte % len(options)]
+        if option not in picked:
+            picked.append(option)
+        if len(picked) == count:
+            break
+    return picked
+
+
+def _make_response(content):
+    message = SimpleNamespace(role="assistant", content=content, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")])
+
+
+class TickRecorder:
+    """
+    LLM observer that attributes calls, tokens and LLM time to the current tick
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls_by_site = {}
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self._intervals = []  # (start, end) of every call, calls overlap when requests are hedged
+
+    @property
+    def llm_seconds(self):
+        """
+        Time at least one LLM call was in flight, so a hedged duplicate doesn't count its time twice
+        """
+        with self._lock:
+            intervals = sorted(self._intervals)
+        seconds = 0.0
+        covered_until = float("-inf")
+        for start, end in intervals:
+            if end > covered_until:
+                seconds += end - max(start, covered_until)
+                covered_until = end
+        return seconds
+
+    def __call__(self, call_site, messages, response, elapsed):
+        end = time.perf_counter()
+        prompt_tokens = sum(count_tokens(message["content"] or "") for message in messages)
+        response_tokens = count_tokens(response.choices[0].message.content or "")
+        with self._lock:  # Hedged calls report from worker threads
+            self.calls_by_site[call_site] = self.calls_by_site.get(call_site, 0) + 1
+            self.prompt_tokens += prompt_tokens
+            self.response_tokens += response_tokens
+            self._intervals.append((end - elapsed, end))
+
+
+def _seed_memory(agent, memory_size):
+    """
+    Give an agent memory_size temporal contexts worth of memories before the run starts
+    """
+    for index in range(memory_size):
+        memory = st.TemporalContext(st.intern_information(f"moment {index}"))
+        memory.experienced_information = [
+            st.intern_information(_WORLD_INFORMATION[(index + offset) % len(_WORLD_INFORMATION)]) for offset in range(3)]
+        agent.memories.memories.append(memory)
+
+
+def _run_background_load(stop, index, priority, calls):
+    """
+    Summarize memories in a loop until stopped, like memory consolidation running next to the ticks
+    :param stop: threading.Event ending the loop
+    :param index: Number of the thread, so threads summarize different memories
+    :param priority: Priority class of the calls
+    :param calls: List the number of summaries made is appended to
+    """
+    count = 0
+    with priority_context(priority):
+        while not stop.is_set():
+            st.summarize_memories([st.intern_information(_WORLD_INFORMATION[(index + count + offset) %
+                                                                             len(_WORLD_INFORMATION)])
+                                   for offset in range(3)])
+            count += 1
+    calls.append(count)
+
+
+def run_benchmark(scenario, ticks, memory_size=0, seed=0, latency=0.0, max_seconds=_DEFAULT_MAX_SECONDS,
+                  stimulus_mode="delta", backend=None, slow_fraction=0.0, agent_options=None,
+                  memory_profile_every=0, semantic_cache=False, minimize_prompts=False, llm_capacity=None,
+                  background_load=0, background_priority="background"):
+    """
+    Run a single benchmark
+
+    :param scenario: 'agent' for the full agent + world loop, 'world' for the world loop alone
+    :param ticks: Number of ticks to run
+    :param memory_size: Number of temporal contexts the agent starts with
+    :param seed: Seed of the stand-in LLM
+    :param latency: Simulated seconds per LLM call
+    :param max_seconds: Wall time after which the run is stopped early
+    :param stimulus_mode: 'delta' or 'full', see _STIMULUS_MODES
+    :param backend: Optional LLM backend to use instead of an in-process StandInLLM
+    :param slow_fraction: Fraction of stand-in calls that are slow, see StandInLLM
+    :param agent_options: Optional keyword arguments for State_Control.Agent, e.g. decision_mode or max_parallelism
+    :param memory_profile_every: Sample a MemoryProfiler every this many ticks, 0 to not profile
+    :param semantic_cache: Reuse responses of similar prompts on the idempotent call sites, see Semantic_Cache
+    :param minimize_prompts: Send the minimized variant of every prompt template, see Prompt_Templates
+    :param llm_capacity: Queue LLM calls through a FairScheduler with this many slots, see LLM_Scheduler
+    :param background_load: Number of threads summarizing memories during the run
+    :param background_priority: Priority class of the background load's calls
+    :return: Dictionary of results
+    """
+    st.reset_information_table()
+    gc.collect()
+    llm.reset_route_stats()
+    llm.reset_hedge_stats()
+    previous_backend = llm.set_llm_backend(backend if backend is not None else StandInLLM(seed, latency, slow_fraction))
+    recorder = TickRecorder()
+    llm.add_llm_observer(recorder)
+    if semantic_cache:
+        llm.enable_semantic_cache(SemanticCache(seed=seed))
+    prompt_templates.get_prompt_registry().reset_renders()
+    prompt_templates.set_prompt_minimization(minimize_prompts)
+    profiler = MemoryProfiler((st.Information, st.Context), every=memory_profile_every,
+                              not_owned_types=(st.ContextResolver, st.AgentMemory, st.MemoryHierarchy))
+    scheduler = FairScheduler(llm_capacity) if llm_capacity is not None else None
+    previous_scheduler = llm.set_llm_scheduler(scheduler)
+    stop_background = threading.Event()
+    background_calls = []
+    background_threads = [threading.Thread(target=_run_background_load, daemon=True,
+                                           args=(stop_background, index, background_priority, background_calls))
+                          for index in range(background_load)]
+    world = agent = None
+    try:
+        rss_start = get_rss_bytes()
+        world = wg.WorldState("A person has just started existing inside a large empty white room.")
+        if scenario == "agent":
+            agent = st.Agent(**(agent_options or {}))
+            _seed_memory(agent, memory_size)
+        setup_calls = sum(recorder.calls_by_site.values())
+        for thread in background_threads:
+            thread.start()
+
+        calls_by_site = {}
+        prompt_tokens = response_tokens = 0
+        llm_seconds = total_seconds = 0.0
+        tick_seconds = []
+        stage_seconds = {}
+        critical_path_ticks = {}
+        rss_curve = [[0, rss_start]]
+        sample_every = max(1, ticks // _RSS_SAMPLES)
+        run_start = time.perf_counter()
+        completed_ticks = 0
+        for tick in range(1, ticks + 1):
+            recorder.reset()
+            tick_start = time.perf_counter()
+            if agent is not None and stimulus_mode == "delta":
+                response = agent.process_world_delta(world.description, world.last_delta, world.speculate)
+            elif agent is not None:
+                response = agent.process_stimulus(world.description, world.current_information_list, world.speculate)
+            else:
+                response = _ACTIONS[tick % len(_ACTIONS)]
+            world.get_next_world_state(response)
+            elapsed = time.perf_counter() - tick_start
+
+            completed_ticks = tick
+            tick_seconds.append(elapsed)
+            total_seconds += elapsed
+            llm_seconds += recorder.llm_seconds
+            prompt_tokens += recorder.prompt_tokens
+            response_tokens += recorder.response_tokens
+            for call_site, calls in recorder.calls_by_site.items():
+                calls_by_site[call_site] = calls_by_site.get(call_site, 0) + calls
+            if agent is not None:
+                for name, timing in agent.last_stage_run.timings.items():
+                    stage_seconds[name] = stage_seconds.get(name, 0.0) + timing.duration
+                    critical_path_ticks[name] = critical_path_ticks.get(name, 0) + timing.critical
+
+            if tick % sample_every == 0:
+                rss_curve.append([tick, get_rss_bytes()])
+            profiler.maybe_sample(tick, agent, world)
+            if time.perf_counter() - run_start > max_seconds:
+                break
+    finally:
+        if world is not None:
+            world.close()
+        if agent is not None:
+            agent.close()
+        stop_background.set()
+        for thread in background_threads:
+            thread.join()
+        llm.set_llm_scheduler(previous_scheduler)
+        llm.remove_llm_observer(recorder)
+        llm.set_llm_backend(previous_backend)
+        semantic_cache_stats = llm.get_semantic_cache_stats()
+        llm.disable_semantic_cache()
+        prompt_templates.set_prompt_minimization(False)
+
+    rss_end = get_rss_bytes()
+    ticks_done = max(completed_ticks, 1)
+    return {
+        "scenario": scenario,
+        "ticks": ticks,
+        "memory_size": memory_size,
+        "stimulus_mode": stimulus_mode,
+        "completed_ticks": completed_ticks,
+        "truncated": completed_ticks < ticks,
+        "setup_llm_calls": setup_calls,
+        "ticks_per_sec": completed_ticks / total_seconds if total_seconds else 0.0,
+        "llm_calls_per_tick": sum(calls_by_site.values()) / ticks_done,
+        "llm_calls_per_tick_by_site": {site: calls / ticks_done for site, calls in sorted(calls_by_site.items())},
+        "prompt_tokens_per_tick": prompt_tokens / ticks_done,
+        "response_tokens_per_tick": response_tokens / ticks_done,
+        "python_overhead_ms_per_tick": (total_seconds - llm_seconds) * 1000 / ticks_done,
+        "tick_ms_curve": _sample_curve(tick_seconds),
+        "rss_start_bytes": rss_start,
+        "rss_end_bytes": rss_end,
+        "rss_growth_bytes": rss_end - rss_start if rss_start is not None and rss_end is not None else None,
+        "rss_curve": rss_curve,
+        "route_stats": llm.get_route_stats(),
+        "hedge_stats": llm.get_hedge_stats(),
+        "semantic_cache": semantic_cache_stats,
+        "memory_hierarchy": agent.memories.hierarchy.get_stats()
+        if agent is not None and agent.memories.hierarchy is not None else None,
+        "prompt_templates": prompt_templates.token_report(),
+        "llm_scheduler": scheduler.get_stats() if scheduler is not None else None,
+        "background_summaries": sum(background_calls),
+        "stage_ms_per_tick": {name: seconds * 1000 / ticks_done for name, seconds in stage_seconds.items()},
+        # Fraction of ticks each stage was on the critical path of the agent's stage graph
+        "critical_path_share": {name: count / ticks_done for name, count in critical_path_ticks.items()},
+        "memory_profile": profiler.samples,
+        "memory_alerts": [dict(alert, tick=sample["tick"]) for sample in profiler.samples for alert in sample["alerts"]],
+    }
+
+
+def _sample_curve(tick_seconds):
+    """
+    :return: [tick, milliseconds] pairs for at most _RSS_SAMPLES evenly spaced ticks
+    """
+    step = max(1, len(tick_seconds) // _RSS_SAMPLES)
+    return [[index + 1, tick_seconds[index] * 1000] for index in range(step - 1, len(tick_seconds), step)]
+
+
+def measure_import_time(module, repeats=3):
+    """
+    Time importing a module in a fresh interpreter
+    :param module: Module name
+    :param repeats: Number of interpreters started, the fastest import is reported
+    :return: Dictionary with the import time in 'ms' and the 'heavy_modules' the import loaded
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    python_path = os.pathsep.join(filter(None, [directory, os.environ.get("PYTHONPATH")]))
+    environment = dict(os.environ, PYTHONPATH=python_path)
+    script = _IMPORT_TIME_SCRIPT.format(module=module, heavy_modules=_HEAVY_MODULES)
+    measurements = []
+    for _ in range(repeats):
+        process = subprocess.run([sys.executable, "-c", script], cwd=directory, env=environment, capture_output=True,
+                                 text=True)
+        if process.returncode:
+            raise RuntimeError(f"Importing {module} failed:\n{process.stderr}")
+        measurements.append(json.loads(process.stdout.strip().splitlines()[-1]))
+    return min(measurements, key=lambda measurement: measurement["ms"])
+
+
+def check_import_budget(import_times, budget_ms):
+    """
+    :param import_times: Dictionary of module -> measure_import_time result
+    :param budget_ms: Most milliseconds an import may take
+    :return: List of violation description strings
+    """
+    violations = []
+    for module, measurement in import_times.items():
+        if measurement["ms"] > budget_ms:
+            violations.append(f"importing {module} took {measurement['ms']:.1f}ms, the budget is {budget_ms:.1f}ms")
+        if measurement["heavy_modules"]:
+            violations.append(f"importing {module} loaded {', '.join(measurement['heavy_modules'])}")
+    return violations
+
+
+def run_suite(scenarios=None, tick_counts=None, memory_sizes=None, http=False, **run_options):
+    """
+    Run every combination of scenario, tick count and memory size
+    :param http: Serve the stand-in over local HTTP and call it through the pooled transport
+    :param run_options: Keyword arguments for run_benchmark, e.g. seed, latency or agent_options
+    :return: Dictionary with run metadata and a list of run results
+    """
+    if not http:
+        return _run_suite(scenarios, tick_counts, memory_sizes, run_options)
+
+    stand_in = StandInLLM(run_options.get("seed", 0), run_options.get("latency", 0.0),
+                          run_options.get("slow_fraction", 0.0))
+    with StandInServer(stand_in) as server:
+        transport = llm.use_pooled_transport(base_url=server.base_url, api_key="", send_call_site=True)
+        try:
+            results = _run_suite(scenarios, tick_counts, memory_sizes, dict(run_options, backend=transport))
+        finally:
+            llm.set_llm_backend(None)
+            transport.close()
+    results["meta"]["transport_health"] = transport.get_health()
+    return results
+
+
+def _run_suite(scenarios, tick_counts, memory_sizes, run_options):
+    scenarios = scenarios or _DEFAULT_SCENARIOS
+    tick_counts = tick_counts or _DEFAULT_TICKS
+    memory_sizes = memory_sizes or _DEFAULT_MEMORY_SIZES
+
+    runs = []
+    for scenario in scenarios:
+        for memory_size in (memory_sizes if scenario == "agent" else [0]):
+            for ticks in tick_counts:
+                result = run_benchmark(scenario, ticks, memory_size, **run_options)
+                print(f"{scenario:>6} ticks={ticks:<5} memory={memory_size:<5} "
+                      f"completed={result['completed_ticks']:<5} ticks/sec={result['ticks_per_sec']:.2f} "
+                      f"llm calls/tick={result['llm_calls_per_tick']:.1f} "
+                      f"overhead ms/tick={result['python_overhead_ms_per_tick']:.2f}")
+                runs.append(result)
+
+    meta = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "http": run_options.get("backend") is not None,
+    }
+    meta.update((name, value) for name, value in run_options.items() if name != "backend")
+    meta["import_times"] = {module: measure_import_time(module) for module in _IMPORT_TIMED_MODULES}
+    return {"meta": meta, "runs": runs}
+
+
+def compare_results(results, baseline, threshold=_REGRESSION_THRESHOLD):
+    """
+    Compare suite results with a saved baseline
+
+    :param results: Output of run_suite
+    :param baseline: Output of an earlier run_suite
+    :param threshold: Fraction of the baseline a metric may get worse by before it counts as a regression
+    :return: List of regression description strings
+    """
+    baseline_runs = {(run["scenario"], run["ticks"], run["memory_size"]): run for run in baseline["runs"]}
+    regressions = []
+    for run in results["runs"]:
+        key = (run["scenario"], run["ticks"], run["memory_size"])
+        if key not in baseline_runs:
+            continue
+        baseline_run = baseline_runs[key]
+        for metric, higher_is_better in _COMPARED_METRICS.items():
+            old_value = baseline_run.get(metric)
+            new_value = run.get(metric)
+            if old_value is None or new_value is None:
+                continue
+            change = (new_value - old_value) / abs(old_value) if old_value else 0.0
+            print(f"{key[0]:>6} ticks={key[1]:<5} memory={key[2]:<5} {metric:<28} {old_value:>14.2f} -> "
+                  f"{new_value:>14.2f} ({change:+.1%})")
+            if (change < -threshold) if higher_is_better else (change > threshold):
+                regressions.append(f"{key[0]} ticks={key[1]} memory={key[2]}: {metric} {old_value:.2f} -> "
+                                   f"{new_value:.2f} ({change:+.1%})")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the agent tick pipeline against a local LLM stand-in")
+    parser.add_argument("--scenarios", nargs="+", choices=_DEFAULT_SCENARIOS, default=_DEFAULT_SCENARIOS)
+    parser.add_argument("--ticks", nargs="+", type=int, default=_DEFAULT_TICKS)
+    parser.add_argument("--memory-sizes", nargs="+", type=int, default=_DEFAULT_MEMORY_SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per LLM call")
+    parser.add_argument("--max-seconds", type=float, default=_DEFAULT_MAX_SECONDS,
+                        help="Stop a run early after this many seconds")
+    parser.add_argument("--stimulus", choices=_STIMULUS_MODES, default="delta",
+                        help="Give the agent only the world delta or the full information list each tick")
+    parser.add_argument("--slow-fraction", type=float, default=0.0,
+                        help=f"Fraction of LLM calls that take {_SLOW_CALL_FACTOR}x the latency")
+    parser.add_argument("--decision", choices=["two_call", "fused"], default="two_call",
+                        help="How agents decide on a response, see State_Control.Agent")
+    parser.add_argument("--max-parallelism", type=int, default=None,
+                        help="Maximum number of agent stages running at once, 1 runs them one after the other")
+    parser.add_argument("--eager-context", action="store_true",
+                        help="Resolve the context of every new stimulus during the tick instead of when it is read")
+    parser.add_argument("--flat-memory", action="store_true",
+                        help="Search every memory for context instead of descending through episodes and eras")
+    parser.add_argument("--hedge", action="store_true", help="Enable request hedging")
+    parser.add_argument("--no-batch", action="store_true",
+                        help="Send every small query on its own instead of packing them, see LlmQuery.batch")
+    parser.add_argument("--semantic-cache", action="store_true",
+                        help="Reuse responses of similar prompts on the idempotent call sites")
+    parser.add_argument("--minimize-prompts", action="store_true",
+                        help="Send the minimized variant of every prompt template")
+    parser.add_argument("--llm-capacity", type=int, default=None, metavar="N",
+                        help="Queue LLM calls for N slots by priority class, see LLM_Scheduler")
+    parser.add_argument("--background-load", type=int, default=0, metavar="THREADS",
+                        help="Threads summarizing memories next to the ticks, like background maintenance")
+    parser.add_argument("--background-priority", choices=["foreground", "background"], default="background",
+                        help="Priority class of the background load's calls, to compare against no prioritization")
+    parser.add_argument("--memory-profile", type=int, default=0, metavar="N",
+                        help="Sample object counts and sizes every N ticks")
+    parser.add_argument("--trace-allocations", action="store_true",
+                        help="Report allocation sites by module in the memory profile (slow)")
+    parser.add_argument("--http", action="store_true",
+                        help="Serve the stand-in over local HTTP and call it through the pooled transport")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Baseline results file to compare against")
+    parser.add_argument("--threshold", type=float, default=_REGRESSION_THRESHOLD)
+    parser.add_argument("--trace", help="Write a Chrome trace-event file of every run to this path")
+    parser.add_argument("--import-budget", type=float, metavar="MS",
+                        help="Fail if importing the simulation modules takes longer or loads a heavy dependency")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        Tracer.enable_tracing()
+    llm.set_hedging_enabled(args.hedge)
+    llm.set_batching_enabled(not args.no_batch)
+    agent_options = {"decision_mode": args.decision, "lazy_context": not args.eager_context,
+                     "hierarchical_memory": not args.flat_memory}
+    if args.max_parallelism is not None:
+        agent_options["max_parallelism"] = args.max_parallelism
+    if args.trace_allocations:
+        tracemalloc.start()
+    results = run_suite(args.scenarios, args.ticks, args.memory_sizes, args.http, seed=args.seed,
+                        latency=args.latency, max_seconds=args.max_seconds, stimulus_mode=args.stimulus,
+                        slow_fraction=args.slow_fraction, agent_options=agent_options,
+                        memory_profile_every=args.memory_profile, semantic_cache=args.semantic_cache,
+                        minimize_prompts=args.minimize_prompts, llm_capacity=args.llm_capacity,
+                        background_load=args.background_load, background_priority=args.background_priority)
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.trace:
+        Tracer.disable_tracing().export(args.trace)
+        print(f"Trace written to {args.trace}")
+
+    for module, measurement in results["meta"]["import_times"].items():
+        print(f"import {module}: {measurement['ms']:.1f}ms")
+
+    regressions = []
+    if args.import_budget is not None:
+        regressions += check_import_budget(results["meta"]["import_times"], args.import_budget)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions += compare_results(results, json.load(baseline_file), args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Insertion ordered collections of context and information objects with constant time membership.
+
+Context and Information objects compare by identity, and information is interned (see Information_Table) so a value
+is always the same object. A dictionary keyed by the objects keeps them in the order they were first added and answers
+'in' without a scan, so building a collection stays linear in its size where 'if x not in some_list' is quadratic.
+"""
+
+
+class OrderedSet:
+    """
+    Objects in the order they were first added, each once
+    """
+
+    def __init__(self, items=()):
+        self._items = dict.fromkeys(items)
+
+    def add(self, item):
+        """
+        :return: True if the item wasn't in the set yet
+        """
+        if item in self._items:
+            return False
+        self._items[item] = None
+        return True
+
+    def update(self, items):
+        """
+        Add every item not in the set yet, keeping the position of the ones already in it
+        :param items: Any iterable
+        :return: Nothing
+        """
+        self._items.update(dict.fromkeys(items))
+
+    def union(self, items):
+        """
+        :return: New set of this set's items followed by the items not in it yet
+        """
+        union = type(self)(self._items)
+        union.update(items)
+        return union
+
+    def to_list(self):
+        return list(self._items)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __or__(self, items):
+        return self.union(items)
+
+    def __ior__(self, items):
+        self.update(items)
+        return self
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self._items)})"
+
+
+class ContextSet(OrderedSet):
+    """
+    Context objects in the order they were first added
+    """
+
+
+class InformationSet(OrderedSet):
+    """
+    Information objects in the order they were first added
+    """
+
+    def values(self):
+        """
+        :return: List of the information values
+        """
+        return [information.value for information in self._items]
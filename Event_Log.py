@@ -0,0 +1,360 @@
+"""
+Append-only log of simulation events.
+
+Events are written as JSON lines into numbered segment files. Next to each segment is a binary index with one fixed
+size record per event (tick, byte offset, length, event type and agent), so finding tick N is a binary search over the
+memory-mapped index and reading it is a slice of the memory-mapped segment. Filtered scans by event type or agent only
+look at index records and parse just the matching lines, and tail() follows the log as it is written. Nothing is
+loaded into memory beyond the events being returned, so a million tick run can be queried as cheaply as a short one.
+
+    python Event_Log.py simulation_log --tick 42
+    python Event_Log.py simulation_log --type agent --agent cheese --start 100 --end 200
+    python Event_Log.py simulation_log --tail
+"""
+
+import argparse
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+_SEGMENT_BYTES = 64 * 1024 * 1024  # A new segment is started once the current one is larger than this
+_SEGMENT_NAME = "segment-{:06d}.jsonl"
+_INDEX_NAME = "segment-{:06d}.idx"
+_NAMES_FILE = "names.json"
+# Index record: tick, offset of the line in the segment, length of the line, event type id, agent id
+_INDEX_RECORD = struct.Struct("<qQIHH")
+_NO_AGENT = 0  # Agent id of events that don't belong to an agent
+_TAIL_POLL_SECONDS = 0.2
+_INDEX_BUFFER_BYTES = 64 * 1024  # Index records are held back until the lines they point at are flushed
+
+
+class _Segment:
+    """
+    A segment file and its index, memory-mapped for reading. Reads use the current maps without looking at the files,
+    the index is only remapped by refresh() and the segment when a read goes past its end
+    """
+
+    def __init__(self, directory, number):
+        self.number = number
+        self.path = os.path.join(directory, _SEGMENT_NAME.format(number))
+        self.index_path = os.path.join(directory, _INDEX_NAME.format(number))
+        self._data = self._index = None
+        self._data_size = self._index_size = 0
+
+    def __len__(self):
+        return self._index_size // _INDEX_RECORD.size
+
+    def _map(self, path, current, current_size):
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size == current_size:
+            return current, size
+        if current is not None:
+            current.close()
+        if size == 0:
+            return None, 0
+        with open(path, "rb") as mapped_file:
+            return mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ), size
+
+    def refresh(self):
+        """
+        Remap the index if the file has grown, so the events appended since are seen
+        """
+        self._index, self._index_size = self._map(self.index_path, self._index, self._index_size)
+
+    def record(self, position):
+        """
+        :return: (tick, offset, length, type id, agent id) of the event at a position in this segment
+        """
+        return _INDEX_RECORD.unpack_from(self._index, position * _INDEX_RECORD.size)
+
+    def first_tick(self):
+        return self.record(0)[0] if len(self) else None
+
+    def find_tick(self, tick):
+        """
+        :return: Position of the first event of the tick or the first later tick, len(self) if there is none
+        """
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.record(middle)[0] < tick:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def read(self, offset, length):
+        end = offset + length
+        if end > self._data_size:
+            self._data, self._data_size = self._map(self.path, self._data, self._data_size)
+        return json.loads(self._data[offset:end])
+
+    def close(self):
+        for mapped in (self._data, self._index):
+            if mapped is not None:
+                mapped.close()
+        self._data = self._index = None
+        self._data_size = self._index_size = 0
+
+
+class EventLog:
+    """
+    A directory of event segments. Open it for writing with EventLog(directory, writable=True)
+    """
+
+    def __init__(self, directory, writable=False, segment_bytes=_SEGMENT_BYTES):
+        self.directory = directory
+        self.writable = writable
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._data_file = self._index_file = None
+        self._data_offset = 0
+        self._pending_index = bytearray()
+        if writable:
+            os.makedirs(directory, exist_ok=True)
+        self._names = self._load_names()  # {"types": [...], "agents": [...]}, an id is a position in the list
+        self._segments = [_Segment(directory, number) for number in self._segment_numbers()]
+        if writable:
+            self._open_segment(self._segments[-1].number if self._segments else 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _segment_numbers(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(name[8:14]) for name in os.listdir(self.directory)
+                      if name.startswith("segment-") and name.endswith(".jsonl"))
+
+    def _load_names(self):
+        path = os.path.join(self.directory, _NAMES_FILE)
+        if os.path.exists(path):
+            with open(path) as names_file:
+                return json.load(names_file)
+        return {"types": [], "agents": [None]}
+
+    def _name_id(self, kind, name):
+        names = self._names[kind]
+        if name in names:
+            return names.index(name)
+        names.append(name)
+        path = os.path.join(self.directory, _NAMES_FILE)
+        with open(path + ".tmp", "w") as names_file:
+            json.dump(self._names, names_file)
+        os.replace(path + ".tmp", path)  # Readers never see a half written name table
+        return len(names) - 1
+
+    def _open_segment(self, number):
+        if self._data_file is not None:
+            self._flush()
+            self._data_file.close()
+            self._index_file.close()
+        segment = _Segment(self.directory, number)
+        if not self._segments or self._segments[-1].number != number:
+            self._segments.append(segment)
+        self._data_file = open(segment.path, "ab")
+        self._index_file = open(segment.index_path, "ab")
+        self._data_offset = self._data_file.tell()
+
+    def append(self, tick, event_type, data=None, agent=None):
+        """
+        Append an event. Ticks must not decrease
+
+        :param tick: Tick the event belongs to
+        :param event_type: Type of the event, e.g. 'world' or 'agent'
+        :param data: JSON serializable dictionary of event fields
+        :param agent: Optional name of the agent the event belongs to
+        :return: Nothing
+        """
+        if not self.writable:
+            raise RuntimeError(f"Event log {self.directory} is not open for writing")
+        event = {"tick": tick, "type": event_type, "agent": agent, "time": time.time()}
+        if data:
+            event.update(data)
+        line = (json.dumps(event, separators=(",", ":"), default=str) + "\n").encode()
+
+        with self._lock:
+            if self._data_offset and self._data_offset + len(line) > self.segment_bytes:
+                self._open_segment(self._segments[-1].number + 1)
+            type_id = self._name_id("types", event_type)
+            agent_id = _NO_AGENT if agent is None else self._name_id("agents", agent)
+            self._data_file.write(line)
+            self._pending_index += _INDEX_RECORD.pack(tick, self._data_offset, len(line), type_id, agent_id)
+            self._data_offset += len(line)
+            if len(self._pending_index) >= _INDEX_BUFFER_BYTES:
+                self._flush()
+
+    def flush(self):
+        """
+        Make every appended event visible to readers
+        """
+        with self._lock:
+            if self._data_file is not None:
+                self._flush()
+
+    def _flush(self):
+        # The data is flushed before the index, so a reader never finds an index record for a line that isn't there yet
+        self._data_file.flush()
+        self._index_file.write(self._pending_index)
+        self._index_file.flush()
+        self._pending_index = bytearray()
+
+    def close(self):
+        with self._lock:
+            if self._data_file is not None:
+                self._flush()
+                self._data_file.close()
+                self._index_file.close()
+                self._data_file = self._index_file = None
+        for segment in self._segments:
+            segment.close()
+
+    def _sync(self):
+        if self.writable:
+            self.flush()
+        self._refresh()
+
+    def _refresh(self):
+        """
+        Pick up segments and names a writer in another process has added since we opened the log, and the events
+        appended to the segments we know. Queries call this once, never per event
+        """
+        if not self.writable:
+            known = {segment.number for segment in self._segments}
+            for number in self._segment_numbers():
+                if number not in known:
+                    self._segments.append(_Segment(self.directory, number))
+            self._names = self._load_names()
+        for segment in self._segments:
+            segment.refresh()
+
+    def _ids(self, kind, name):
+        if name is None:
+            return None
+        names = self._names[kind]
+        return {names.index(name)} if name in names else set()
+
+    def read_tick(self, tick):
+        """
+        :param tick: Tick number
+        :return: List of the events of the tick
+        """
+        return list(self.scan(start_tick=tick, end_tick=tick + 1))
+
+    def scan(self, event_type=None, agent=None, start_tick=None, end_tick=None):
+        """
+        Iterate over events in the order they were written
+
+        :param event_type: Optional event type to filter on
+        :param agent: Optional agent name to filter on
+        :param start_tick: Optional first tick
+        :param end_tick: Optional tick to stop before
+        :return: Generator of event dictionaries
+        """
+        self._sync()
+        type_ids = self._ids("types", event_type)
+        agent_ids = self._ids("agents", agent)
+
+        segments = self._segments
+        first = 0
+        if start_tick is not None:  # Skip whole segments that end before start_tick
+            first_ticks = [segment.first_tick() for segment in segments]
+            first_ticks = [tick if tick is not None else float("inf") for tick in first_ticks]
+            first = max(bisect.bisect_right(first_ticks, start_tick) - 1, 0)
+
+        for segment in segments[first:]:
+            position = segment.find_tick(start_tick) if start_tick is not None else 0
+            for position in range(position, len(segment)):
+                tick, offset, length, type_id, agent_id = segment.record(position)
+                if end_tick is not None and tick >= end_tick:
+                    return
+                if (type_ids is None or type_id in type_ids) and (agent_ids is None or agent_id in agent_ids):
+                    yield segment.read(offset, length)
+
+    def tail(self, event_type=None, agent=None, from_start=False, stop=None, poll_seconds=_TAIL_POLL_SECONDS):
+        """
+        Follow the log, yielding events as they are written
+
+        :param event_type: Optional event type to filter on
+        :param agent: Optional agent name to filter on
+        :param from_start: Yield the events already in the log first, otherwise only new ones
+        :param stop: Optional threading.Event that ends the generator once set
+        :param poll_seconds: How often to check for new events
+        :return: Generator of event dictionaries
+        """
+        self._refresh()
+        segment_index, position = 0, 0
+        if not from_start and self._segments:
+            segment_index, position = len(self._segments) - 1, len(self._segments[-1])
+
+        while stop is None or not stop.is_set():
+            self._refresh()
+            type_ids = self._ids("types", event_type)
+            agent_ids = self._ids("agents", agent)
+            found = False
+            while segment_index < len(self._segments):
+                segment = self._segments[segment_index]
+                while position < len(segment):
+                    tick, offset, length, type_id, agent_id = segment.record(position)
+                    position += 1
+                    found = True
+                    if (type_ids is None or type_id in type_ids) and (agent_ids is None or agent_id in agent_ids):
+                        yield segment.read(offset, length)
+                if segment_index == len(self._segments) - 1:
+                    break
+                segment_index, position = segment_index + 1, 0
+            if not found:
+                time.sleep(poll_seconds)
+
+    def last_tick(self):
+        """
+        :return: Tick of the latest event, None for an empty log
+        """
+        self._sync()
+        for segment in reversed(self._segments):
+            if len(segment):
+                return segment.record(len(segment) - 1)[0]
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query a simulation event log")
+    parser.add_argument("directory", help="Event log directory")
+    parser.add_argument("--tick", type=int, help="Print the events of a single tick")
+    parser.add_argument("--type", help="Only events of this type")
+    parser.add_argument("--agent", help="Only events of this agent")
+    parser.add_argument("--start", type=int, help="First tick to print")
+    parser.add_argument("--end", type=int, help="Tick to stop before")
+    parser.add_argument("--tail", action="store_true", help="Keep printing events as they are written")
+    args = parser.parse_args(argv)
+
+    event_log = EventLog(args.directory)
+    if args.tick is not None:
+        events = (event for event in event_log.read_tick(args.tick)
+                  if args.type in (None, event["type"]) and args.agent in (None, event["agent"]))
+    elif args.tail:
+        events = event_log.tail(args.type, args.agent)
+    else:
+        events = event_log.scan(args.type, args.agent, args.start, args.end)
+
+    try:
+        for event in events:
+            print(json.dumps(event), flush=args.tail)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        event_log.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Information nodes and the table they are interned in.
+
+Kept apart from State_Control so the world (World_Generator) can intern information without importing the agent.
+"""
+
+import re
+import threading
+import weakref
+
+# Canonicalize information values loosely (case, whitespace, punctuation, light stemming) when interning them
+_FUZZY_CANONICALIZATION = False
+
+
+class Information:
+    """
+    Information is constructed of context (list of links to other information).
+    Information can be created, processed, and manipulated by both an agent and the world.
+    The world can only create information that has no context.
+    An agent can only create information that has context.
+    """
+
+    def __init__(self, information, context_of_information=None):
+        if context_of_information is None:
+            context_of_information = []
+        self.value = information  # A string of any information
+        self._context_of_information = context_of_information  # A list of keys for other information that provides context
+        self._context_resolver = None  # ContextResolver that provides the context once it is read, see defer_context
+
+    @property
+    def context_of_information(self):
+        resolver = self._context_resolver
+        if resolver is not None:
+            context_of_information = resolver.resolve(self)
+            if context_of_information is None:  # We are being resolved further up the stack, use what we had
+                return self._context_of_information
+            if self._context_resolver is resolver:
+                self._context_of_information = context_of_information
+                self._context_resolver = None
+        return self._context_of_information
+
+    @context_of_information.setter
+    def context_of_information(self, context_of_information):
+        self._context_of_information = context_of_information
+        self._context_resolver = None
+
+    def defer_context(self, resolver):
+        """
+        Let a resolver provide our context the first time it is read. Until then reading it costs nothing
+        :param resolver: ContextResolver
+        """
+        self._context_resolver = resolver
+
+    @property
+    def context_resolved(self):
+        return self._context_resolver is None
+
+    def __str__(self):
+        return self.value
+
+
+class InformationTable:
+    """
+    Intern table mapping normalized information values to a single canonical Information object, so the same text is
+    only stored once and anything keyed by Information objects keeps hitting across ticks.
+    Entries are weak, information nothing else refers to anymore is dropped from the table.
+    Only context-free information (what the world provides) is interned. Information an agent creates with its own
+    context is a new Information object of that agent's, never merged into a canonical node.
+    """
+    _WHITESPACE = re.compile(r"\s+")
+    _PUNCTUATION = re.compile(r"[^\w\s]")
+
+    def __init__(self, fuzzy=_FUZZY_CANONICALIZATION):
+        self.fuzzy = fuzzy
+        self._table = weakref.WeakValueDictionary()  # Normalized value -> Information object
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._table)
+
+    def __contains__(self, value):
+        return self.normalize(value) in self._table
+
+    def normalize(self, value):
+        """
+        :param value: An information string
+        :return: The key the value is interned under
+        """
+        value = self._WHITESPACE.sub(" ", value.strip().strip("'\"").strip())
+        if not self.fuzzy:
+            return value
+
+        words = self._PUNCTUATION.sub("", value.lower()).split()
+        return " ".join(self._stem(word) for word in words)
+
+    @staticmethod
+    def _stem(word):
+        """
+        Very light suffix stripping, just enough for plurals and simple verb forms to meet
+        """
+        if len(word) <= 4:
+            return word
+        if word.endswith("ies"):
+            return word[:-3] + "y"
+        if word.endswith("ing") and len(word) > 5:
+            return word[:-3]
+        if word.endswith("ed"):
+            return word[:-2]
+        if word.endswith(("sses", "xes", "ches", "shes", "zes")):
+            return word[:-2]
+        if word.endswith("s") and not word.endswith("ss"):
+            return word[:-1]
+        return word
+
+    def intern(self, value):
+        """
+        Get the canonical Information object for a value, creating it if this is the first time we have seen it
+
+        :param value: A context-free information string
+        :return: Information object
+        """
+        key = self.normalize(value)
+        with self._lock:
+            information = self._table.get(key)
+            if information is None:
+                information = Information(value.strip().strip("'\"").strip())
+                self._table[key] = information
+            return information
+
+
+_INFORMATION_TABLE = InformationTable()
+
+
+def intern_information(value):
+    """
+    Every context-free Information object should be created through here, see InformationTable.intern
+    """
+    return _INFORMATION_TABLE.intern(value)
+
+
+def reset_information_table(fuzzy=_FUZZY_CANONICALIZATION):
+    """
+    Start a new, empty intern table
+    :param fuzzy: Whether the new table canonicalizes values loosely
+    :return: The new InformationTable
+    """
+    global _INFORMATION_TABLE
+    _INFORMATION_TABLE = InformationTable(fuzzy)
+    return _INFORMATION_TABLE
+
+
+def get_information_table():
+    return _INFORMATION_TABLE
@@ -7,58 +7,792 @@
 
 
 """
-import openai
+import contextvars
+import itertools
 import json
+import math
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+
+from LLM_Scheduler import get_current_priority, get_current_tenant
+from LLM_Tools import get_tool_registry, register_tool  # register_tool is re-exported for callers
+from LLM_Transport import CancelToken, PooledTransport, ResponseObject, TransportError, cancellable
+from Prompt_Assembler import count_tokens
+from Prompt_Templates import render_prompt
+from Semantic_Cache import SemanticCache
+from Tracer import span, tracing_enabled
 
 _LLM_MODEL = "gpt-3.5-turbo"
 _RETRIES = 3
 # TODO Make this a file read instead of harcdcoded TODO TODO
-openai.api_key = ""
+_OPENAI_API_KEY = ""
 
 _GET_RESPONSE_CONTENT = ""
 
+# Model used by each tier. Call sites are routed to a tier instead of a model so tiers can be swapped in one place
+_MODEL_TIERS = {
+    "fast": _LLM_MODEL,
+    "strong": "gpt-4-turbo",
+}
+# Tier used by each call site. A route with 'escalate_to' is a cascade: when cascading is enabled the call is first
+# made on 'tier' and only repeated on 'escalate_to' if the response fails the route's validator or its confidence
+# (mean token probability, only available from backends that return logprobs) is below 'min_confidence'.
+# Routes with a 'similarity' are idempotent, and while the semantic cache is enabled a cached response is reused for a
+# prompt whose key is at least that similar (cosine, see Semantic_Cache). Routes with 'verdict' answer with a single
+# verdict (yes or no, a category), and an audited cache hit agrees with the fresh answer only if the verdicts are equal.
+# A route's 'priority' is the class its calls queue in while an LLM scheduler is set (see LLM_Scheduler), foreground
+# when missing. Work off the tick's critical path is background so it never delays the calls a tick waits on.
+# A call site without a route of its own uses the route of the part before its first '.', e.g. 'batch.relevance' uses
+# 'batch'
+_MODEL_ROUTES = {
+    "default": {"tier": "fast"},
+    "category": {"tier": "fast", "validator": "single_word", "similarity": 0.9, "verdict": True},
+    "relevance": {"tier": "fast", "validator": "yes_no", "similarity": 0.92, "verdict": True},
+    "contextualize": {"tier": "fast", "validator": "not_empty"},
+    "compress": {"tier": "fast", "validator": "not_empty"},
+    "generate_responses": {"tier": "fast", "escalate_to": "strong", "validator": "list"},
+    "choose_response": {"tier": "fast", "escalate_to": "strong", "validator": "not_empty"},
+    "decide": {"tier": "fast", "escalate_to": "strong", "validator": "json_object"},
+    "world_next_state": {"tier": "fast", "validator": "not_empty"},
+    "world_parse": {"tier": "fast", "escalate_to": "strong", "validator": "list"},
+    "batch": {"tier": "fast", "validator": "json_object"},
+}
+# Cascading is opt in (set_cascade_enabled), escalated calls cost the strong tier's price
+_CASCADE_ENABLED = False
+# Number of recent latencies kept per route for percentiles
+_ROUTE_LATENCY_WINDOW = 256
+
+# Request hedging. When enabled, a call still running after the _HEDGE_PERCENTILE latency of single attempts on its
+# route and tier is sent a second time and whichever response arrives first is used. The loser is cancelled if it
+# hasn't started and aborted if it has (only the pooled transport can abort a request in flight, see
+# LLM_Transport.CancelToken). With an LLM scheduler set, a hedge is only sent when a slot is free for it, and that
+# slot is held until both copies have finished
+_HEDGING_ENABLED = False
+_HEDGE_PERCENTILE = 95
+_HEDGE_MIN_SAMPLES = 20  # Latency samples a route needs before its calls are hedged
+_HEDGE_BUDGET = 0.05  # Maximum fraction of calls that may be hedged
+_HEDGE_MAX_WORKERS = 64
+# Circuit breaker. Hedging adds load, so it stops for _HEDGE_BREAKER_COOLDOWN seconds once more than
+# _HEDGE_BREAKER_FAILURE_RATE of the last _HEDGE_BREAKER_WINDOW calls needed retries (timeouts, rate limits, ...)
+_HEDGE_BREAKER_WINDOW = 50
+_HEDGE_BREAKER_FAILURE_RATE = 0.2
+_HEDGE_BREAKER_COOLDOWN = 30.0
+
+# Query packing (LlmQuery.batch). Small independent queries sharing a system prompt are sent as the numbered tasks of
+# one request, up to _BATCH_TOKEN_BUDGET tokens of tasks and _BATCH_MAX_TASKS tasks per request. When disabled every
+# query is sent on its own
+_BATCHING_ENABLED = True
+_BATCH_TOKEN_BUDGET = 1500
+_BATCH_MAX_TASKS = 20
+_BATCH_ANSWER_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+# 'yes' or 'no' as a word of their own, not inside 'not', 'know' or 'nothing'
+_YES_NO_PATTERN = re.compile(r"\b(yes|no)\b", re.IGNORECASE)
+
+# SemanticCache used for the routes with a 'similarity', None while the semantic cache is disabled
+_SEMANTIC_CACHE = None
+
+# Scheduler every call that reaches the backend queues through, e.g. LLM_Scheduler.FairScheduler, None to call at once
+_LLM_SCHEDULER = None
+
+# Optional replacement for openai.ChatCompletion.create, e.g. a deterministic local stand-in for benchmarking.
+# Called as backend(model=, messages=, tools=, tool_choice=, call_site=, **request_options) and must return an object
+# shaped like an OpenAI chat completion response.
+_LLM_BACKEND = None
+# Callables run after every successful LLM call as observer(call_site, messages, response, elapsed_seconds)
+_LLM_OBSERVERS = []
+# Requests currently waiting on the backend, request id -> (call site, model, start time)
+_IN_FLIGHT = {}
+_IN_FLIGHT_LOCK = threading.Lock()
+_IN_FLIGHT_IDS = itertools.count()
+# The openai library, imported on first use. It's slow to import and isn't needed at all when a backend is set
+openai = None
+
+
+class _NeverRaised(Exception):
+    """
+    Stands in for the openai error types while openai isn't imported, so their except clauses match nothing
+    """
+
+
+class _NoOpenAIErrors:
+    Timeout = APIError = APIConnectionError = InvalidRequestError = _NeverRaised
+    AuthenticationError = PermissionError = RateLimitError = _NeverRaised
+
+
+def _get_openai():
+    global openai
+    if openai is None:
+        import openai as openai_module
+        openai_module.api_key = _OPENAI_API_KEY
+        openai = openai_module
+    return openai
+
+
+def set_llm_backend(backend):
+    """
+    Replace the backend used for every LLM call
+    :param backend: Callable with the same keywords as openai.ChatCompletion.create plus call_site, None for openai
+    :return: The previous backend
+    """
+    global _LLM_BACKEND
+    previous_backend = _LLM_BACKEND
+    _LLM_BACKEND = backend
+    return previous_backend
+
+
+def set_llm_scheduler(scheduler):
+    """
+    Queue the calls that reach the backend (not semantic cache hits) through a scheduler, charged to the current tenant
+    :param scheduler: Object with a slot(tenant, call_site) context manager, e.g. LLM_Scheduler.FairScheduler. None
+    makes calls without queuing
+    :return: The previous scheduler
+    """
+    global _LLM_SCHEDULER
+    previous_scheduler = _LLM_SCHEDULER
+    _LLM_SCHEDULER = scheduler
+    return previous_scheduler
+
+
+def use_pooled_transport(base_url=None, api_key=None, pool_size=None, http2=False, call_site_timeouts=None,
+                         send_call_site=False):
+    """
+    Send every LLM call through a pooled keep-alive transport instead of the openai library's global session
+
+    :param base_url: Base URL of the OpenAI compatible API, defaults to openai.api_base
+    :param api_key: API key, defaults to openai.api_key
+    :param pool_size: Maximum number of connections kept open
+    :param http2: Use HTTP/2 if httpx is installed
+    :param call_site_timeouts: Dictionary of call site -> (connect timeout, read timeout) overrides
+    :param send_call_site: Name the call site of each request in an X-Call-Site header
+    :return: The PooledTransport, see PooledTransport.get_health for connection health
+    """
+    transport_options = {"http2": http2, "call_site_timeouts": call_site_timeouts, "send_call_site": send_call_site}
+    if pool_size is not None:
+        transport_options["pool_size"] = pool_size
+    if base_url is None or api_key is None:
+        base_url = base_url or _get_openai().api_base
+        api_key = api_key if api_key is not None else _get_openai().api_key
+    transport = PooledTransport(base_url, api_key, **transport_options)
+    set_llm_backend(transport)
+    return transport
+
+
+def add_llm_observer(observer):
+    _LLM_OBSERVERS.append(observer)
+
+
+def remove_llm_observer(observer):
+    if observer in _LLM_OBSERVERS:
+        _LLM_OBSERVERS.remove(observer)
+
+
+def get_in_flight_calls():
+    """
+    :return: List of (call site, model, seconds waited so far) of the requests currently waiting on the backend
+    """
+    now = time.perf_counter()
+    with _IN_FLIGHT_LOCK:
+        calls = list(_IN_FLIGHT.values())
+    return [(call_site, model, now - start) for call_site, model, start in calls]
+
+
+class RouteStats:
+    """
+    Latency and escalation statistics of a single call site. Updated by concurrent stage and hedge threads
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.escalations = 0
+        self.latency_total = 0.0
+        self.latencies = deque(maxlen=_ROUTE_LATENCY_WINDOW)  # Most recent latencies in seconds, escalations included
+        # Tier -> most recent latencies of single attempts on the tier, what hedge delays are based on
+        self.attempt_latencies = {}
+        self.calls_by_tier = {}
+        self._lock = threading.Lock()
+
+    def record(self, tier, elapsed):
+        with self._lock:
+            self.calls += 1
+            self.latency_total += elapsed
+            self.latencies.append(elapsed)
+            self.calls_by_tier[tier] = self.calls_by_tier.get(tier, 0) + 1
+
+    def record_attempt(self, tier, elapsed):
+        """
+        Record the latency of one attempt on a tier, a call that escalates makes two
+        """
+        with self._lock:
+            if tier not in self.attempt_latencies:
+                self.attempt_latencies[tier] = deque(maxlen=_ROUTE_LATENCY_WINDOW)
+            self.attempt_latencies[tier].append(elapsed)
+
+    def record_escalation(self):
+        with self._lock:
+            self.escalations += 1
+
+    def percentile(self, percent, min_samples=1, tier=None):
+        """
+        :param percent: Percentile between 0 and 100
+        :param min_samples: Fewest latencies in the window the percentile is computed from
+        :param tier: Optional tier whose attempt latencies are used instead of the whole calls'
+        :return: Latency in seconds at the percentile of the recent window, None if there are fewer samples
+        """
+        with self._lock:
+            latencies = list(self.latencies if tier is None else self.attempt_latencies.get(tier, ()))
+        if len(latencies) < max(1, min_samples):
+            return None
+        latencies.sort()
+        return latencies[min(len(latencies) - 1, math.ceil(percent / 100 * len(latencies)) - 1)]
+
+    def to_dict(self):
+        with self._lock:
+            calls, escalations, latency_total = self.calls, self.escalations, self.latency_total
+            calls_by_tier = dict(self.calls_by_tier)
+            tiers = list(self.attempt_latencies)
+        return {
+            "calls": calls,
+            "calls_by_tier": calls_by_tier,
+            "escalations": escalations,
+            "escalation_rate": escalations / calls if calls else 0.0,
+            "mean_latency": latency_total / calls if calls else 0.0,
+            "p50_latency": self.percentile(50),
+            "p95_latency": self.percentile(95),
+            "p95_attempt_latency_by_tier": {tier: self.percentile(95, tier=tier) for tier in tiers},
+        }
+
+
+_ROUTE_STATS = {}  # Call site -> RouteStats
+_ROUTE_STATS_LOCK = threading.Lock()
+
+
+def set_model_tier(tier, model):
+    _MODEL_TIERS[tier] = model
+
+
+def set_model_route(call_site, tier, escalate_to=None, validator=None, min_confidence=None, similarity=None,
+                    priority=None, verdict=False):
+    """
+    Route a call site to a model tier
+
+    :param call_site: Name of the call site, e.g. 'category'
+    :param tier: Tier the call is made on first
+    :param escalate_to: Optional tier the call is repeated on if the first response is not good enough
+    :param validator: Name of a validator in _VALIDATORS or a callable taking the response text and returning a bool
+    :param min_confidence: Optional minimum mean token probability before escalating
+    :param similarity: Optional minimum similarity of a semantic cache hit, only for idempotent call sites
+    :param priority: Optional priority class of the call site's calls, e.g. 'background'
+    :param verdict: The call site answers with a verdict, audited semantic cache hits compare verdicts
+    :return: Nothing
+    """
+    route = {"tier": tier}
+    if escalate_to is not None:
+        route["escalate_to"] = escalate_to
+    if validator is not None:
+        route["validator"] = validator
+    if min_confidence is not None:
+        route["min_confidence"] = min_confidence
+    if similarity is not None:
+        route["similarity"] = similarity
+    if priority is not None:
+        route["priority"] = priority
+    if verdict:
+        route["verdict"] = True
+    _MODEL_ROUTES[call_site] = route
+
+
+def set_cascade_enabled(enabled):
+    global _CASCADE_ENABLED
+    _CASCADE_ENABLED = enabled
+
+
+def set_batching_enabled(enabled):
+    global _BATCHING_ENABLED
+    _BATCHING_ENABLED = enabled
+
+
+def enable_semantic_cache(cache=None):
+    """
+    Reuse responses of similar prompts on the routes with a 'similarity'
+    :param cache: Optional SemanticCache, a new one with the default size and audit rate by default
+    :return: The SemanticCache, see SemanticCache.get_stats for hit and false hit rates
+    """
+    global _SEMANTIC_CACHE
+    _SEMANTIC_CACHE = cache if cache is not None else SemanticCache()
+    return _SEMANTIC_CACHE
+
+
+def disable_semantic_cache():
+    global _SEMANTIC_CACHE
+    _SEMANTIC_CACHE = None
+
+
+def get_semantic_cache_stats():
+    """
+    :return: Hit and audit statistics of the semantic cache, None while it is disabled
+    """
+    cache = _SEMANTIC_CACHE
+    return cache.get_stats() if cache is not None else None
+
+
+def get_route(call_site):
+    route = _MODEL_ROUTES.get(call_site)
+    if route is None and "." in call_site:
+        route = _MODEL_ROUTES.get(call_site.split(".", 1)[0])
+    return route if route is not None else _MODEL_ROUTES["default"]
+
+
+def get_route_stats():
+    """
+    :return: Dictionary of call site -> latency and escalation statistics
+    """
+    with _ROUTE_STATS_LOCK:
+        return {call_site: stats.to_dict() for call_site, stats in sorted(_ROUTE_STATS.items())}
+
+
+def reset_route_stats():
+    with _ROUTE_STATS_LOCK:
+        _ROUTE_STATS.clear()
+
+
+def _get_route_stats(call_site):
+    with _ROUTE_STATS_LOCK:
+        if call_site not in _ROUTE_STATS:
+            _ROUTE_STATS[call_site] = RouteStats()
+        return _ROUTE_STATS[call_site]
+
+
+class HedgeController:
+    """
+    Keeps hedging within its budget and trips a circuit breaker when the backend looks overloaded
+    """
+
+    def __init__(self):
+        self.calls = 0  # Calls that were eligible for hedging
+        self.hedges = 0
+        self.hedge_wins = 0  # Hedges that returned before the original call
+        self.budget_denials = 0
+        self.slot_denials = 0  # Hedges not sent because the LLM scheduler had no free slot
+        self.breaker_denials = 0
+        self.breaker_trips = 0
+        self._outcomes = deque(maxlen=_HEDGE_BREAKER_WINDOW)  # True for every recent call that needed a retry
+        self._breaker_open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record_outcome(self, failed):
+        with self._lock:
+            self._outcomes.append(failed)
+            if len(self._outcomes) == self._outcomes.maxlen and \
+                    sum(self._outcomes) / len(self._outcomes) > _HEDGE_BREAKER_FAILURE_RATE:
+                self._breaker_open_until = time.monotonic() + _HEDGE_BREAKER_COOLDOWN
+                self.breaker_trips += 1
+                self._outcomes.clear()
+
+    def record_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def record_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def record_slot_denial(self):
+        with self._lock:
+            self.slot_denials += 1
+
+    def try_hedge(self):
+        """
+        :return: True if a hedge may be sent now, the hedge is counted against the budget
+        """
+        with self._lock:
+            if time.monotonic() < self._breaker_open_until:
+                self.breaker_denials += 1
+                return False
+            if self.hedges + 1 > _HEDGE_BUDGET * self.calls:
+                self.budget_denials += 1
+                return False
+            self.hedges += 1
+            return True
+
+    @property
+    def breaker_open(self):
+        return time.monotonic() < self._breaker_open_until
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_rate": self.hedges / self.calls if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "budget_denials": self.budget_denials,
+                "slot_denials": self.slot_denials,
+                "breaker_denials": self.breaker_denials,
+                "breaker_trips": self.breaker_trips,
+                "breaker_open": self.breaker_open,
+            }
+
+
+_HEDGE_CONTROLLER = HedgeController()
+_HEDGE_EXECUTOR = None
+_HEDGE_EXECUTOR_LOCK = threading.Lock()
+
+
+def set_hedging_enabled(enabled):
+    global _HEDGING_ENABLED
+    _HEDGING_ENABLED = enabled
+
+
+def get_hedge_stats():
+    return _HEDGE_CONTROLLER.to_dict()
+
+
+def reset_hedge_stats():
+    global _HEDGE_CONTROLLER
+    _HEDGE_CONTROLLER = HedgeController()
+
+
+def _get_hedge_executor():
+    global _HEDGE_EXECUTOR
+    with _HEDGE_EXECUTOR_LOCK:
+        if _HEDGE_EXECUTOR is None:
+            _HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=_HEDGE_MAX_WORKERS, thread_name_prefix="llm-hedge")
+        return _HEDGE_EXECUTOR
+
+
+_VALIDATORS = {
+    "not_empty": lambda text: bool(text.strip()),
+    "single_word": lambda text: len(text.strip().strip(".").split()) == 1,
+    "yes_no": lambda text: _YES_NO_PATTERN.search(text) is not None,
+    "list": lambda text: len([item for item in text.split(",") if item.strip()]) > 1,
+    "json_object": lambda text: _is_json_object(text),
+}
+
 
-def _get_llm_response(messages, tools=None, tool_choice=None):
+def is_yes(text):
+    """
+    :param text: Answer to a yes or no question
+    :return: True if the first 'yes' or 'no' of the answer, as a word of its own, is 'yes'
+    """
+    match = _YES_NO_PATTERN.search(text or "")
+    return match is not None and match.group(1).lower() == "yes"
+
+
+def _is_json_object(text):
+    try:
+        return isinstance(json.loads(text[text.index("{"):text.rindex("}") + 1]), dict)
+    except ValueError:
+        return False
+
+
+def _response_acceptable(route, response):
+    """
+    Check a response against the validator and confidence threshold of its route
+    :return: True if the response does not need to be escalated
+    """
+    message = response.choices[0].message
+    if message.content is not None and not _text_acceptable(route, message.content):
+        return False
+
+    min_confidence = route.get("min_confidence")
+    if min_confidence is not None:
+        confidence = _get_confidence(response)
+        if confidence is not None and confidence < min_confidence:
+            return False
+
+    return True
+
+
+def _text_acceptable(route, text):
+    """
+    :return: True if the text passes the route's validator or the route has none
+    """
+    validator = route.get("validator")
+    if validator is None:
+        return True
+    if isinstance(validator, str):
+        validator = _VALIDATORS[validator]
+    return validator(text)
+
+
+def _get_confidence(response):
+    """
+    :return: Mean token probability of the response, None if the backend did not return logprobs
+    """
+    logprobs = getattr(response.choices[0], "logprobs", None)
+    tokens = getattr(logprobs, "content", None) if logprobs is not None else None
+    if not tokens:
+        return None
+    return math.exp(sum(token.logprob for token in tokens) / len(tokens))
+
+
+def _get_llm_response(messages, tools=None, tool_choice=None, call_site="default", semantic_key=None, priority=None):
     """
     Basic wrapper function for prompting and handling errors from LLM.
+    The model is picked by the call site's route, escalating to a stronger tier when the route cascades.
 
     :messages: A formatted 'messages' input for sending to LLM. See: https://platform.openai.com/docs/api-reference/messages
+    :call_site: Name of the part of the simulation making the call, used to pick the model and attribute metrics
+    :semantic_key: Text or tuple of texts the semantic cache compares prompts by, the last message by default
+    :priority: Priority class the call queues in, by default the current one (see LLM_Scheduler.priority_context) or
+    the route's
     :return: The LLM's response
     """
+    route = get_route(call_site)
+    priority = priority or get_current_priority() or route.get("priority")
+    cache = _SEMANTIC_CACHE
+    if cache is not None and tools is None and "similarity" in route:
+        return _get_cached_response(cache, messages, call_site, route, semantic_key, priority)
+    return _get_routed_response(messages, tools, tool_choice, call_site, route, priority)
+
+
+def _get_cached_response(cache, messages, call_site, route, semantic_key, priority):
+    """
+    Answer from the semantic cache when a similar prompt was answered before, otherwise make the call and cache it.
+    Audited hits make the call anyway and return the fresh response
+    """
+    namespace = _cache_namespace(messages, call_site)
+    key = semantic_key if semantic_key is not None else messages[-1]["content"]
+    with span(f"llm.cache.{call_site}", category="llm", call_site=call_site) as cache_span:
+        hit = cache.lookup(namespace, call_site, key, route["similarity"])
+        cache_outcome = "miss" if hit is None else "audit" if hit.audit else "hit"
+        cache_span.set(hit=hit is not None, cache=cache_outcome, similarity=hit.similarity if hit is not None else None)
+    if cache_outcome == "hit":
+        return hit.response
+    return _get_uncached_response(cache, messages, call_site, route, key, priority, hit)
+
+
+def _get_uncached_response(cache, messages, call_site, route, key, priority, hit):
+    """
+    Make a call the semantic cache was looked up for but didn't answer, and cache the response
+    :param hit: The audited CacheHit, whose audit is recorded, None on a miss
+    """
+    cache_outcome = "miss" if hit is None else "audit"
+    response = _get_routed_response(messages, None, None, call_site, route, priority, cache_outcome)
+    if hit is None or not cache.record_audit(hit, response.choices[0].message.content, route.get("verdict", False)):
+        cache.store(_cache_namespace(messages, call_site), key, response)
+    return response
+
+
+def _cache_namespace(messages, call_site):
+    # Only prompts of the same call site with the same leading (system) messages may answer each other
+    return (call_site,) + tuple((message["role"], message["content"]) for message in messages[:-1])
+
+
+def _get_routed_response(messages, tools, tool_choice, call_site, route, priority, cache_outcome="none"):
+    """
+    Make the call on the route's tier, escalating when the route cascades. With an LLM scheduler set the call first
+    queues for a slot in its priority class
+    :param cache_outcome: Why the semantic cache didn't answer, 'miss', 'audit' or 'none' when the call isn't cached
+    """
+    route_stats = _get_route_stats(call_site)
+    escalate_to = route.get("escalate_to") if _CASCADE_ENABLED else None
+    request_options = {"logprobs": True} if escalate_to is not None and "min_confidence" in route else {}
+
+    tier = route["tier"]
+    scheduler = _LLM_SCHEDULER
+    with scheduler.slot(get_current_tenant(), call_site, priority) if scheduler is not None else nullcontext():
+        start_time = time.perf_counter()  # After queuing, so the route's latencies (and hedge delays) are the backend's
+        response = _get_attempt_response(messages, tools, tool_choice, call_site, tier, request_options, route_stats,
+                                         cache_outcome, priority)
+        if escalate_to is not None and escalate_to != tier and not _response_acceptable(route, response):
+            route_stats.record_escalation()
+            tier = escalate_to
+            response = _get_attempt_response(messages, tools, tool_choice, call_site, tier, request_options,
+                                             route_stats, cache_outcome, priority)
+        elapsed = time.perf_counter() - start_time
+
+    route_stats.record(tier, elapsed)
+    return response
+
+
+def _get_attempt_response(messages, tools, tool_choice, call_site, tier, request_options, route_stats,
+                          cache_outcome="none", priority=None):
+    """
+    Make one attempt on a tier, recording its latency on its own so an escalation doesn't inflate the tier's hedge delay
+    """
+    start_time = time.perf_counter()
+    response = _get_hedged_response(messages, tools, tool_choice, call_site, tier, request_options, route_stats,
+                                    cache_outcome, priority)
+    route_stats.record_attempt(tier, time.perf_counter() - start_time)
+    return response
+
+
+def _get_hedged_response(messages, tools, tool_choice, call_site, tier, request_options, route_stats,
+                         cache_outcome="none", priority=None):
+    """
+    Make the call on a tier, sending a duplicate if it runs longer than the tier's hedge percentile of single attempts.
+    Both copies run in a copy of our context, so they keep the tenant, the priority and the parent span
+    """
+    hedge_delay = None
+    if _HEDGING_ENABLED:
+        hedge_delay = route_stats.percentile(_HEDGE_PERCENTILE, _HEDGE_MIN_SAMPLES, tier)
+    if hedge_delay is None:
+        return _get_tier_response(messages, tools, tool_choice, call_site, tier, request_options, cache_outcome)
+
+    hedge_controller = _HEDGE_CONTROLLER
+    hedge_controller.record_call()
+    executor = _get_hedge_executor()
+    request = (messages, tools, tool_choice, call_site, tier, request_options, cache_outcome)
+    primary_token = CancelToken()
+    primary = executor.submit(contextvars.copy_context().run, _get_cancellable_response, primary_token, request)
+    done, pending = wait([primary], timeout=hedge_delay)
+    if done:
+        return primary.result()
+
+    # Our own slot is released once we return, the loser may still be running then
+    scheduler = _LLM_SCHEDULER
+    hedge_slot = scheduler.try_acquire(get_current_tenant(), priority) if scheduler is not None else None
+    if scheduler is not None and hedge_slot is None:
+        hedge_controller.record_slot_denial()
+        return primary.result()
+    if not hedge_controller.try_hedge():
+        if hedge_slot is not None:
+            scheduler.release(*hedge_slot)
+        return primary.result()
+
+    with span(f"llm.hedge.{call_site}", category="llm", call_site=call_site, hedge_delay=hedge_delay):
+        hedge_token = CancelToken()
+        hedge = executor.submit(contextvars.copy_context().run, _get_cancellable_response, hedge_token, request)
+        if hedge_slot is not None:
+            _call_when_done([primary, hedge], lambda: scheduler.release(*hedge_slot))
+        pending = {primary, hedge}
+        winner = None
+        while pending and (winner is None or winner.exception() is not None):
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # Prefer a successful response, a failure only wins once both copies have failed
+            winner = min(done, key=lambda future: future.exception() is not None)
+
+    for future, token in ((primary, primary_token), (hedge, hedge_token)):
+        if future is not winner and not future.cancel():
+            token.cancel()
+    if winner is hedge and winner.exception() is None:
+        hedge_controller.record_win()
+    return winner.result()
+
+
+def _get_cancellable_response(token, request):
+    with cancellable(token):
+        return _get_tier_response(*request)
+
+
+def _call_when_done(futures, callback):
+    """
+    Call the callback once every future has finished or been cancelled
+    """
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            callback()
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def _get_tier_response(messages, tools, tool_choice, call_site, tier, request_options, cache_outcome="none"):
+    """
+    Make the call on the model of a tier, inside a trace span when tracing is enabled. The span records the
+    cache_outcome, see _get_routed_response
+    """
+    model = _MODEL_TIERS[tier]
+    if not tracing_enabled():
+        response, attempts = _request_llm_response(messages, tools, tool_choice, call_site, model, request_options)
+        _HEDGE_CONTROLLER.record_outcome(attempts > 1)
+        return response
+
+    prompt_text = "".join(message["content"] or "" for message in messages)
+    with span(f"llm.{call_site}", category="llm", call_site=call_site, model=model, tier=tier,
+              prompt_chars=len(prompt_text)) as llm_span:
+        response, attempts = _request_llm_response(messages, tools, tool_choice, call_site, model, request_options)
+        llm_span.set(retries=attempts - 1, cache=cache_outcome, **_get_token_counts(prompt_text, response))
+    _HEDGE_CONTROLLER.record_outcome(attempts > 1)
+
+    return response
+
+
+def _get_token_counts(prompt_text, response):
+    """
+    :return: Dictionary of prompt and response token counts, from the response's usage when the backend reports it
+    """
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return {"prompt_tokens": usage.prompt_tokens, "response_tokens": usage.completion_tokens}
+
+    token_counts = {"prompt_tokens": count_tokens(prompt_text), "response_tokens": 0}
+    if getattr(response, "choices", None):
+        token_counts["response_tokens"] = count_tokens(response.choices[0].message.content or "")
+    return token_counts
+
+
+def _request_llm_response(messages, tools, tool_choice, call_site, model, request_options):
+    """
+    Send the messages to the LLM backend, retrying recoverable errors
+    :return: (response, number of attempts made) tuple
+    """
     retry = _RETRIES
+    attempts = 0
     response = {}
+    errors = _get_openai().error if _LLM_BACKEND is None or openai is not None else _NoOpenAIErrors
     while retry:
         retry -= 1
+        attempts += 1
+        request_id = next(_IN_FLIGHT_IDS)
         try:
-            response = openai.ChatCompletion.create(model=_LLM_MODEL, messages=messages, tools=tools, tool_choice=tool_choice)
+            start_time = time.perf_counter()
+            with _IN_FLIGHT_LOCK:
+                _IN_FLIGHT[request_id] = (call_site, model, start_time)
+            if _LLM_BACKEND is not None:
+                response = _LLM_BACKEND(model=model, messages=messages, tools=tools, tool_choice=tool_choice,
+                                        call_site=call_site, **request_options)
+            else:
+                response = _get_openai().ChatCompletion.create(model=model, messages=messages, tools=tools,
+                                                             tool_choice=tool_choice, **request_options)
+            elapsed = time.perf_counter() - start_time
         # From https://help.openai.com/en/articles/6897213-openai-library-error-types-guidance
-        except openai.error.Timeout as e:
+        except errors.Timeout as e:
             # Retry if we still can
             print(f"OpenAI API request timed out: {e}")
             continue
 
-        except openai.error.APIError as e:
+        except errors.APIError as e:
             # Retry if we still can
             print(f"OpenAI API returned an API Error: {e}")
             continue
 
-        except openai.error.APIConnectionError as e:
-            # Raise error related to internet connection failure
-            raise RuntimeError(f"OpenAI API request failed to connect: {e}\n Messages: {messages}")
+        except errors.APIConnectionError as e:
+            # Retry if we still can, a single dead connection shouldn't end the run
+            print(f"OpenAI API request failed to connect: {e}")
+            continue
 
-        except openai.error.InvalidRequestError as e:
+        except TransportError as e:
+            if e.retryable:
+                # Retry if we still can
+                print(f"LLM transport error: {e}")
+                continue
+            raise RuntimeError(f"LLM transport error: {e}\n Messages: {messages}")
+
+        except errors.InvalidRequestError as e:
             # Raise error related to incorrect messages
             raise RuntimeError(f"InvalidRequestError: {e}\n Messages: {messages}")
 
-        except openai.error.AuthenticationError as e:
+        except errors.AuthenticationError as e:
             # Raise error related to Authentication problem
             raise RuntimeError(f"AuthenticationError: {e}\n Messages: {messages}")
 
-        except openai.error.PermissionError as e:
+        except errors.PermissionError as e:
             # Raise error related to permission problem
             raise RuntimeError(f"PermissionError: {e}\n Messages: {messages}")
 
-        except openai.error.RateLimitError as e:
+        except errors.RateLimitError as e:
             # Retry if we still can
             print(f"OpenAI RateLimitError hit: {e}\n Messages: {messages}")
             continue
@@ -67,8 +801,16 @@ def _get_llm_response(messages, tools=None, tool_choice=None):
             # Raise error for unexpected case
             raise RuntimeError(f"Unexpected Error hit during LLM query: {e}\n Messages: {messages}")
 
+        finally:
+            with _IN_FLIGHT_LOCK:
+                _IN_FLIGHT.pop(request_id, None)
+
+        for observer in _LLM_OBSERVERS:
+            observer(call_site, messages, response, elapsed)
+        break
+
     # TODO add check for tool_choice and if function call is forced ensure the response fits the required format
-    return response
+    return response, attempts
 
 
 class LlmQuery:
@@ -76,70 +818,206 @@ class LlmQuery:
     Class containing data for/from LLM responses
     """
 
-    def __init__(self, llm_role="system", user_role="user", llm_context="", user_input="", function_dict=None):
-        if function_dict is None:
-            function_dict = {}
+    def __init__(self, llm_role="system", user_role="user", llm_context="", user_input="", tool_names=None,
+                 tool_registry=None, call_site="default", semantic_key=None, priority=None):
+        self.call_site = call_site  # Which part of the simulation is asking, e.g. 'category' or 'world_next_state'
+        # Priority class of the call, e.g. 'background', by default the current one or the route's (see LLM_Scheduler)
+        self.priority = priority
+        # The parts of the prompt that vary, a string or a tuple of strings, e.g. the information being classified.
+        # The semantic cache compares prompts by it, so similar keys on the same call site and system prompt can share
+        # a response
+        self.semantic_key = semantic_key
         self.llm_role = llm_role
         self.user_role = user_role
         self.llm_context = llm_context
         self.user_input = user_input
-        self.function_dict = function_dict
+        self.tool_names = tool_names  # Tools offered by get_response_function, every registered tool if None
+        self.tool_registry = tool_registry if tool_registry is not None else get_tool_registry()
         self.response = ""
+        self.tool_results = []
 
     def get_response_text(self):
-        messages = [{"role": self.llm_role, "content": self.llm_context}, {"role": self.user_role, "content": self.user_input}]
-        self.response = _get_llm_response(messages)
+        messages = self.get_messages()
+        self.response = _get_llm_response(messages, call_site=self.call_site, semantic_key=self.semantic_key,
+                                          priority=self.priority)
         return self.response
 
     def get_response_function(self):
-        messages = [{"role": self.llm_role, "content": _GET_RESPONSE_CONTENT},
-                    {"role": self.user_role, "content": f"{self.user_input} Dictionary of functions: {self.function_dict}"}]
-        llm_function_helper_dict = {
-            'type': 'function',
-            'function': {
-                'name': '_llm_function_helper',
-                'description': 'You have to call this function. There is no other option.',
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        'function_choice': {
-                            'type': 'string',
-                            'description': 'Name of the function to call'
-                        },
-                        'parameter_dict': {
-                            'type': 'object',
-                            'description': 'An object where the keys are the names of the parameters used by the '
-                                           'function selected in function_choice and the values are the value for that '
-                                           'parameter name.'
-                        }
-
-                    },
-                    "required": ["function_choice", "parameter_dict"]
-
-                }
-
-            }
-        }
+        """
+        Let the LLM call one or more of the registered tools. The tool calls run concurrently
+
+        :return: List of ToolResult, one per tool call in the response
+        """
+        messages = [{"role": self.llm_role, "content": self.llm_context or _GET_RESPONSE_CONTENT},
+                    {"role": self.user_role, "content": self.user_input}]
+        tools = self.tool_registry.get_definitions(self.tool_names)
+
+        self.response = _get_llm_response(messages, tools=tools, tool_choice="auto", call_site=self.call_site,
+                                          priority=self.priority)
+
+        with span(f"tools.{self.call_site}", category="llm"):
+            self.tool_results = self.tool_registry.execute(self.response.choices[0].message.tool_calls)
+
+        return self.tool_results
+
+    def get_messages(self):
+        return [{"role": self.llm_role, "content": self.llm_context},
+                {"role": self.user_role, "content": self.user_input}]
+
+    @staticmethod
+    def batch(queries, token_budget=None, max_tasks=None):
+        """
+        Answer many small independent queries (get_response_text, not tool calls) with as few requests as possible.
+        Queries of the same call site and system prompt are packed as numbered tasks into requests of at most
+        token_budget tokens of tasks, the answers come back as one JSON object and are split out again. A sub-answer
+        that is missing or fails its call site's validator is asked again on its own. Identical queries are asked once
+
+        :param queries: List of LlmQuery objects
+        :param token_budget: Maximum tokens of tasks per request, _BATCH_TOKEN_BUDGET by default
+        :param max_tasks: Maximum tasks per request, _BATCH_MAX_TASKS by default
+        :return: The queries, each with its response set as if it had been asked on its own
+        """
+        token_budget = _BATCH_TOKEN_BUDGET if token_budget is None else token_budget
+        max_tasks = _BATCH_MAX_TASKS if max_tasks is None else max_tasks
+        if not _BATCHING_ENABLED:
+            for query in queries:
+                query.get_response_text()
+            return queries
+
+        # (call site, system message, priority) -> user input -> queries asking it
+        groups = {}
+        for query in queries:
+            group = groups.setdefault((query.call_site, query.llm_role, query.llm_context, query.user_role,
+                                       query.priority), {})
+            group.setdefault(query.user_input, []).append(query)
+
+        for (call_site, _, _, _, priority), group in groups.items():
+            pending = []  # (identical queries, audited CacheHit or None) of the queries the cache didn't answer
+            for same_queries in group.values():
+                hit = _lookup_cache(same_queries[0])
+                if hit is not None and not hit.audit:
+                    _share_response(same_queries, hit.response)
+                else:
+                    pending.append((same_queries, hit))
+            for chunk in _pack_tasks(pending, token_budget, max_tasks):
+                if len(chunk) == 1:
+                    _answer_alone(*chunk[0])
+                else:
+                    _answer_chunk(chunk, call_site, priority)
+        return queries
+
+
+def _share_response(same_queries, response):
+    for query in same_queries:
+        query.response = response
+
+
+def _answer_alone(same_queries, hit):
+    """
+    Ask identical queries on their own. Their semantic cache lookup was already made and isn't repeated
+    :param hit: The audited CacheHit of the lookup, None on a miss or when the query's route isn't cached
+    """
+    query = same_queries[0]
+    route = get_route(query.call_site)
+    cache = _SEMANTIC_CACHE
+    if cache is None or "similarity" not in route:
+        _share_response(same_queries, query.get_response_text())
+        return
+    priority = query.priority or get_current_priority() or route.get("priority")
+    key = query.semantic_key if query.semantic_key is not None else query.user_input
+    query.response = _get_uncached_response(cache, query.get_messages(), query.call_site, route, key, priority, hit)
+    _share_response(same_queries, query.response)
+
+
+def _lookup_cache(query):
+    """
+    Look a query up in the semantic cache, the way _get_cached_response does
+    :return: CacheHit, None on a miss or when the query's route isn't cached
+    """
+    route = get_route(query.call_site)
+    cache = _SEMANTIC_CACHE
+    if cache is None or "similarity" not in route:
+        return None
+    key = query.semantic_key if query.semantic_key is not None else query.user_input
+    return cache.lookup(_cache_namespace(query.get_messages(), query.call_site), query.call_site, key,
+                        route["similarity"])
 
-        self.response = _get_llm_response(messages, tools=[llm_function_helper_dict])
 
-        function_name = self.response.choices[0].message.tool_calls[0].function.name
-        arguments = self.response.choices[0].message.tool_calls[0].function.arguments
+def _pack_tasks(pending, token_budget, max_tasks):
+    """
+    Split pending tasks into chunks whose user inputs fit the token budget together
+    :param pending: List of (identical queries, CacheHit or None) tuples
+    :return: List of chunks, each a list of pending tasks
+    """
+    chunks, chunk, chunk_tokens = [], [], 0
+    for task in pending:
+        tokens = count_tokens(task[0][0].user_input)
+        if chunk and (chunk_tokens + tokens > token_budget or len(chunk) >= max_tasks):
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], 0
+        chunk.append(task)
+        chunk_tokens += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _answer_chunk(chunk, call_site, priority):
+    """
+    Ask a chunk of queries as the numbered tasks of one request and hand every valid sub-answer to its queries. The
+    queries without a valid sub-answer are asked on their own
+    """
+    first = chunk[0][0][0]
+    tasks = "\n\n".join(f"Task {number}:\n{same_queries[0].user_input}"
+                         for number, (same_queries, _) in enumerate(chunk, start=1))
+    llm_context, user_input = render_prompt("batch", system=first.llm_context, tasks=tasks)
+    messages = [{"role": first.llm_role, "content": llm_context}, {"role": first.user_role, "content": user_input}]
+    response = _get_llm_response(messages, call_site=f"batch.{call_site}", priority=priority)
+    answers = _parse_batch_answers(response.choices[0].message.content or "")
+
+    route = get_route(call_site)
+    for number, (same_queries, hit) in enumerate(chunk, start=1):
+        answer = answers.get(str(number))
+        if answer is None or not _text_acceptable(route, answer):
+            _answer_alone(same_queries, hit)
+            continue
+        sub_response = ResponseObject({"choices": [{"index": 0, "finish_reason": "stop",
+                                                     "message": {"role": "assistant", "content": answer}}]})
+        _share_response(same_queries, sub_response)
+        _store_in_cache(same_queries[0], hit, sub_response)
 
-        function_response = _llm_function_helper(function_name, arguments)
 
-        return function_response
+def _store_in_cache(query, hit, response):
+    """
+    Cache a sub-answer like _get_cached_response caches a response, recording the audit of an audited hit
+    """
+    route = get_route(query.call_site)
+    cache = _SEMANTIC_CACHE
+    if cache is None or "similarity" not in route:
+        return
+    if hit is None or not cache.record_audit(hit, response.choices[0].message.content, route.get("verdict", False)):
+        key = query.semantic_key if query.semantic_key is not None else query.user_input
+        cache.store(_cache_namespace(query.get_messages(), query.call_site), key, response)
 
 
-def _llm_function_helper(function_name, arguments):
+def _parse_batch_answers(text):
     """
-    Used as the function the LLM is forced to select when responding as a way of calling other functions
-
-    :param function_name: The name of the function to be called
-    :param arguments: A dictionary of the parameters to be used in the function
-    :return: Returns the result of whatever function is called
+    :param text: Response to a batch prompt, a JSON object of task number -> answer, possibly inside other text
+    :return: Dictionary of task number string -> answer text, empty if the response isn't a JSON object
     """
-    arguments = json.loads(arguments)
-    return_val = globals()[function_name](**arguments)  # Call the function
-
-    return return_val
\ No newline at end of file
+    match = _BATCH_ANSWER_PATTERN.search(text)
+    if match is None:
+        return {}
+    try:
+        answers = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    if not isinstance(answers, dict):
+        return {}
+    parsed = {}
+    for number, answer in answers.items():
+        if isinstance(answer, list):
+            answer = ", ".join(str(item) for item in answer)
+        if isinstance(answer, (str, int, float, bool)):
+            parsed[str(number).strip().lower().replace("task", "").strip()] = str(answer)
+    return parsed
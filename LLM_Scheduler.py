@@ -0,0 +1,344 @@
+"""
+Fair sharing of LLM capacity between tenants, e.g. the agents hosted by Agent_Service.
+
+At most 'capacity' LLM calls run at once. While every slot is busy, calls wait in a weighted fair queue (start-time fair
+queuing): a call's start tag is the later of the scheduler's virtual time and the finish tag of its tenant's previous
+call, its finish tag is one call later divided by the tenant's weight, and a freed slot goes to the waiting call with
+the smallest finish tag. While several tenants have calls waiting, each gets slots in proportion to its weight however
+many calls it queues, and a tenant that was idle gets no credit it could later use to crowd out the others.
+
+Every call also has a priority class. Foreground calls (the tick's critical path, e.g. choose_response) are always given
+a freed slot before background calls (memory compression, speculative world states), and background calls can never
+hold the last _FOREGROUND_RESERVE of the slots, so a foreground call arriving during heavy background work finds a free
+slot instead of waiting for background calls to finish. Background work is only deferred, a call that has started is
+never interrupted. A scheduler too small to spare a slot (capacity 1) reserves none: background calls may then hold the
+only slot, and a foreground call arriving meanwhile waits for it, though still ahead of every queued background call.
+
+The tenant and priority of a call are read from context variables set with tenant_context and priority_context.
+Stage_Executor runs stages in a copy of the caller's context, so the calls an agent's stages make are charged to the
+agent.
+"""
+
+import contextvars
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+_CAPACITY = 8  # LLM calls running at once across all tenants
+_DEFAULT_WEIGHT = 1.0
+_LATENCY_WINDOW = 256  # Most recent latencies kept per tenant for percentiles
+# Priority classes, most urgent first. A waiting call is given a slot before every waiting call of a later class
+_PRIORITY_CLASSES = ("foreground", "background")
+_DEFAULT_PRIORITY = "foreground"
+# Fraction of the capacity (at least one slot) calls of the later priority classes can never hold
+_FOREGROUND_RESERVE = 0.25
+
+_CURRENT_TENANT = contextvars.ContextVar("llm_tenant", default=None)
+_CURRENT_PRIORITY = contextvars.ContextVar("llm_priority", default=None)
+
+
+@contextmanager
+def tenant_context(tenant):
+    """
+    Charge the LLM calls made inside the block (and in stages it runs) to a tenant
+    :param tenant: Hashable tenant id, e.g. an agent id
+    """
+    token = _CURRENT_TENANT.set(tenant)
+    try:
+        yield
+    finally:
+        _CURRENT_TENANT.reset(token)
+
+
+def get_current_tenant():
+    """
+    :return: The tenant set by the innermost tenant_context, None outside of one
+    """
+    return _CURRENT_TENANT.get()
+
+
+@contextmanager
+def priority_context(priority):
+    """
+    Give the LLM calls made inside the block (and in stages it runs) a priority class, unless a call names its own
+    :param priority: One of _PRIORITY_CLASSES, e.g. 'background' for maintenance work
+    """
+    if priority not in _PRIORITY_CLASSES:
+        raise RuntimeError(f"Unknown LLM priority class '{priority}', expected one of {_PRIORITY_CLASSES}")
+    token = _CURRENT_PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        _CURRENT_PRIORITY.reset(token)
+
+
+def get_current_priority():
+    """
+    :return: The priority class set by the innermost priority_context, None outside of one
+    """
+    return _CURRENT_PRIORITY.get()
+
+
+def _percentile(samples, percent):
+    """
+    :return: Value at the percentile of the samples, None if there are none
+    """
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, math.ceil(percent / 100 * len(samples)) - 1)]
+
+
+class WaitStats:
+    """
+    Queue waits of the calls of a tenant or a priority class
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.in_flight = 0
+        self.queued = 0  # Calls waiting for a slot right now
+        self.wait_total = 0.0
+        self.waits = deque(maxlen=_LATENCY_WINDOW)  # Seconds the most recent calls waited for a slot
+
+    def record_wait(self, waited):
+        self.wait_total += waited
+        self.waits.append(waited)
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "mean_wait": self.wait_total / self.calls if self.calls else 0.0,
+            "p50_wait": _percentile(self.waits, 50),
+            "p95_wait": _percentile(self.waits, 95),
+        }
+
+
+class TenantStats(WaitStats):
+    """
+    Queue waits and request latency of a single tenant
+    """
+
+    def __init__(self, weight):
+        super().__init__()
+        self.weight = weight
+        self.requests = 0
+        self.request_latencies = deque(maxlen=_LATENCY_WINDOW)  # Seconds of the most recent requests
+
+    def to_dict(self):
+        return {
+            "weight": self.weight,
+            **super().to_dict(),
+            "requests": self.requests,
+            "p50_request_latency": _percentile(self.request_latencies, 50),
+            "p95_request_latency": _percentile(self.request_latencies, 95),
+        }
+
+
+class _Waiter:
+    def __init__(self, tenant, priority, start_tag):
+        self.tenant = tenant
+        self.priority = priority
+        self.start_tag = start_tag
+        self.granted = threading.Event()
+
+
+class FairScheduler:
+    """
+    Weighted fair queues of LLM calls, one per priority class, in front of a fixed number of slots
+    """
+
+    def __init__(self, capacity=_CAPACITY, default_weight=_DEFAULT_WEIGHT, foreground_reserve=_FOREGROUND_RESERVE):
+        """
+        :param capacity: LLM calls running at once, e.g. what the provider quota allows
+        :param default_weight: Weight of tenants that weren't given one with set_weight
+        :param foreground_reserve: Fraction of the capacity (at least one slot) calls of the later priority classes can
+            never hold. Background calls keep at least one slot, so with capacity 1 nothing is reserved
+        """
+        if capacity < 1:
+            raise RuntimeError(f"Scheduler capacity must be at least 1, not {capacity}")
+        self.capacity = capacity
+        self.default_weight = default_weight
+        background_limit = max(1, capacity - max(1, math.ceil(capacity * foreground_reserve)))
+        # Priority class -> slots its calls may hold at once
+        self.limits = {priority: capacity if rank == 0 else background_limit
+                       for rank, priority in enumerate(_PRIORITY_CLASSES)}
+        self.in_use = 0
+        # Priority class -> start tag of its latest call given a slot
+        self._virtual_times = {priority: 0.0 for priority in _PRIORITY_CLASSES}
+        # Priority class -> heap of (finish tag, sequence number, _Waiter)
+        self._queues = {priority: [] for priority in _PRIORITY_CLASSES}
+        self._finish_tags = {}  # (tenant, priority class) -> finish tag of the latest call
+        self._stats = {}  # Tenant -> TenantStats
+        self._class_stats = {priority: WaitStats() for priority in _PRIORITY_CLASSES}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def _get_stats(self, tenant):
+        if tenant not in self._stats:
+            self._stats[tenant] = TenantStats(self.default_weight)
+        return self._stats[tenant]
+
+    def set_weight(self, tenant, weight):
+        """
+        :param tenant: Tenant id
+        :param weight: Share of the capacity relative to the other tenants, 2 gets twice the calls of 1
+        """
+        if weight <= 0:
+            raise RuntimeError(f"Tenant weight must be positive, not {weight}")
+        with self._lock:
+            self._get_stats(tenant).weight = weight
+
+    @staticmethod
+    def _resolve(tenant, priority):
+        """
+        :return: (tenant, priority class) tuple, the current ones (see tenant_context and priority_context) by default
+        """
+        tenant = get_current_tenant() if tenant is None else tenant
+        if priority is None:
+            priority = get_current_priority() or _DEFAULT_PRIORITY
+        if priority not in _PRIORITY_CLASSES:
+            raise RuntimeError(f"Unknown LLM priority class '{priority}', expected one of {_PRIORITY_CLASSES}")
+        return tenant, priority
+
+    def _can_start(self, priority):
+        return self.in_use < self.capacity and self._class_stats[priority].in_flight < self.limits[priority]
+
+    def _can_start_now(self, priority):
+        """
+        :return: True if a call of the priority class may start without queuing, no call that should go first waits
+        """
+        ahead = _PRIORITY_CLASSES[:_PRIORITY_CLASSES.index(priority) + 1]
+        return self._can_start(priority) and not any(self._queues[waiting] for waiting in ahead)
+
+    def _charge(self, tenant, priority):
+        """
+        Count a call against its tenant's fair share. Call with _lock held
+        :return: (TenantStats, WaitStats of the priority class, start tag) tuple
+        """
+        stats, class_stats = self._get_stats(tenant), self._class_stats[priority]
+        start_tag = max(self._virtual_times[priority], self._finish_tags.get((tenant, priority), 0.0))
+        self._finish_tags[(tenant, priority)] = start_tag + 1.0 / stats.weight
+        stats.calls += 1
+        class_stats.calls += 1
+        return stats, class_stats, start_tag
+
+    def _start(self, tenant, priority, start_tag):
+        self.in_use += 1
+        self._virtual_times[priority] = max(self._virtual_times[priority], start_tag)
+        self._get_stats(tenant).in_flight += 1
+        self._class_stats[priority].in_flight += 1
+
+    def acquire(self, tenant=None, priority=None):
+        """
+        Wait for a slot
+        :param tenant: Tenant id, the current tenant by default
+        :param priority: Priority class, the current one or _DEFAULT_PRIORITY by default
+        :return: Seconds waited
+        """
+        tenant, priority = self._resolve(tenant, priority)
+        with self._lock:
+            stats, class_stats, start_tag = self._charge(tenant, priority)
+            if self._can_start_now(priority):
+                self._start(tenant, priority, start_tag)
+                stats.record_wait(0.0)
+                class_stats.record_wait(0.0)
+                return 0.0
+            waiter = _Waiter(tenant, priority, start_tag)
+            heapq.heappush(self._queues[priority], (self._finish_tags[(tenant, priority)], next(self._sequence),
+                                                    waiter))
+            stats.queued += 1
+            class_stats.queued += 1
+
+        start_time = time.perf_counter()
+        waiter.granted.wait()
+        waited = time.perf_counter() - start_time
+        with self._lock:
+            stats.record_wait(waited)
+            class_stats.record_wait(waited)
+        return waited
+
+    def try_acquire(self, tenant=None, priority=None):
+        """
+        Take a slot only if one is free right now, never queue for it. For optional extra calls, e.g. hedges
+        :param tenant: Tenant id, the current tenant by default
+        :param priority: Priority class, the current one or _DEFAULT_PRIORITY by default
+        :return: (tenant, priority class) tuple to release the slot with, None if no slot was free
+        """
+        tenant, priority = self._resolve(tenant, priority)
+        with self._lock:
+            if not self._can_start_now(priority):
+                return None
+            stats, class_stats, start_tag = self._charge(tenant, priority)
+            self._start(tenant, priority, start_tag)
+            stats.record_wait(0.0)
+            class_stats.record_wait(0.0)
+        return tenant, priority
+
+    def release(self, tenant=None, priority=None):
+        """
+        Free a slot and hand the free slots to the waiting calls that should go next
+        :param tenant: The tenant the slot was acquired for
+        :param priority: The priority class the slot was acquired for
+        """
+        tenant, priority = self._resolve(tenant, priority)
+        granted = []
+        with self._lock:
+            self.in_use -= 1
+            self._get_stats(tenant).in_flight -= 1
+            self._class_stats[priority].in_flight -= 1
+            for waiting in _PRIORITY_CLASSES:
+                queue = self._queues[waiting]
+                while queue and self._can_start(waiting):
+                    _, _, waiter = heapq.heappop(queue)
+                    self._start(waiter.tenant, waiting, waiter.start_tag)
+                    self._get_stats(waiter.tenant).queued -= 1
+                    self._class_stats[waiting].queued -= 1
+                    granted.append(waiter)
+        for waiter in granted:
+            waiter.granted.set()
+
+    @contextmanager
+    def slot(self, tenant=None, call_site="default", priority=None):
+        """
+        Hold a slot for the duration of the block
+        :param tenant: Tenant id, the current tenant by default
+        :param call_site: Call site of the LLM call
+        :param priority: Priority class, the current one or _DEFAULT_PRIORITY by default
+        """
+        tenant, priority = self._resolve(tenant, priority)
+        self.acquire(tenant, priority)
+        try:
+            yield
+        finally:
+            self.release(tenant, priority)
+
+    def record_request(self, tenant, elapsed):
+        """
+        Record the end to end latency of a tenant's request, e.g. a whole agent tick
+        """
+        with self._lock:
+            stats = self._get_stats(tenant)
+            stats.requests += 1
+            stats.request_latencies.append(elapsed)
+
+    def get_stats(self):
+        """
+        :return: Dictionary with the 'capacity', slots 'in_use', calls 'queued', 'classes', a dictionary of priority
+        class -> slot limit and queue waits, and 'tenants', a dictionary of tenant -> queue waits and request latencies
+        """
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "in_use": self.in_use,
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "classes": {priority: dict(self._class_stats[priority].to_dict(), limit=self.limits[priority])
+                            for priority in _PRIORITY_CLASSES},
+                "tenants": {str(tenant): stats.to_dict() for tenant, stats in self._stats.items()},
+            }
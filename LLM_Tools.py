@@ -0,0 +1,298 @@
+"""
+Registry of functions the LLM can call as tools.
+
+Functions are registered once. Their JSON schema is compiled into a validator at registration time and the OpenAI
+tool list is built once and cached, so a request only pays for a dictionary lookup. The arguments of every tool call
+are checked against the schema before the function runs, and all tool calls of a response run concurrently, so an
+agent can take several actions in one round-trip.
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_TOOL_MAX_WORKERS = 8
+# JSON schema type for Python annotations, used when a function is registered without a schema
+_ANNOTATION_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    dict: "object",
+}
+# Python types accepted for each JSON schema type. bool is excluded from the numbers since it subclasses int
+_JSON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+    "null": (type(None),),
+}
+
+
+class ToolError(RuntimeError):
+    """
+    Raised for an unknown tool or arguments that don't match the tool's schema
+    """
+
+
+def compile_schema(schema, path="arguments"):
+    """
+    Compile a JSON schema into a validator function. Supports the subset used for tool parameters: type, enum,
+    properties, required, additionalProperties and items
+
+    :param schema: JSON schema dictionary
+    :param path: Name of the value, used in error messages
+    :return: Function taking a value and raising ToolError if it doesn't match
+    """
+    checks = []
+
+    schema_type = schema.get("type")
+    if schema_type is not None:
+        type_names = [schema_type] if isinstance(schema_type, str) else list(schema_type)
+        for type_name in type_names:
+            if type_name not in _JSON_TYPES:
+                raise ToolError(f"Unsupported type '{type_name}' in schema of {path}")
+        python_types = tuple(python_type for type_name in type_names for python_type in _JSON_TYPES[type_name])
+        allow_bool = "boolean" in type_names
+
+        def check_type(value):
+            if not isinstance(value, python_types) or (isinstance(value, bool) and not allow_bool):
+                raise ToolError(f"{path} should be of type {schema_type}, got {type(value).__name__}")
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = schema["enum"]
+
+        def check_enum(value):
+            if value not in allowed:
+                raise ToolError(f"{path} should be one of {allowed}, got {value!r}")
+        checks.append(check_enum)
+
+    if "properties" in schema or "required" in schema or "additionalProperties" in schema:
+        property_checks = {name: compile_schema(property_schema, f"{path}.{name}")
+                           for name, property_schema in schema.get("properties", {}).items()}
+        required = schema.get("required", [])
+        additional = schema.get("additionalProperties", True)
+        additional_check = compile_schema(additional, f"{path}.*") if isinstance(additional, dict) else None
+
+        def check_object(value):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    raise ToolError(f"{path} is missing required parameter '{name}'")
+            for name, item in value.items():
+                if name in property_checks:
+                    property_checks[name](item)
+                elif additional_check is not None:
+                    additional_check(item)
+                elif additional is False:
+                    raise ToolError(f"{path} has unexpected parameter '{name}'")
+        checks.append(check_object)
+
+    if "items" in schema:
+        item_check = compile_schema(schema["items"], f"{path}[]")
+
+        def check_items(value):
+            if isinstance(value, list):
+                for item in value:
+                    item_check(item)
+        checks.append(check_items)
+
+    def validate(value):
+        for check in checks:
+            check(value)
+
+    return validate
+
+
+def schema_from_signature(function):
+    """
+    Build a parameter schema from a function's signature. Parameters without a default are required
+    :param function: The function
+    :return: JSON schema dictionary
+    """
+    import inspect  # Only needed when registering, and slow to import
+
+    properties = {}
+    required = []
+    for name, parameter in inspect.signature(function).parameters.items():
+        if parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+            continue
+        properties[name] = {}
+        if parameter.annotation in _ANNOTATION_TYPES:
+            properties[name]["type"] = _ANNOTATION_TYPES[parameter.annotation]
+        if parameter.default is parameter.empty:
+            required.append(name)
+    return {"type": "object", "properties": properties, "required": required}
+
+
+class Tool:
+    """
+    A registered function with its schema, compiled validator and OpenAI tool definition
+    """
+
+    def __init__(self, function, name, description, parameters):
+        self.function = function
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.validate = compile_schema(parameters, name)
+        self.definition = {
+            "type": "function",
+            "function": {"name": name, "description": description, "parameters": parameters},
+        }
+
+
+class ToolResult:
+    """
+    Outcome of one tool call. 'error' is set instead of 'result' if the call failed
+    """
+
+    def __init__(self, call_id, name, arguments, result=None, error=None):
+        self.call_id = call_id
+        self.name = name
+        self.arguments = arguments
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        outcome = f"result={self.result!r}" if self.ok else f"error={self.error!r}"
+        return f"ToolResult({self.name}, {outcome})"
+
+
+class ToolRegistry:
+    """
+    Functions the LLM may call, by name
+    """
+
+    def __init__(self, max_workers=_TOOL_MAX_WORKERS):
+        self.tools = {}
+        self.max_workers = max_workers
+        self._definitions = {}  # Tuple of tool names (None for all tools) -> cached list of tool definitions
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def register(self, function=None, name=None, description=None, parameters=None):
+        """
+        Register a function as a tool. Can be used as a decorator, with or without arguments
+
+        :param function: The function to register
+        :param name: Tool name, the function's name by default
+        :param description: Tool description, the first line of the function's docstring by default
+        :param parameters: JSON schema of the parameters, built from the function's signature by default
+        :return: The function, unchanged
+        """
+        if function is None:
+            return lambda decorated: self.register(decorated, name, description, parameters)
+
+        if description is None:
+            docstring = function.__doc__ or ""
+            description = docstring.strip().split("\n")[0]
+        if parameters is None:
+            parameters = schema_from_signature(function)
+        tool = Tool(function, name or function.__name__, description, parameters)
+        with self._lock:
+            self.tools[tool.name] = tool
+            self._definitions = {}
+        return function
+
+    def unregister(self, name):
+        with self._lock:
+            self.tools.pop(name, None)
+            self._definitions = {}
+
+    def get_definitions(self, names=None):
+        """
+        OpenAI tool definitions, built once per set of names
+        :param names: Optional list of tool names to offer, all tools by default
+        :return: List of tool definition dictionaries
+        """
+        key = None if names is None else tuple(names)
+        # Read under the lock too, so a lookup racing register or unregister never returns definitions they replaced
+        with self._lock:
+            definitions = self._definitions.get(key)
+            if definitions is None:
+                if names is None:
+                    definitions = [tool.definition for tool in self.tools.values()]
+                else:
+                    definitions = [self._get_tool(name).definition for name in names]
+                self._definitions[key] = definitions
+            return definitions
+
+    def _get_tool(self, name):
+        tool = self.tools.get(name)
+        if tool is None:
+            raise ToolError(f"Unknown tool '{name}'")
+        return tool
+
+    def validate(self, name, arguments):
+        """
+        Parse and check the arguments of a tool call
+        :param name: Tool name
+        :param arguments: JSON string or dictionary of arguments
+        :return: Dictionary of arguments
+        """
+        tool = self._get_tool(name)
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments) if arguments.strip() else {}
+            except json.JSONDecodeError as e:
+                raise ToolError(f"Arguments of {name} are not valid JSON: {e}")
+        tool.validate(arguments)
+        return arguments
+
+    def call(self, name, arguments, call_id=None):
+        """
+        Validate and run a single tool call
+        :return: ToolResult, with the error set if validation or the function failed
+        """
+        try:
+            arguments = self.validate(name, arguments)
+            return ToolResult(call_id, name, arguments, result=self.tools[name].function(**arguments))
+        except Exception as e:
+            return ToolResult(call_id, name, arguments, error=f"{type(e).__name__}: {e}")
+
+    def execute(self, tool_calls):
+        """
+        Run every tool call of a response, concurrently when there is more than one
+
+        :param tool_calls: The tool_calls of a chat completion message
+        :return: List of ToolResult in the order of tool_calls
+        """
+        requests = [(tool_call.function.name, tool_call.function.arguments, getattr(tool_call, "id", None))
+                    for tool_call in tool_calls or []]
+        if len(requests) <= 1:
+            return [self.call(*request) for request in requests]
+
+        executor = self._get_executor()
+        futures = [executor.submit(self.call, *request) for request in requests]
+        return [future.result() for future in futures]
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool")
+            return self._executor
+
+
+_TOOL_REGISTRY = ToolRegistry()
+
+
+def get_tool_registry():
+    return _TOOL_REGISTRY
+
+
+def register_tool(function=None, name=None, description=None, parameters=None):
+    """
+    Register a function on the default registry, see ToolRegistry.register
+    """
+    return _TOOL_REGISTRY.register(function, name, description, parameters)
@@ -0,0 +1,416 @@
+"""
+Pooled keep-alive HTTP transport for OpenAI compatible chat completion backends.
+
+The transport is an LLM_Controller backend (see LLM_Controller.use_pooled_transport). It keeps a fixed size pool of
+persistent connections so fan-out heavy ticks don't pay TCP/TLS setup per call, applies separate connect and read
+timeouts per call site, and tracks connection health so a dead socket is dropped and the request retried on a fresh
+connection instead of stalling the run. HTTP/2 is used through httpx when it is installed and requested, the standard
+library http.client is used otherwise.
+
+A request made inside cancellable(token) can be aborted from another thread with token.cancel(), e.g. the losing copy
+of a hedged call. The http.client pool shuts the request's socket down, the HTTP/2 pool can only refuse requests that
+haven't been sent yet.
+"""
+
+import contextvars
+import json
+import queue
+import socket
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+_DEFAULT_BASE_URL = "https://api.openai.com/v1"
+_POOL_SIZE = 8
+# http.client and ssl, imported with the first ConnectionPool since they are slow to import and unused with a stand-in
+http_client = ssl = None
+# (connect timeout, read timeout) in seconds for each call site
+_CALL_SITE_TIMEOUTS = {
+    "default": (5.0, 30.0),
+    "category": (3.0, 10.0),
+    "relevance": (3.0, 10.0),
+    "contextualize": (3.0, 20.0),
+    "compress": (3.0, 20.0),
+    "generate_responses": (5.0, 30.0),
+    "choose_response": (5.0, 30.0),
+    "decide": (5.0, 30.0),
+    "world_next_state": (5.0, 60.0),
+    "world_parse": (5.0, 30.0),
+}
+# A pool with this many failed requests in a row is reported as unhealthy
+_UNHEALTHY_AFTER = 3
+# Status codes worth retrying
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_CANCEL_TOKEN = contextvars.ContextVar("llm_cancel_token", default=None)
+
+
+class TransportError(Exception):
+    """
+    Raised by the transport. 'retryable' tells LLM_Controller whether the request may be tried again
+    """
+    retryable = False
+
+
+class TransportTimeout(TransportError):
+    retryable = True
+
+
+class TransportConnectionError(TransportError):
+    retryable = True
+
+
+class RequestCancelled(TransportError):
+    """
+    Raised by a request whose CancelToken was cancelled
+    """
+
+
+class TransportHTTPError(TransportError):
+
+    def __init__(self, status, body):
+        super().__init__(f"HTTP {status}: {body[:500]}")
+        self.status = status
+        self.retryable = status in _RETRYABLE_STATUS
+
+
+class ResponseObject(dict):
+    """
+    JSON object that also allows attribute access, like the objects the openai library returns
+    """
+
+    def __getattr__(self, name):
+        try:
+            return _wrap(self[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, key):
+        return _wrap(dict.__getitem__(self, key))
+
+
+class CancelToken:
+    """
+    Lets another thread abort the request made inside cancellable(token)
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._connection = None  # Connection the request is using right now
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.cancelled:
+            raise RequestCancelled("Request cancelled before it was sent")
+
+    def attach(self, connection):
+        with self._lock:
+            self.check()
+            self._connection = connection
+
+    def detach(self):
+        with self._lock:
+            self._connection = None
+
+    def cancel(self):
+        """
+        Abort the request: a request not sent yet never is, one in flight has its socket shut down
+        """
+        with self._lock:
+            self.cancelled = True
+            sock = getattr(self._connection, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Already closed
+
+
+@contextmanager
+def cancellable(token):
+    """
+    Make the requests sent inside the block abortable with token.cancel()
+    :param token: CancelToken
+    """
+    reset_token = _CANCEL_TOKEN.set(token)
+    try:
+        yield token
+    finally:
+        _CANCEL_TOKEN.reset(reset_token)
+
+
+def _wrap(value):
+    if isinstance(value, dict) and not isinstance(value, ResponseObject):
+        return ResponseObject(value)
+    if isinstance(value, list):
+        return [_wrap(item) for item in value]
+    return value
+
+
+class ConnectionHealth:
+    """
+    Request and failure counts of a connection pool
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.connections_dropped = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self):
+        return self.consecutive_failures < _UNHEALTHY_AFTER
+
+    def count(self, **counters):
+        with self._lock:
+            for name, amount in counters.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def record(self, error=None):
+        """
+        Record the outcome of a request
+        :param error: The exception the request failed with, None if it succeeded
+        """
+        with self._lock:
+            self.requests += 1
+            if error is None:
+                self.consecutive_failures = 0
+            else:
+                self.failures += 1
+                self.consecutive_failures += 1
+                self.last_error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "healthy": self.healthy,
+                "requests": self.requests,
+                "failures": self.failures,
+                "consecutive_failures": self.consecutive_failures,
+                "connections_opened": self.connections_opened,
+                "connections_reused": self.connections_reused,
+                "connections_dropped": self.connections_dropped,
+                "last_error": self.last_error,
+            }
+
+
+def _import_http():
+    global http_client, ssl
+    if http_client is None:
+        import http.client as http_client_module
+        import ssl as ssl_module
+        http_client, ssl = http_client_module, ssl_module
+
+
+class ConnectionPool:
+    """
+    A fixed size pool of keep-alive http.client connections to a single host
+    """
+
+    def __init__(self, base_url, size=_POOL_SIZE):
+        url = urlsplit(base_url)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.size = size
+        self.health = ConnectionHealth()
+        self._idle = queue.LifoQueue()  # Most recently used connection first, it is the least likely to be stale
+        self._slots = threading.BoundedSemaphore(size)
+        _import_http()
+        self._ssl_context = ssl.create_default_context() if self.scheme == "https" else None
+
+    def _connect(self, connect_timeout):
+        if self.scheme == "https":
+            connection = http_client.HTTPSConnection(self.host, self.port, timeout=connect_timeout,
+                                                     context=self._ssl_context)
+        else:
+            connection = http_client.HTTPConnection(self.host, self.port, timeout=connect_timeout)
+        connection.connect()
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.health.count(connections_opened=1)
+        return connection
+
+    def request(self, method, path, body, headers, timeouts):
+        """
+        Send a request on a pooled connection. A reused connection that turns out to be dead is dropped and the request
+        is sent once more on a fresh connection.
+
+        :param method: HTTP method
+        :param path: Request path
+        :param body: Request body bytes
+        :param headers: Dictionary of headers
+        :param timeouts: (connect timeout, read timeout) in seconds
+        :return: (status, response body bytes) tuple
+        """
+        connect_timeout, read_timeout = timeouts
+        token = _CANCEL_TOKEN.get()
+        if token is not None:
+            token.check()
+        if not self._slots.acquire(timeout=connect_timeout + read_timeout):
+            raise TransportTimeout(f"No free connection to {self.host} after {connect_timeout + read_timeout}s")
+        try:
+            for fresh in (False, True):
+                connection = None if fresh else self._get_idle()
+                reused = connection is not None
+                try:
+                    if connection is None:
+                        connection = self._connect(connect_timeout)
+                    if token is not None:
+                        token.attach(connection)
+                    connection.sock.settimeout(read_timeout)
+                    connection.request(method, path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    data = response.read()
+                except socket.timeout as e:
+                    self._drop(connection, e, token)
+                    raise TransportTimeout(f"Request to {self.host} timed out: {e}")
+                except (http_client.HTTPException, ConnectionError) as e:
+                    if reused:  # The server closed an idle keep-alive connection, try again on a new one
+                        self._drop(connection)
+                        continue
+                    self._drop(connection, e, token)
+                    raise TransportConnectionError(f"Connection to {self.host} failed: {e}")
+                except OSError as e:
+                    self._drop(connection, e, token)
+                    raise TransportConnectionError(f"Connection to {self.host} failed: {e}")
+                except RequestCancelled:
+                    self._drop(connection)
+                    raise
+                finally:
+                    if token is not None:
+                        token.detach()
+
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._idle.put(connection)
+                self.health.count(connections_reused=int(reused))
+                # Server errors count against the health of the backend, client errors don't
+                self.health.record(TransportHTTPError(response.status, "") if response.status >= 500 else None)
+                return response.status, data
+        except TransportError:
+            if token is not None and token.cancelled:  # The failure is the socket we shut down
+                raise RequestCancelled(f"Request to {self.host} was cancelled") from None
+            raise
+        finally:
+            self._slots.release()
+
+        raise TransportConnectionError(f"Connection to {self.host} failed")
+
+    def _get_idle(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _drop(self, connection, error=None, token=None):
+        """
+        Close a connection instead of returning it to the pool
+        :param connection: The connection, may be None if connecting failed
+        :param error: The exception that made the request fail, None if the request will be retried
+        :param token: The request's CancelToken, a cancelled request doesn't count against the backend's health
+        """
+        if connection is not None:
+            connection.close()
+            self.health.count(connections_dropped=1)
+        if error is not None and not (token is not None and token.cancelled):
+            self.health.record(error)
+
+    def close(self):
+        while True:
+            connection = self._get_idle()
+            if connection is None:
+                return
+            connection.close()
+
+
+class _Http2Pool:
+    """
+    Same interface as ConnectionPool, backed by an httpx client with HTTP/2 enabled
+    """
+
+    def __init__(self, base_url, size=_POOL_SIZE):
+        import httpx
+        self._httpx = httpx
+        self.size = size
+        self.health = ConnectionHealth()
+        self._client = httpx.Client(base_url=base_url, http2=True,
+                                    limits=httpx.Limits(max_connections=size, max_keepalive_connections=size))
+
+    def request(self, method, path, body, headers, timeouts):
+        token = _CANCEL_TOKEN.get()
+        if token is not None:
+            token.check()
+        connect_timeout, read_timeout = timeouts
+        timeout = self._httpx.Timeout(read_timeout, connect=connect_timeout)
+        try:
+            response = self._client.request(method, path, content=body, headers=headers, timeout=timeout)
+        except self._httpx.TimeoutException as e:
+            self.health.record(e)
+            raise TransportTimeout(str(e))
+        except self._httpx.TransportError as e:
+            self.health.record(e)
+            raise TransportConnectionError(str(e))
+        self.health.record(TransportHTTPError(response.status_code, "") if response.status_code >= 500 else None)
+        return response.status_code, response.content
+
+    def close(self):
+        self._client.close()
+
+
+class PooledTransport:
+    """
+    LLM_Controller backend that posts chat completions over a connection pool
+    """
+
+    def __init__(self, base_url=_DEFAULT_BASE_URL, api_key="", pool_size=_POOL_SIZE, http2=False,
+                 call_site_timeouts=None, send_call_site=False):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.send_call_site = send_call_site  # Name the call site in an X-Call-Site header, e.g. for a stand-in
+        self.call_site_timeouts = dict(_CALL_SITE_TIMEOUTS)
+        if call_site_timeouts is not None:
+            self.call_site_timeouts.update(call_site_timeouts)
+        self._path = urlsplit(self.base_url).path + "/chat/completions"
+        self.pool = None
+        if http2:
+            try:
+                self.pool = _Http2Pool(self.base_url, pool_size)
+                self._path = "/chat/completions"  # httpx joins it onto base_url
+            except ImportError:  # httpx (with h2) is optional, fall back to HTTP/1.1 keep-alive
+                self.pool = None
+        if self.pool is None:
+            self.pool = ConnectionPool(self.base_url, pool_size)
+
+    def __call__(self, model=None, messages=None, tools=None, tool_choice=None, call_site="default",
+                 **request_options):
+        payload = {"model": model, "messages": messages}
+        if tools is not None:
+            payload["tools"] = tools
+        if tool_choice is not None:
+            payload["tool_choice"] = tool_choice
+        payload.update(request_options)
+
+        headers = {"Content-Type": "application/json"}
+        if self.send_call_site:
+            headers["X-Call-Site"] = call_site
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        timeouts = self.call_site_timeouts.get(call_site, self.call_site_timeouts["default"])
+        status, data = self.pool.request("POST", self._path, json.dumps(payload).encode(), headers, timeouts)
+        if status >= 400:
+            raise TransportHTTPError(status, data.decode(errors="replace"))
+
+        return ResponseObject(json.loads(data))
+
+    def get_health(self):
+        return self.pool.health.to_dict()
+
+    def close(self):
+        self.pool.close()
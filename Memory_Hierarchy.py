@@ -0,0 +1,181 @@
+"""
+Time-bucketed hierarchy over an agent's memories.
+
+Memories (temporal contexts) are the leaves, in the order they were stored. Every _BRANCHING consecutive moments form
+an episode, every _BRANCHING episodes an era, and so on for as many levels as the lifetime needs. Each node keeps a
+summary embedding, the sum of its leaves' normalized embeddings (Semantic_Cache.embed of the information experienced),
+updated as leaves arrive, and can produce a summary node (an Information) on demand.
+
+A search scores the top level, descends only into the best scoring children at each level and ranks the leaves it
+reaches, so it looks at about _BRANCHING * beam * depth nodes instead of every memory, however long the agent lives.
+"""
+
+import bisect
+import math
+import threading
+
+from Semantic_Cache import embed
+
+_BRANCHING = 16  # Children per node, moments per episode and episodes per era
+_BEAM = 2  # Children descended into per node at every level of a search
+_SEARCH_LEAVES = 8  # Memories returned by a search
+_LEVEL_NAMES = ["moment", "episode", "era"]  # Levels above the last name are eras too
+
+
+class MemoryNode:
+    """
+    A moment (a single memory) or a bucket of consecutive nodes one level down
+    """
+
+    def __init__(self, level, start):
+        self.level = level
+        self.start = start  # Position of the first memory under this node
+        self.end = start  # Position after the last memory under this node
+        self.children = []
+        self.memory = None  # The temporal context of a moment
+        self.vector = {}  # Summary embedding, feature -> weight
+        self.squared_norm = 0.0
+        self._summary = None
+        self._summary_size = 0  # Number of children when the summary was made
+
+    @property
+    def name(self):
+        return _LEVEL_NAMES[min(self.level, len(_LEVEL_NAMES) - 1)]
+
+    def add_vector(self, vector):
+        """
+        Add a normalized embedding to the summary embedding, keeping the norm up to date without a full pass
+        """
+        dot = sum(weight * self.vector.get(feature, 0.0) for feature, weight in vector.items())
+        self.squared_norm += 2 * dot + sum(weight * weight for weight in vector.values())
+        for feature, weight in vector.items():
+            self.vector[feature] = self.vector.get(feature, 0.0) + weight
+
+    def score(self, query, query_norm):
+        """
+        :return: Cosine similarity of the query embedding and this node's summary embedding
+        """
+        if not query_norm or self.squared_norm <= 0:
+            return 0.0
+        dot = sum(weight * self.vector.get(feature, 0.0) for feature, weight in query.items())
+        return dot / (query_norm * math.sqrt(self.squared_norm))
+
+    def get_summary(self, summarizer):
+        """
+        Summary node of this node, made on first use and remade once more children have arrived
+        :param summarizer: Function taking the temporal contexts of an episode or the summaries of a higher level's
+        children and returning an Information object
+        :return: Information object
+        """
+        if self.memory is not None:
+            return self.memory.what
+        if self._summary is None or self._summary_size != len(self.children):
+            items = [child.memory if child.memory is not None else child.get_summary(summarizer)
+                     for child in self.children]
+            self._summary, self._summary_size = summarizer(items), len(self.children)
+        return self._summary
+
+
+class MemoryHierarchy:
+    """
+    Moments, episodes and eras over a growing list of memories
+    """
+
+    def __init__(self, branching=_BRANCHING, beam=_BEAM, search_leaves=_SEARCH_LEAVES):
+        self.branching = branching
+        self.beam = beam
+        self.search_leaves = search_leaves
+        self.levels = [[]]  # Nodes per level, moments first. The last level is the top
+        self.synced = 0  # How many entries of the memory list have been looked at
+        self._list_positions = []  # Position in the memory list of every moment
+        self._seen = set()  # Ids of the temporal contexts already added, in case the memory list repeats one
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def sync(self, memories):
+        """
+        Add the memories appended to the list since the last sync
+        :param memories: The agent's memory list, only ever appended to
+        :return: Nothing
+        """
+        with self._lock:
+            for position in range(self.synced, len(memories)):
+                memory = memories[position]
+                if memory is not None and id(memory) not in self._seen:
+                    self._seen.add(id(memory))
+                    self._list_positions.append(position)
+                    self._add(memory)
+            self.synced = len(memories)
+
+    def _add(self, memory):
+        position = len(self.levels[0])
+        leaf = MemoryNode(0, position)
+        leaf.end = position + 1
+        leaf.memory = memory
+        vector, norm = embed(" ".join(information.value for information in memory.experienced_information))
+        if norm:
+            leaf.add_vector({feature: weight / norm for feature, weight in vector.items()})
+
+        # The ancestors of the newest leaf are the last node of every level. A full one is followed by a new node
+        node, new = leaf, True
+        for level in range(1, len(self.levels)):
+            nodes = self.levels[level]
+            parent_new = False
+            if new:
+                if len(nodes[-1].children) >= self.branching:
+                    nodes.append(MemoryNode(level, leaf.start))
+                    parent_new = True
+                nodes[-1].children.append(node)
+            parent = nodes[-1]
+            parent.end = leaf.end
+            parent.add_vector(leaf.vector)
+            node, new = parent, parent_new
+        self.levels[0].append(leaf)
+
+        top = self.levels[-1]
+        if len(top) > self.branching:  # Too many nodes to scan on every search, group them under a new top level
+            level = len(self.levels)
+            groups = []
+            for index in range(0, len(top), self.branching):
+                group = MemoryNode(level, top[index].start)
+                for child in top[index:index + self.branching]:
+                    group.children.append(child)
+                    group.end = child.end
+                    group.add_vector(child.vector)
+                groups.append(group)
+            self.levels.append(groups)
+
+    def search(self, text, before=None, limit=None):
+        """
+        Find the memories most similar to a text, descending only into the best scoring episodes and eras
+
+        :param text: Text to search for, e.g. the value of an information object
+        :param before: Only search the memories before this position of the memory list, e.g. a snapshot's length
+        :param limit: Maximum number of memories returned, search_leaves by default
+        :return: List of temporal contexts in the order they were stored
+        """
+        limit = self.search_leaves if limit is None else limit
+        query, query_norm = embed(text)
+        with self._lock:
+            end = len(self.levels[0]) if before is None else bisect.bisect_left(self._list_positions, before)
+            if end <= limit:
+                return [leaf.memory for leaf in self.levels[0][:end]]
+
+            nodes = [node for node in self.levels[-1] if node.start < end]
+            leaves = []
+            while nodes:
+                ranked = sorted(nodes, key=lambda node: (node.score(query, query_norm), node.start), reverse=True)
+                if ranked[0].memory is not None:
+                    leaves = ranked[:limit]
+                    break
+                nodes = [child for node in ranked[:self.beam] for child in node.children if child.start < end]
+        return [leaf.memory for leaf in sorted(leaves, key=lambda leaf: leaf.start)]
+
+    def get_stats(self):
+        """
+        :return: Dictionary with the number of memories and the number of nodes on every level, moments first
+        """
+        with self._lock:
+            return {"memories": len(self.levels[0]), "nodes_per_level": [len(nodes) for nodes in self.levels]}
@@ -0,0 +1,220 @@
+"""
+Memory footprint sampling for long running agents.
+
+A MemoryProfiler is sampled every N ticks. Each sample reports the live count and own size of every tracked class (by
+default Information and each Context subclass) with the deep size of everything its instances hold, the deep size
+of an agent's memories and a world's lists, how many entries of the memory list are duplicates, RSS, and with
+tracemalloc enabled the top allocation sites grouped by module with their growth since the previous sample. Samples
+that cross a threshold carry alerts, so unbounded growth shows up in the metrics long before it takes the process down.
+
+Deep sizes stop at references to objects a measured object doesn't own, such as the resolver a lazily contextualized
+Information points back to the agent's memory with, so a figure is what the measured objects would free, not the
+whole simulation.
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+import types
+
+_PROFILE_EVERY = 100  # Ticks between samples
+_TOP_MODULES = 10  # Allocation sites reported per sample
+# Default alert thresholds, metric name -> highest value that doesn't alert
+_ALERT_THRESHOLDS = {
+    "rss_bytes": 2 * 1024 ** 3,
+    "memories_deep_bytes": 512 * 1024 ** 2,
+    "duplicate_memories": 10000,
+    "count.Information": 1000000,
+}
+# Objects that are shared infrastructure rather than part of a simulation object graph
+_SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.CodeType,
+               types.FrameType)
+# Attributes that refer back to objects owned elsewhere, never followed when measuring deep sizes
+_NOT_OWNED_ATTRIBUTES = frozenset({"_context_resolver"})
+
+
+def get_rss_bytes():
+    """
+    :return: Current resident set size of this process in bytes (peak RSS where /proc is unavailable), None where the
+        resource module is missing too (Windows)
+    """
+    try:
+        import resource  # Unix only, imported here so importing the profiler works everywhere
+    except ImportError:
+        return None
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def own_size(obj):
+    """
+    Size of an object with its attribute dictionary and the containers and strings it holds directly, not counting
+    other objects it refers to
+    """
+    size = sys.getsizeof(obj)
+    attributes = getattr(obj, "__dict__", None)
+    if attributes is None:
+        return size
+    size += sys.getsizeof(attributes)
+    for value in list(attributes.values()):  # Reads the raw attributes, so lazy properties are never resolved
+        if isinstance(value, (str, bytes, list, tuple, dict, set)):
+            size += sys.getsizeof(value)
+    return size
+
+
+def deep_size(root, not_owned_types=()):
+    """
+    Size of everything reachable from root, each object counted once
+    :param root: Any object
+    :param not_owned_types: Classes whose instances are owned elsewhere, neither counted nor followed
+    :return: Size in bytes
+    """
+    return _reachable_size([root], not_owned_types)
+
+
+def _reachable_size(roots, not_owned_types=()):
+    """
+    :return: Size in bytes of everything reachable from any of roots, each object counted once
+    """
+    seen = set()
+    stack = list(roots)
+    size = 0
+    not_owned_types = tuple(not_owned_types)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SKIP_TYPES) or obj is None or isinstance(obj, not_owned_types):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            items = list(obj.items())
+            stack.extend(key for key, _ in items)
+            stack.extend(value for _, value in items)
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(list(obj))
+        elif not isinstance(obj, (str, bytes, int, float, bool)):
+            attributes = getattr(obj, "__dict__", None)
+            if attributes is not None:
+                seen.add(id(attributes))
+                size += sys.getsizeof(attributes)
+                stack.extend(value for name, value in list(attributes.items()) if name not in _NOT_OWNED_ATTRIBUTES)
+            for slot in getattr(type(obj), "__slots__", ()):
+                if slot not in _NOT_OWNED_ATTRIBUTES:
+                    stack.append(getattr(obj, slot, None))
+    return size
+
+
+class MemoryProfiler:
+    """
+    Samples object counts, sizes and allocation sites every 'every' ticks
+    """
+
+    def __init__(self, tracked_types=(), every=_PROFILE_EVERY, thresholds=None, trace_allocations=False,
+                 top_modules=_TOP_MODULES, event_log=None, not_owned_types=()):
+        """
+        :param tracked_types: Base classes whose instances (and subclass instances, counted per class) are counted
+        :param every: Ticks between samples
+        :param thresholds: Optional dictionary of metric name -> highest value that doesn't alert, added to the defaults
+        :param trace_allocations: Start tracemalloc to report allocation sites by module. Slows allocations down
+        :param top_modules: Number of modules reported
+        :param event_log: Optional EventLog every sample is appended to as a 'memory' event
+        :param not_owned_types: Classes whose instances deep sizes don't count or follow, e.g. an agent's memory that
+            tracked objects refer back to
+        """
+        self.tracked_types = tuple(tracked_types)
+        self.every = every
+        self.thresholds = dict(_ALERT_THRESHOLDS)
+        if thresholds is not None:
+            self.thresholds.update(thresholds)
+        self.top_modules = top_modules
+        self.event_log = event_log
+        self.not_owned_types = tuple(not_owned_types)
+        self.samples = []
+        self._previous_allocations = {}
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def maybe_sample(self, tick, agent=None, world=None):
+        """
+        Sample if tick is a multiple of 'every'
+        :return: The sample, None if this tick isn't sampled
+        """
+        if self.every <= 0 or tick % self.every:
+            return None
+        return self.sample(tick, agent, world)
+
+    def sample(self, tick, agent=None, world=None):
+        """
+        :param tick: Tick number
+        :param agent: Optional State_Control.Agent whose memories are measured
+        :param world: Optional World_Generator.WorldState whose lists are measured
+        :return: Dictionary of metrics, with an 'alerts' list of the metrics over their threshold
+        """
+        sample = {"tick": tick, "rss_bytes": get_rss_bytes()}
+        sample.update(self._count_objects())
+
+        if agent is not None:
+            memories = list(agent.memories.memories)
+            sample["memories"] = len(memories)
+            sample["duplicate_memories"] = len(memories) - len({id(memory) for memory in memories})
+            sample["memories_deep_bytes"] = deep_size(memories, self.not_owned_types)
+            sample["temporal_contexts"] = len(agent.current_agent_state.temporal_context_list)
+        if world is not None:
+            sample["world_information"] = len(world.current_information_list)
+            sample["world_deep_bytes"] = deep_size([world.current_information_list, world.information_index,
+                                                    world.last_delta.__dict__], self.not_owned_types)
+        if tracemalloc.is_tracing():
+            sample["allocations_by_module"] = self._allocations_by_module()
+
+        sample["alerts"] = [{"metric": metric, "value": sample[metric], "threshold": threshold}
+                            for metric, threshold in self.thresholds.items()
+                            if isinstance(sample.get(metric), (int, float)) and sample[metric] > threshold]
+        for alert in sample["alerts"]:
+            print(f"Memory alert at tick {tick}: {alert['metric']}={alert['value']} is over {alert['threshold']}")
+
+        self.samples.append(sample)
+        if self.event_log is not None:
+            self.event_log.append(tick, "memory", sample)
+        return sample
+
+    def _count_objects(self):
+        """
+        :return: Dictionary with count.<class>, bytes.<class> (own sizes) and deep_bytes.<class> (everything the
+            class's instances hold, each object counted once per class) of every tracked class
+        """
+        if not self.tracked_types:
+            return {}
+        instances, sizes = {}, {}
+        for obj in gc.get_objects():
+            if isinstance(obj, self.tracked_types):
+                name = type(obj).__name__
+                instances.setdefault(name, []).append(obj)
+                sizes[name] = sizes.get(name, 0) + own_size(obj)
+        metrics = {}
+        for name in sorted(instances):
+            metrics[f"count.{name}"] = len(instances[name])
+            metrics[f"bytes.{name}"] = sizes[name]
+            metrics[f"deep_bytes.{name}"] = _reachable_size(instances[name], self.not_owned_types)
+        return metrics
+
+    def _allocations_by_module(self):
+        """
+        :return: List of the modules holding the most traced memory with their growth since the previous sample
+        """
+        by_module = {}
+        for statistic in tracemalloc.take_snapshot().statistics("filename"):
+            module = os.path.splitext(os.path.basename(statistic.traceback[0].filename))[0]
+            size, count = by_module.get(module, (0, 0))
+            by_module[module] = (size + statistic.size, count + statistic.count)
+
+        top = sorted(by_module.items(), key=lambda item: -item[1][0])[:self.top_modules]
+        report = [{"module": module, "bytes": size, "blocks": count,
+                   "growth_bytes": size - self._previous_allocations.get(module, 0)}
+                  for module, (size, count) in top]
+        self._previous_allocations = {module: size for module, (size, _) in by_module.items()}
+        return report
@@ -0,0 +1,97 @@
+"""
+Append-only list whose snapshots share its items.
+
+A PersistentList is a length over a backing list that is only ever appended to. A snapshot is a second length over the
+same backing list, so taking one is constant time whatever the size of the list, and later appends to the original
+don't change what the snapshot contains. Appending to a list that no longer ends where its backing list does (e.g. a
+snapshot, once the original has grown) first copies its own items: copy on write, paid only by the list that diverges.
+Items are never replaced in place, which is what makes sharing safe.
+
+Lists that share a backing list find what one holds beyond the other with a slice, so the diff of two consecutive
+snapshots costs only the items added in between.
+"""
+
+import itertools
+import threading
+
+from Context_Set import OrderedSet
+
+_APPEND_LOCK = threading.Lock()  # Lists sharing a backing list may append from different threads
+
+
+class PersistentList:
+    """
+    Append-only sequence with constant time snapshots
+    """
+
+    def __init__(self, items=()):
+        self._items = list(items)  # Backing list, possibly shared with snapshots and longer than this list
+        self._length = len(self._items)
+
+    @classmethod
+    def _view(cls, items, length):
+        view = cls.__new__(cls)
+        view._items = items
+        view._length = length
+        return view
+
+    def snapshot(self):
+        """
+        :return: PersistentList with this list's current items, unaffected by later appends to either list
+        """
+        return self._view(self._items, self._length)
+
+    def _own(self):
+        """
+        Copy our items out of the backing list if another list has appended past our end. Call with _APPEND_LOCK held
+        """
+        if self._length != len(self._items):
+            self._items = self._items[:self._length]
+
+    def append(self, item):
+        with _APPEND_LOCK:
+            self._own()
+            self._items.append(item)
+            self._length += 1
+
+    def extend(self, items):
+        items = list(items)
+        with _APPEND_LOCK:
+            self._own()
+            self._items.extend(items)
+            self._length = len(self._items)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def added_since(self, other):
+        """
+        :param other: An earlier snapshot of this list, or any iterable
+        :return: List of the items appended since the snapshot, or of our items not in other
+        """
+        if isinstance(other, PersistentList) and other._items is self._items and other._length <= self._length:
+            return self._items[other._length:self._length]
+        known = OrderedSet(other)
+        return [item for item in self if item not in known]
+
+    def to_list(self):
+        return self._items[:self._length]
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return itertools.islice(self._items, self._length)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._items[slice(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("PersistentList index out of range")
+        return self._items[index]
+
+    def __repr__(self):
+        return f"PersistentList({self.to_list()})"
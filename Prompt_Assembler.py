@@ -0,0 +1,194 @@
+"""
+Token budgeted prompt assembly.
+
+Every prompt is split into named sections (stimulus description, temporal context, candidate responses, ...). Each
+section has a fixed token budget and is filled with the items that score best on relevance to the current stimulus and
+recency. Items are only rendered (which may cost an LLM call) once they have been selected, so the size and cost of a
+prompt stays fixed however long the agent has lived.
+"""
+
+import math
+import re
+
+# Default token budget of each prompt section
+_SECTION_BUDGETS = {
+    "stimulus": 256,
+    "temporal": 768,
+    "memories": 256,
+    "candidates": 256,
+    "compress": 512,
+}
+_DEFAULT_BUDGET = 256
+
+# How much relevance and recency each contribute to the score of an item. Should add up to 1
+_RELEVANCE_WEIGHT = 0.6
+_RECENCY_WEIGHT = 0.4
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_WORD_PATTERN = re.compile(r"[a-z0-9']+")
+_TRUNCATION_MARKER = "..."
+# Most tokens an unrendered item is assumed to render to when no estimate was given. Rendering usually condenses the
+# raw text (e.g. contextualizing a temporal context summarizes all of its information), so its full count would skip
+# items that fit
+_RENDER_ESTIMATE_CAP = 64
+# tiktoken encoding, loaded on the first token count since loading it reads the encoding files. False until then
+_ENCODING = False
+
+
+def _get_encoding():
+    """
+    :return: The tiktoken encoding, None if tiktoken isn't installed
+    """
+    global _ENCODING
+    if _ENCODING is False:
+        try:
+            import tiktoken
+            _ENCODING = tiktoken.get_encoding("cl100k_base")
+        except ImportError:  # Fall back to an approximate local count
+            _ENCODING = None
+    return _ENCODING
+
+
+def count_tokens(text):
+    """
+    Count the tokens of a string locally. Uses tiktoken when installed, otherwise approximates the count by splitting
+    into words and punctuation where every 4 characters of a word counts as a token.
+    :param text: Any string
+    :return: Number of tokens
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+
+    tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        tokens += max(1, math.ceil(len(match.group()) / 4))
+    return tokens
+
+
+def truncate_to_tokens(text, budget):
+    """
+    Cut a string down so that it fits in the token budget
+    :param text: Any string
+    :param budget: Maximum number of tokens
+    :return: The string if it fits, otherwise the start of it followed by a truncation marker
+    """
+    if count_tokens(text) <= budget:
+        return text
+    budget -= count_tokens(_TRUNCATION_MARKER)
+    if budget < 1:
+        return ""
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:budget]) + _TRUNCATION_MARKER
+
+    tokens = 0
+    end = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        tokens += max(1, math.ceil(len(match.group()) / 4))
+        if tokens > budget:
+            break
+        end = match.end()
+    return text[:end] + _TRUNCATION_MARKER
+
+
+def relevance(text, query):
+    """
+    Cheap lexical relevance of a string to a query
+    :param text: String being scored
+    :param query: String the text should be relevant to
+    :return: The fraction of the text's words that also appear in the query, between 0 and 1
+    """
+    text_words = set(_WORD_PATTERN.findall(text.lower()))
+    if not text_words or not query:
+        return 0.0
+    query_words = set(_WORD_PATTERN.findall(query.lower()))
+    return len(text_words & query_words) / len(text_words)
+
+
+class PromptSection:
+    """
+    A single section of a prompt with a token budget
+    """
+
+    def __init__(self, name, budget, separator="\n"):
+        self.name = name
+        self.budget = budget
+        self.separator = separator
+        # List of (text, render, recency, estimate) tuples in the order they should appear in the prompt
+        self.items = []
+
+    def add(self, text, render=None, recency=1.0, estimate=None):
+        """
+        Add a candidate item to the section
+        :param text: Raw text of the item, used to score it
+        :param render: Optional callable returning the text that goes into the prompt. Only called if selected
+        :param recency: How recent the item is, between 0 (oldest) and 1 (newest)
+        :param estimate: Optional token count of the rendered text, e.g. of a cached render. By default the token count
+        of the raw text, capped at _RENDER_ESTIMATE_CAP
+        :return: Nothing
+        """
+        self.items.append((text, render, recency, estimate))
+
+    def render(self, query=""):
+        """
+        Fill the section with the best scoring items that fit in its budget
+        :param query: String the items should be relevant to (usually the stimulus description)
+        :return: The items that made it in, joined in their original order
+        """
+        scored = []
+        for index, (text, render, recency, _) in enumerate(self.items):
+            score = _RELEVANCE_WEIGHT * relevance(text, query) + _RECENCY_WEIGHT * recency
+            scored.append((score, index))
+        scored.sort(reverse=True)
+
+        selected = {}
+        tokens_left = self.budget
+        separator_tokens = count_tokens(self.separator)
+        for score, index in scored:
+            if tokens_left < 1:
+                break
+            text, render, recency, estimate = self.items[index]
+            # Rendering may be an LLM call, so items estimated not to fit are skipped without rendering
+            if selected and render is not None:
+                if estimate is None:
+                    estimate = min(count_tokens(text), _RENDER_ESTIMATE_CAP)
+                if estimate + separator_tokens > tokens_left:
+                    continue
+            rendered = render() if render is not None else text
+            if not rendered:  # Nothing to say after all, e.g. information without context
+                continue
+            tokens = count_tokens(rendered) + separator_tokens
+            if tokens > tokens_left:
+                if selected:  # Something smaller may still fit
+                    continue
+                rendered = truncate_to_tokens(rendered, tokens_left - separator_tokens)
+                tokens = tokens_left
+            selected[index] = rendered
+            tokens_left -= tokens
+
+        return self.separator.join(selected[index] for index in sorted(selected))
+
+
+class PromptAssembler:
+    """
+    Creates prompt sections using a table of per section token budgets
+    """
+
+    def __init__(self, section_budgets=None):
+        self.section_budgets = dict(_SECTION_BUDGETS)
+        if section_budgets is not None:
+            self.section_budgets.update(section_budgets)
+
+    def section(self, name, separator="\n"):
+        return PromptSection(name, self.section_budgets.get(name, _DEFAULT_BUDGET), separator)
+
+    def fit(self, name, text):
+        """
+        Fit a single string into the budget of a section
+        :param name: Name of the section
+        :param text: Any string
+        :return: The string, truncated if it does not fit the section's budget
+        """
+        return truncate_to_tokens(text, self.section_budgets.get(name, _DEFAULT_BUDGET))
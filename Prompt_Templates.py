@@ -0,0 +1,348 @@
+"""
+Registry of the named prompt templates the agent and the world send to the LLM.
+
+A template is a system prompt and a user prompt, each a list of segments: plain text with str.format fields, Verbose
+text that has a shorter wording, Example text that only illustrates the instruction, and Prefix segments that insert a
+shared system prefix registered once. Every template is compiled once into a full and a minimized variant. The
+minimized variant uses the short wordings, drops the examples and starts with the shared prefixes, so prompts of
+different call sites begin with identical text that providers can cache.
+
+Minimization is off by default so prompts stay exactly as written. token_report() gives the fixed (template) tokens of
+every template in both variants and how often each was rendered, so token volume can be cut one template at a time and
+the saving measured with the benchmark (Benchmark.py --minimize-prompts).
+
+    python Prompt_Templates.py
+"""
+
+import string
+import sys
+import threading
+
+from Prompt_Assembler import count_tokens
+
+_MINIMIZE_PROMPTS = False
+_FORMATTER = string.Formatter()
+
+
+class Verbose:
+    """
+    Text with a shorter wording used by the minimized variant, an empty short wording drops it
+    """
+
+    def __init__(self, text, short=""):
+        self.text = text
+        self.short = short
+
+
+class Example(Verbose):
+    """
+    Illustrates the instruction. Dropped from the minimized variant
+    """
+
+    def __init__(self, text):
+        super().__init__(text, "")
+
+
+class Prefix:
+    """
+    Inserts a shared system prefix registered with PromptRegistry.register_prefix
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+
+class CompiledPrompt:
+    """
+    A format string parsed once
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = [(literal, field) for literal, field, _, _ in _FORMATTER.parse(text)]
+        self.fields = [field for _, field in self.parts if field is not None]
+        self._literal_tokens = None
+
+    @property
+    def literal_tokens(self):
+        """
+        Tokens of the text without its fields, counted on first use so importing the templates doesn't load tiktoken
+        """
+        if self._literal_tokens is None:
+            self._literal_tokens = count_tokens("".join(literal for literal, _ in self.parts))
+        return self._literal_tokens
+
+    def render(self, values):
+        rendered = []
+        for literal, field in self.parts:
+            rendered.append(literal)
+            if field is not None:
+                if field not in values:
+                    raise RuntimeError(f"Prompt field '{field}' was not given a value")
+                rendered.append(str(values[field]))
+        return "".join(rendered)
+
+
+class PromptTemplate:
+    """
+    A named prompt compiled into its full and minimized variants
+    """
+
+    def __init__(self, name, system, user, prefixes):
+        self.name = name
+        self.renders = 0
+        # Variant -> (compiled system prompt, compiled user prompt)
+        self.variants = {minimized: (CompiledPrompt(_join(system, prefixes, minimized)),
+                                     CompiledPrompt(_join(user, prefixes, minimized)))
+                         for minimized in (False, True)}
+
+    def render(self, values, minimized=None):
+        """
+        :param values: Dictionary of field -> value
+        :param minimized: Render the minimized variant, by default when minimization is enabled
+        :return: (system prompt, user prompt) tuple
+        """
+        system, user = self.variants[_MINIMIZE_PROMPTS if minimized is None else minimized]
+        self.renders += 1
+        return system.render(values), user.render(values)
+
+    def fixed_tokens(self, minimized):
+        system, user = self.variants[minimized]
+        return system.literal_tokens + user.literal_tokens
+
+
+def _join(segments, prefixes, minimized):
+    """
+    :return: Text of a list of segments in one variant
+    """
+    if isinstance(segments, (str, Verbose, Prefix)):
+        segments = [segments]
+    leading, text = [], []
+    for segment in segments:
+        if isinstance(segment, Prefix):
+            if segment.name not in prefixes:
+                raise RuntimeError(f"No prompt prefix registered as '{segment.name}'")
+            # The minimized variant puts shared prefixes first so every prompt using them starts the same way
+            (leading if minimized else text).append(prefixes[segment.name])
+        elif isinstance(segment, Verbose):
+            text.append(segment.short if minimized else segment.text)
+        else:
+            text.append(segment)
+    return "".join(leading + text)
+
+
+class PromptRegistry:
+    """
+    Prompt templates by name
+    """
+
+    def __init__(self):
+        self.templates = {}
+        self.prefixes = {}  # Prefix name -> text
+        self._lock = threading.Lock()
+
+    def register_prefix(self, name, text):
+        """
+        Register a system prefix several templates share. Register it before the templates that use it
+        """
+        self.prefixes[name] = text
+
+    def register(self, name, system, user):
+        """
+        Compile and register a template
+
+        :param name: Template name, usually the call site it is sent from
+        :param system: System prompt, a segment or list of segments
+        :param user: User prompt, a segment or list of segments
+        :return: The PromptTemplate
+        """
+        template = PromptTemplate(name, system, user, self.prefixes)
+        with self._lock:
+            self.templates[name] = template
+        return template
+
+    def get(self, name):
+        template = self.templates.get(name)
+        if template is None:
+            raise RuntimeError(f"No prompt template registered as '{name}'")
+        return template
+
+    def render(self, name, **values):
+        """
+        :return: (system prompt, user prompt) tuple of the named template
+        """
+        return self.get(name).render(values)
+
+    def token_report(self):
+        """
+        :return: Dictionary of template name -> fixed tokens of both variants, the saving per render, and renders
+        """
+        report = {}
+        for name, template in sorted(self.templates.items()):
+            full, minimized = template.fixed_tokens(False), template.fixed_tokens(True)
+            report[name] = {
+                "full_tokens": full,
+                "minimized_tokens": minimized,
+                "saved_tokens": full - minimized,
+                "saved_fraction": (full - minimized) / full if full else 0.0,
+                "renders": template.renders,
+                "fields": template.variants[False][0].fields + template.variants[False][1].fields,
+            }
+        return report
+
+    def reset_renders(self):
+        for template in self.templates.values():
+            template.renders = 0
+
+
+def set_prompt_minimization(enabled):
+    global _MINIMIZE_PROMPTS
+    _MINIMIZE_PROMPTS = enabled
+
+
+_PROMPT_REGISTRY = PromptRegistry()
+
+
+def get_prompt_registry():
+    return _PROMPT_REGISTRY
+
+
+def render_prompt(name, **values):
+    """
+    Render a template of the default registry, see PromptRegistry.render
+    """
+    return _PROMPT_REGISTRY.render(name, **values)
+
+
+def token_report():
+    return _PROMPT_REGISTRY.token_report()
+
+
+def print_token_report(report=None):
+    """
+    Print fixed tokens per template before and after minimization
+    :param report: Optional output of token_report, the default registry's by default
+    """
+    report = report if report is not None else token_report()
+    print(f"{'template':<20} {'full':>6} {'minimized':>10} {'saved':>7} {'renders':>8}")
+    for name, row in report.items():
+        print(f"{name:<20} {row['full_tokens']:>6} {row['minimized_tokens']:>10} {row['saved_fraction']:>7.1%} "
+              f"{row['renders']:>8}")
+    full = sum(row["full_tokens"] * row["renders"] for row in report.values())
+    minimized = sum(row["minimized_tokens"] * row["renders"] for row in report.values())
+    if full:
+        print(f"Fixed tokens of the rendered prompts: {full} full, {minimized} minimized ({1 - minimized / full:.1%} "
+              f"saved)")
+
+
+_ACORN_EXAMPLE = Example("As an example, if my information is 'I walked underneath a tree and picked up an acorn' then "
+                         "the possible responses might be: 'throw acorn', 'sigh at acorn', 'stare at acorn', "
+                         "'do nothing'")
+
+_PROMPT_REGISTRY.register_prefix("person", "Pretend you are a person who's internal context will be described by the "
+                                           "user.")
+
+_PROMPT_REGISTRY.register(
+    "contextualize",
+    system=["Create a single sentence by combining some context to explain a piece of information. Response must be "
+            "in the first person."],
+    user=[Verbose("The information is: ", "Information: "), "{information}.\n",
+          Verbose("The context is: ", "Context: "), "{context}.\n",
+          Verbose("Create a sentence in which the context describes ", "Describe "),
+          "{explanation} {explanation_details}.",
+          Verbose(" The phrase '{explanation}' must be used in the sentence.", " Use the phrase '{explanation}'.")])
+
+_PROMPT_REGISTRY.register(
+    "category",
+    system=[Verbose("Select one of the following categories of information: Understood, Spatial, Internal, Emotional, "
+                    "or Social", "Classify the information.")],
+    user=["Understood - Why something exists.\n"
+          "Spatial - Where something exists.\n"
+          "Internal - What I think about something.\n"
+          "Emotional - What I feel about something.\n"
+          "Social - Who is existing\n",
+          Verbose("Based on the provided definitions above, respond with a single word that is the category that",
+                  "Answer with the one category word that "),
+          "{information} best fits into"])
+
+_PROMPT_REGISTRY.register(
+    "relevance_context",
+    system="Respond 'Yes' or 'No' to the user's question",
+    user=[Verbose("Respond yes or no, is ", "Is "),
+          "{information} relevant to {other} within the context of {context}"])
+
+_PROMPT_REGISTRY.register(
+    "relevance_category",
+    system="Respond 'Yes' or 'No' to the user's question",
+    user=[Verbose("Respond yes or no, generally would ", "Generally, would "),
+          "{information} provide {category} context?"])
+
+_PROMPT_REGISTRY.register(
+    "generate_responses",
+    system="Create a comma separated list of possible actions to take by pretending to be someone.",
+    user=[Verbose("Given the following information, create a comma separated list of possible responses if you were "
+                  "the person described.\n"),
+          Verbose("Description of what has just happened:\n", "What just happened:\n"), "{stimulus}\n",
+          Verbose("The person's current context is:\n", "The person's context:\n"), "{context}\n",
+          _ACORN_EXAMPLE])
+
+_PROMPT_REGISTRY.register(
+    "choose_response",
+    system=[Prefix("person"), " Based on that context you will choose one of the possible responses provided by the "
+                              "user."],
+    user=["The following has just happened:\n{stimulus}\n",
+          Verbose("Pretend you are the person with the following context:\n", "Your context:\n"), "{context}\n",
+          Verbose("If you were that person given what has just happened, based on the following list of possible"
+                  "responses which would you do? ", "Which would you do? "),
+          "Possible responses:\n{responses}"])
+
+_PROMPT_REGISTRY.register(
+    "decide",
+    system=[Prefix("person"), " List the possible actions that person could take and choose the one they would do. "
+                              "Answer only with a JSON object of the form "
+                              "{{\"candidates\": [\"action\", ...], \"choice\": \"action\"}}."],
+    user=["The following has just happened:\n{stimulus}\n",
+          Verbose("Pretend you are the person with the following context:\n", "Your context:\n"), "{context}\n",
+          _ACORN_EXAMPLE])
+
+_PROMPT_REGISTRY.register(
+    "compress",
+    system="Combine several pieces of information into a single sentence.",
+    user=[Verbose("Given the following information: \n"), "{context}\n",
+          Verbose("Return a single sentence that includes all of it.")])
+
+_PROMPT_REGISTRY.register(
+    "world_next_state",
+    system=Verbose("You will be provided a description of the current world state. You must provide the user"
+                   "a description of the next world state based on their input.",
+                   "Describe the next world state based on the user's input."),
+    user=[Verbose("This is the current world state description: ", "Current world state: "), "{description}\n",
+          Verbose("Provide a consistent description of the next world state given that ", "Consistently describe "
+                                                                                           "what follows after "),
+          "{action}", Verbose(" has just happened.", ".")])
+
+_PROMPT_REGISTRY.register(
+    "world_parse",
+    system="You will create a comma separated list of 'information pieces' based on the description provided",
+    user=[Verbose("Turn the follow description into a comma separated list of information.\n"), "{description}\n",
+          Example("As an example, if my description is 'A person walked underneath a tree and picked up an acorn' "
+                  "then the list created would be: 'person walking', 'underneath a tree', 'picked up an acorn'")])
+
+_PROMPT_REGISTRY.register(
+    "batch",
+    system=["{system}\n",
+            Verbose("You will be given several numbered tasks. Do each task on its own, as if it were the only one. "
+                    "Answer only with a JSON object mapping every task number to the answer of that task, e.g. "
+                    "{{\"1\": \"answer\", \"2\": \"answer\"}}.",
+                    "Do every numbered task independently. Answer only with a JSON object of task number to answer, "
+                    "e.g. {{\"1\": \"answer\"}}.")],
+    user="{tasks}")
+
+
+def main(argv=None):
+    print_token_report()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+"""
+Approximate-match cache of LLM responses.
+
+Prompts of the idempotent call sites (category, relevance) often differ only trivially, e.g. 'under a tree' instead of
+'underneath a tree' or the same items in another order, so an exact match cache would miss them. Each prompt is reduced
+to a short key (the parts that vary, see LlmQuery's semantic_key), normalized, and each field of the key is embedded as
+a sparse bag of canonical words (lightly stemmed, with words like 'underneath' and 'beneath' meeting at 'under') and
+their character trigrams. Entries live in a local inverted index, so a lookup
+only scores the entries that share a reasonably rare word with the key instead of every cached prompt. A cached
+response is reused when every field's cosine similarity is above the route's threshold. Comparing fields separately
+keeps a long shared field (e.g. the context of a relevance question) from hiding that the short ones differ. Fields
+that differ in negation ('the door is open', 'the door is not open') never match, however many words they share.
+
+Approximate hits can be wrong, so a fraction of them is audited: the call is made anyway and the fresh answer compared
+with the cached one, by their verdict (first word, e.g. 'yes' or a category) for call sites that answer with one and
+by similarity otherwise. Disagreements are counted as false hits and kept as examples for tuning the thresholds.
+"""
+
+import math
+import random
+import re
+import threading
+from collections import OrderedDict, deque
+
+from Information_Table import InformationTable
+
+_MAX_ENTRIES = 4096  # Entries kept per namespace, least recently used first out
+_AUDIT_RATE = 0.05  # Fraction of approximate hits that are checked against a fresh call
+_FALSE_HIT_EXAMPLES = 20  # Most recent false hits kept per call site
+# A word in more than this fraction of a namespace's entries (and at least _COMMON_WORD_MIN_ENTRIES) doesn't make an
+# entry a candidate on its own, so words like 'a' or 'the' don't turn every lookup into a full scan
+_COMMON_WORD_FRACTION = 0.25
+_COMMON_WORD_MIN_ENTRIES = 32
+_ANSWER_SIMILARITY = 0.8  # Audited free text answers this similar to the cached one count as agreeing
+# Words that turn a statement into its opposite, a key field with one never matches a field without
+_NEGATIONS = frozenset({"not", "no", "never", "nothing", "none", "nobody", "nowhere", "neither", "nor", "without"})
+# Words embedded as another word of the same meaning
+_EQUIVALENT_WORDS = {
+    "underneath": "under", "beneath": "under", "below": "under",
+    "atop": "on", "upon": "on", "onto": "on",
+    "beside": "next", "alongside": "next",
+    "inside": "in", "within": "in", "into": "in",
+    "cannot": "not",
+}
+
+_WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def normalize(text):
+    """
+    :return: Lower case words of the text separated by single spaces, without punctuation
+    """
+    return " ".join(_WORD_PATTERN.findall(text.lower()))
+
+
+def verdict(text):
+    """
+    :return: First normalized word of an answer, e.g. 'yes' for 'Yes, it is.', empty for an empty answer
+    """
+    words = normalize(text).split(maxsplit=1)
+    return words[0] if words else ""
+
+
+def _canonical_word(word):
+    """
+    Stem a word the way the fuzzy information table does and map it to its equivalent, so plurals, simple verb forms
+    and reworded prepositions meet
+    """
+    if word.endswith("n't"):
+        return "not"
+    return InformationTable._stem(_EQUIVALENT_WORDS.get(word, word))
+
+
+def embed(text):
+    """
+    Embed a text as a sparse vector of its canonical words and the character trigrams of its words. The trigrams let
+    misspelled or compound words still overlap
+
+    :param text: Any string
+    :return: (dictionary of feature -> weight, norm) tuple
+    """
+    vector = {}
+    for word in normalize(text).split():
+        word = _canonical_word(word)
+        vector["w:" + word] = vector.get("w:" + word, 0) + 1
+        padded = f"#{word}#"
+        for index in range(len(padded) - 2):
+            trigram = padded[index:index + 3]
+            vector[trigram] = vector.get(trigram, 0) + 1
+    return vector, math.sqrt(sum(weight * weight for weight in vector.values()))
+
+
+def cosine(first, second):
+    """
+    :param first: (vector, norm) tuple from embed
+    :param second: (vector, norm) tuple from embed
+    :return: Cosine similarity between 0 and 1
+    """
+    (first_vector, first_norm), (second_vector, second_norm) = first, second
+    if not first_norm or not second_norm:
+        return 0.0
+    if len(first_vector) > len(second_vector):
+        first_vector, second_vector = second_vector, first_vector
+    dot = sum(weight * second_vector.get(feature, 0) for feature, weight in first_vector.items())
+    return dot / (first_norm * second_norm)
+
+
+def _key_fields(key):
+    """
+    :param key: A string or a tuple of strings
+    :return: Tuple of strings
+    """
+    return (key,) if isinstance(key, str) else tuple(key)
+
+
+def _negated(embedding):
+    vector, _ = embedding
+    return any("w:" + word in vector for word in _NEGATIONS)
+
+
+def key_similarity(first, second):
+    """
+    :param first: Tuple of field embeddings
+    :param second: Tuple of field embeddings
+    :return: Lowest cosine similarity of the fields, 0 for keys with different numbers of fields or a field negated in
+        only one of them
+    """
+    if len(first) != len(second):
+        return 0.0
+    if any(_negated(first_field) != _negated(second_field) for first_field, second_field in zip(first, second)):
+        return 0.0
+    return min((cosine(first_field, second_field) for first_field, second_field in zip(first, second)), default=1.0)
+
+
+class CacheEntry:
+    def __init__(self, entry_id, key, normalized, embedding, response):
+        self.entry_id = entry_id
+        self.key = key
+        self.normalized = normalized  # Tuple of the normalized fields of the key
+        self.embedding = embedding  # Tuple of the embeddings of the fields
+        self.response = response
+
+
+class CacheHit:
+    """
+    A cached response similar enough to a lookup's key. If 'audit' is set the caller should make the call anyway and
+    report the fresh answer with SemanticCache.record_audit
+    """
+
+    def __init__(self, call_site, key, entry, similarity, audit):
+        self.call_site = call_site
+        self.key = key
+        self.entry = entry
+        self.similarity = similarity
+        self.audit = audit
+
+    @property
+    def response(self):
+        return self.entry.response
+
+
+class _Namespace:
+    """
+    Entries that may answer each other's lookups, those of one call site with the same system prompt
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()  # Entry id -> CacheEntry, least recently used first
+        self.postings = {}  # (field position, word feature) -> set of entry ids containing it
+        self.exact = {}  # Normalized key fields -> entry id
+
+    def add(self, entry, max_entries):
+        self.entries[entry.entry_id] = entry
+        self.exact[entry.normalized] = entry.entry_id
+        for posting_key in _posting_keys(entry.embedding):
+            self.postings.setdefault(posting_key, set()).add(entry.entry_id)
+        while len(self.entries) > max_entries:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        if self.exact.get(entry.normalized) == entry_id:
+            del self.exact[entry.normalized]
+        for posting_key in _posting_keys(entry.embedding):
+            posting = self.postings.get(posting_key)
+            if posting is not None:
+                posting.discard(entry_id)
+                if not posting:
+                    del self.postings[posting_key]
+
+    def nearest(self, embedding):
+        """
+        :return: (entry, similarity) of the most similar entry sharing a word with the key, (None, 0.0) if there is none
+        """
+        common = max(_COMMON_WORD_MIN_ENTRIES, _COMMON_WORD_FRACTION * len(self.entries))
+        postings = [self.postings[posting_key] for posting_key in _posting_keys(embedding)
+                    if posting_key in self.postings]
+        rare = [posting for posting in postings if len(posting) <= common]
+        candidates = set().union(*(rare or postings))
+
+        best, best_similarity = None, 0.0
+        for entry_id in candidates:
+            entry = self.entries[entry_id]
+            similarity = key_similarity(embedding, entry.embedding)
+            if similarity > best_similarity:
+                best, best_similarity = entry, similarity
+        return best, best_similarity
+
+
+def _posting_keys(embedding):
+    return [(position, feature) for position, (vector, _) in enumerate(embedding) for feature in vector
+            if feature.startswith("w:")]
+
+
+class CallSiteCacheStats:
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.exact_hits = 0
+        self.similarity_total = 0.0  # Sum of the similarity of every hit
+        self.audits = 0  # Approximate hits checked against a fresh call
+        self.false_hits = 0
+        self.false_hit_examples = deque(maxlen=_FALSE_HIT_EXAMPLES)
+
+    def to_dict(self):
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "exact_hits": self.exact_hits,
+            "mean_hit_similarity": self.similarity_total / self.hits if self.hits else None,
+            "audits": self.audits,
+            "false_hits": self.false_hits,
+            "false_hit_rate": self.false_hits / self.audits if self.audits else None,
+            "false_hit_examples": list(self.false_hit_examples),
+        }
+
+
+class SemanticCache:
+    """
+    Responses by approximate prompt key, in separate namespaces
+    """
+
+    def __init__(self, max_entries=_MAX_ENTRIES, audit_rate=_AUDIT_RATE, seed=0):
+        """
+        :param max_entries: Entries kept per namespace
+        :param audit_rate: Fraction of hits that are audited
+        :param seed: Seed deciding which hits are audited, so a run audits the same hits every time
+        """
+        self.max_entries = max_entries
+        self.audit_rate = audit_rate
+        self._random = random.Random(seed)
+        self._namespaces = {}
+        self._stats = {}  # Call site -> CallSiteCacheStats
+        self._entry_ids = 0
+        self._lock = threading.Lock()
+
+    def _get_stats(self, call_site):
+        if call_site not in self._stats:
+            self._stats[call_site] = CallSiteCacheStats()
+        return self._stats[call_site]
+
+    def lookup(self, namespace, call_site, key, threshold):
+        """
+        :param namespace: Hashable id of the entries that may answer the lookup
+        :param call_site: Call site the statistics are kept under
+        :param key: Text, or tuple of texts compared field by field, the cached keys are compared with
+        :param threshold: Minimum cosine similarity of every field of a hit
+        :return: CacheHit, None on a miss
+        """
+        fields = _key_fields(key)
+        normalized = tuple(normalize(field) for field in fields)
+        with self._lock:
+            stats = self._get_stats(call_site)
+            stats.lookups += 1
+            entries = self._namespaces.get(namespace)
+            if entries is None:
+                return None
+
+            entry_id = entries.exact.get(normalized)
+            audit = False
+            if entry_id is not None:  # Same prompt up to case and punctuation, no need to embed or audit it
+                entry, similarity = entries.entries[entry_id], 1.0
+                stats.exact_hits += 1
+            else:
+                entry, similarity = entries.nearest(tuple(embed(field) for field in fields))
+                if entry is None or similarity < threshold:
+                    return None
+                audit = self._random.random() < self.audit_rate
+                stats.audits += audit
+            entries.entries.move_to_end(entry.entry_id)
+            stats.hits += 1
+            stats.similarity_total += similarity
+        return CacheHit(call_site, key, entry, similarity, audit)
+
+    def store(self, namespace, key, response):
+        """
+        Cache a response under a key, replacing an entry with the same normalized key
+        """
+        fields = _key_fields(key)
+        normalized = tuple(normalize(field) for field in fields)
+        embedding = tuple(embed(field) for field in fields)
+        with self._lock:
+            entries = self._namespaces.setdefault(namespace, _Namespace())
+            previous = entries.exact.get(normalized)
+            if previous is not None:
+                entries.remove(previous)
+            self._entry_ids += 1
+            entries.add(CacheEntry(self._entry_ids, key, normalized, embedding, response), self.max_entries)
+
+    def record_audit(self, hit, fresh_answer, by_verdict=False):
+        """
+        Compare the fresh answer of an audited hit with the cached one. A false hit's entry is dropped
+
+        :param hit: The audited CacheHit
+        :param fresh_answer: Text of the response the call returned
+        :param by_verdict: The answers are verdicts ('yes', a category), they agree only if their first words are equal.
+            Similar wording would let 'yes, it is relevant' agree with 'no, it is not relevant'
+        :return: True if the cached answer agreed with the fresh one
+        """
+        cached_answer = hit.response.choices[0].message.content or ""
+        fresh_answer = fresh_answer or ""
+        if by_verdict:
+            agrees = verdict(cached_answer) == verdict(fresh_answer)
+        else:
+            agrees = normalize(cached_answer) == normalize(fresh_answer) or \
+                cosine(embed(cached_answer), embed(fresh_answer)) >= _ANSWER_SIMILARITY
+        if agrees:
+            return True
+        with self._lock:
+            stats = self._get_stats(hit.call_site)
+            stats.false_hits += 1
+            stats.false_hit_examples.append({"key": hit.key, "cached_key": hit.entry.key,
+                                             "similarity": hit.similarity, "cached_answer": cached_answer,
+                                             "fresh_answer": fresh_answer})
+            for entries in self._namespaces.values():
+                if entries.entries.get(hit.entry.entry_id) is hit.entry:
+                    entries.remove(hit.entry.entry_id)
+        return False
+
+    def get_stats(self):
+        """
+        :return: Dictionary with the number of cached 'entries' and 'call_sites', a dictionary of call site -> hit,
+        audit and false hit statistics
+        """
+        with self._lock:
+            return {
+                "entries": sum(len(entries.entries) for entries in self._namespaces.values()),
+                "call_sites": {call_site: stats.to_dict() for call_site, stats in sorted(self._stats.items())},
+            }
+
+    def clear(self):
+        with self._lock:
+            self._namespaces.clear()
+            self._stats.clear()
@@ -0,0 +1,71 @@
+"""
+Single command line entry point for the simulation.
+
+Each command imports only the modules it needs, so 'log' never loads the agent and only 'dashboard' loads tkinter.
+
+    python Simulation.py run
+    python Simulation.py dashboard
+    python Simulation.py benchmark --ticks 10 --import-budget 150
+    python Simulation.py log simulation_log/20240402-120000 --tail
+    python Simulation.py prompts
+    python Simulation.py serve --port 8080 --capacity 8
+"""
+
+import sys
+
+_USAGE = "usage: python Simulation.py {run,dashboard,benchmark,log,prompts,serve} [arguments]"
+
+
+def _run(argv):
+    import State_Control
+    State_Control.main()
+    return 0
+
+
+def _dashboard(argv):
+    import User_interface
+    User_interface.run_dashboard()
+    return 0
+
+
+def _benchmark(argv):
+    import Benchmark
+    return Benchmark.main(argv)
+
+
+def _log(argv):
+    import Event_Log
+    return Event_Log.main(argv)
+
+
+def _prompts(argv):
+    import Prompt_Templates
+    return Prompt_Templates.main(argv)
+
+
+def _serve(argv):
+    import Agent_Service
+    return Agent_Service.main(argv)
+
+
+# Command name -> function taking the remaining arguments and returning the exit code
+_COMMANDS = {
+    "run": _run,
+    "dashboard": _dashboard,
+    "benchmark": _benchmark,
+    "log": _log,
+    "prompts": _prompts,
+    "serve": _serve,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in _COMMANDS:
+        print(_USAGE)
+        return 0 if argv and argv[0] in ("-h", "--help") else 2
+    return _COMMANDS[argv[0]](argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+Runs the stages of a tick as a dependency graph.
+
+Each stage declares the named values it reads (inputs) and the named values it produces (outputs). A stage starts as
+soon as all of its inputs exist, so independent stages run concurrently up to max_parallelism. A stage with 'fan_out'
+is called once per item of its fan-out inputs and every call is scheduled separately, e.g. one classification per
+stimulus. Stages are described by plain dictionaries naming a registered stage function, so a pipeline can be
+reordered or a stage swapped in configuration (or a JSON file) without editing the code that registers the functions.
+
+Every run records per-stage timings and the critical path: the chain of dependent stages that determined the run's
+wall time. Shortening any other stage can't make the tick faster.
+"""
+
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from Tracer import span
+
+_MAX_PARALLELISM = 4
+_STAGE_FUNCTIONS = {}  # Stage function name -> function
+
+
+def register_stage(name):
+    """
+    Decorator registering a stage function under a name that stage configurations can refer to
+    :param name: Name of the stage function
+    """
+
+    def decorator(function):
+        _STAGE_FUNCTIONS[name] = function
+        return function
+
+    return decorator
+
+
+def get_stage_function(name):
+    function = _STAGE_FUNCTIONS.get(name)
+    if function is None:
+        raise RuntimeError(f"No stage function registered as '{name}'")
+    return function
+
+
+def load_stage_config(path):
+    """
+    Read a stage configuration, a JSON list of stage dictionaries (see Stage.from_config)
+    :param path: File path
+    :return: List of stage dictionaries
+    """
+    with open(path) as config_file:
+        return json.load(config_file)
+
+
+class Stage:
+    """
+    A named step of a pipeline. The function is called with the stage's inputs as keyword arguments and returns the
+    value of its output, or a tuple of values if it has several outputs
+    """
+
+    def __init__(self, name, function, inputs=(), outputs=(), fan_out=()):
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        # Inputs that are lists iterated in step. The function is called once per position with those inputs set to
+        # the items, and each output becomes the list of results
+        self.fan_out = tuple(fan_out)
+        for input_name in self.fan_out:
+            if input_name not in self.inputs:
+                raise RuntimeError(f"Stage '{name}' fans out over '{input_name}' which is not one of its inputs")
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        :param config: Dictionary with 'name', 'function' (a registered stage function name, defaults to the stage
+        name), and optional 'inputs', 'outputs' and 'fan_out' lists
+        :return: Stage
+        """
+        function = config.get("function", config["name"])
+        if isinstance(function, str):
+            function = get_stage_function(function)
+        return cls(config["name"], function, config.get("inputs", ()), config.get("outputs", ()),
+                   config.get("fan_out", ()))
+
+
+class StageTiming:
+    """
+    When a stage ran during a StageRun. Times are seconds since the start of the run
+    """
+
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls  # Number of function calls, more than one for a fanned out stage
+        self.ready = 0.0  # When all inputs of the stage existed
+        self.start = None  # When the first call began, later than ready if it waited for a free worker
+        self.end = None
+        self.critical = False
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        return {"calls": self.calls, "ready": self.ready, "start": self.start, "end": self.end,
+                "duration": self.duration, "critical": self.critical}
+
+
+class StageRun:
+    """
+    Values and timings of one run of a StageGraph
+    """
+
+    def __init__(self, values, timings, wall_seconds):
+        self.values = values
+        self.timings = timings  # Stage name -> StageTiming, in the order the stages finished
+        self.wall_seconds = wall_seconds
+        self.critical_path = []  # Stage names from the first to the last stage on the critical path
+
+    @property
+    def critical_path_seconds(self):
+        return sum(self.timings[name].duration for name in self.critical_path)
+
+    def to_dict(self):
+        return {
+            "wall_seconds": self.wall_seconds,
+            "critical_path": list(self.critical_path),
+            "critical_path_seconds": self.critical_path_seconds,
+            "stages": {name: timing.to_dict() for name, timing in self.timings.items()},
+        }
+
+
+class StageGraph:
+    """
+    A set of stages wired together by the names of their inputs and outputs
+    """
+
+    def __init__(self, stages, max_parallelism=_MAX_PARALLELISM):
+        self.stages = [stage if isinstance(stage, Stage) else Stage.from_config(stage) for stage in stages]
+        self.max_parallelism = max_parallelism
+        self._producers = {}  # Output name -> Stage
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in self._producers:
+                    raise RuntimeError(f"'{output}' is produced by both '{self._producers[output].name}' and "
+                                       f"'{stage.name}'")
+                self._producers[output] = stage
+        self._check_acyclic()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _check_acyclic(self):
+        visiting, done = set(), set()
+
+        def visit(stage):
+            if stage.name in done:
+                return
+            if stage.name in visiting:
+                raise RuntimeError(f"Stage '{stage.name}' depends on its own output")
+            visiting.add(stage.name)
+            for input_name in stage.inputs:
+                if input_name in self._producers:
+                    visit(self._producers[input_name])
+            visiting.discard(stage.name)
+            done.add(stage.name)
+
+        for stage in self.stages:
+            visit(stage)
+
+    def run(self, initial_values):
+        """
+        Run every stage
+
+        :param initial_values: Dictionary of the values no stage produces
+        :return: StageRun
+        """
+        for stage in self.stages:
+            for input_name in stage.inputs:
+                if input_name not in self._producers and input_name not in initial_values:
+                    raise RuntimeError(f"Stage '{stage.name}' needs '{input_name}' which nothing provides")
+
+        values = dict(initial_values)
+        timings = {}
+        origin = time.perf_counter()
+        pending = list(self.stages)
+        running = {}  # Future -> (stage, position within the fan out)
+        results = {}  # Stage name -> list of results per fan out position
+        remaining = {}  # Stage name -> number of calls still running
+
+        def clock():
+            return time.perf_counter() - origin
+
+        def start_ready():
+            ready = [stage for stage in pending if all(name in values for name in stage.inputs)]
+            for stage in ready:
+                pending.remove(stage)
+                arguments = [{name: values[name] for name in stage.inputs}]
+                if stage.fan_out:
+                    items = list(zip(*[values[name] for name in stage.fan_out]))
+                    arguments = [dict(arguments[0], **dict(zip(stage.fan_out, item))) for item in items]
+                timing = StageTiming(stage.name, len(arguments))
+                timing.ready = clock()
+                timings[stage.name] = timing
+                results[stage.name] = [None] * len(arguments)
+                remaining[stage.name] = len(arguments)
+                if not arguments:  # Fanned out over empty lists, its outputs are empty lists straight away
+                    finish(stage)
+                    continue
+                for position, kwargs in enumerate(arguments):
+                    running[self._submit(stage, kwargs)] = (stage, position)
+            if ready:  # Finished stages may have made more stages ready
+                start_ready()
+
+        def finish(stage):
+            timing = timings[stage.name]
+            calls = results.pop(stage.name)
+            timing.start = min([call_start - origin for _, call_start, _ in calls], default=timing.ready)
+            timing.end = max([call_end - origin for _, _, call_end in calls], default=timing.ready)
+            stage_results = [result for result, _, _ in calls]
+            if stage.fan_out:
+                outputs = [list(column) for column in zip(*[_as_tuple(result, stage) for result in stage_results])]
+                if not outputs:
+                    outputs = [[] for _ in stage.outputs]
+            else:
+                outputs = _as_tuple(stage_results[0], stage)
+            values.update(zip(stage.outputs, outputs))
+
+        try:
+            start_ready()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, position = running.pop(future)
+                    results[stage.name][position] = future.result()
+                    remaining[stage.name] -= 1
+                    if remaining[stage.name] == 0:
+                        finish(stage)
+                start_ready()
+        finally:
+            for future in running:
+                future.cancel()
+
+        if pending:
+            raise RuntimeError(f"Stages {[stage.name for stage in pending]} never became ready")
+
+        stage_run = StageRun(values, timings, clock())
+        stage_run.critical_path = self._critical_path(timings)
+        return stage_run
+
+    def _submit(self, stage, kwargs):
+        if self.max_parallelism <= 1:  # Run inline, in configuration order on the calling thread
+            future = Future()
+            try:
+                future.set_result(_run_stage(stage, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        # Run in a copy of the caller's context variables, e.g. the LLM tenant (see LLM_Scheduler.tenant_context)
+        return self._get_executor().submit(contextvars.copy_context().run, _run_stage, stage, kwargs)
+
+    def close(self):
+        """
+        Stop the stage threads. A later run starts new ones
+        :return: Nothing
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_parallelism, thread_name_prefix="stage")
+            return self._executor
+
+    def _critical_path(self, timings):
+        """
+        Walk back from the stage that finished last, each time to the input producer that finished last
+        """
+        if not timings:
+            return []
+        stage = max(self.stages, key=lambda stage: timings[stage.name].end)
+        path = []
+        while stage is not None:
+            timings[stage.name].critical = True
+            path.append(stage.name)
+            producers = [self._producers[name] for name in stage.inputs if name in self._producers]
+            stage = max(producers, key=lambda producer: timings[producer.name].end) if producers else None
+        path.reverse()
+        return path
+
+
+def _run_stage(stage, kwargs):
+    """
+    :return: (result, start time, end time) tuple
+    """
+    start = time.perf_counter()
+    with span(f"stage.{stage.name}", category="stage"):
+        result = stage.function(**kwargs)
+    return result, start, time.perf_counter()
+
+
+def _as_tuple(result, stage):
+    if len(stage.outputs) == 1:
+        return (result,)
+    if len(stage.outputs) == 0:
+        return ()
+    return tuple(result)
+
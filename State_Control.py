@@ -16,44 +16,311 @@ Information objects that should be created:
 
 """
 
-from LLM_Controller import LlmQuery
-from World_Generator import WorldState
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from Context_Set import ContextSet, InformationSet
+from Event_Log import EventLog
+from Information_Table import Information, get_information_table, intern_information, \
+    reset_information_table  # reset_information_table is re-exported for callers
+from LLM_Controller import LlmQuery, is_yes
+from LLM_Scheduler import priority_context
+from Memory_Hierarchy import MemoryHierarchy
+from Memory_Profiler import MemoryProfiler
+from Persistent_List import PersistentList
+from Prompt_Assembler import PromptAssembler, count_tokens
+from Prompt_Templates import render_prompt
+from Stage_Executor import StageGraph, register_stage
+from Tracer import span, traced
+from World_Generator import WorldState, match_action
+
+# Temporal contexts older than the most recent _RECENT_TEMPORAL_CONTEXTS are summarized into a single rollup
+# information object for every _ROLLUP_SIZE of them. Prompts are then built from the rollups and the recent contexts.
+_RECENT_TEMPORAL_CONTEXTS = 8
+_ROLLUP_SIZE = 8
+# How an agent decides on a response. 'two_call' generates candidate responses and then chooses one in a second LLM
+# call, 'fused' does both in a single structured call. Only 'two_call' lets the world speculate: a fused decision has
+# its response as soon as it has candidates, so there is no time to get ahead in
+_DECISION_MODE = "two_call"
+_DECISION_MODES = ("two_call", "fused")
+# Resolve the context of new stimuli only when something reads it (see ContextResolver) instead of during the tick. The
+# context string reads the context of the stimuli it has room for, so only those search our memories
+_LAZY_CONTEXT = True
+# Search memories coarse to fine through episodes and eras (see Memory_Hierarchy) instead of asking about every memory
+_HIERARCHICAL_MEMORY = True
+# AgentState snapshots an agent keeps, one per tick. Snapshots share their lists' items (see Persistent_List), so each
+# costs a few objects however long the agent has lived
+_STATE_HISTORY = 8
+# The lists of an AgentState, all append-only PersistentLists
+_AGENT_STATE_LISTS = ("understood_context_list", "spatial_context_list", "emotional_context_list",
+                      "internal_context_list", "social_context_list", "temporal_context_list", "rollup_list")
+# Stages of an agent tick for each decision mode, run by Stage_Executor. A stage starts once its inputs exist, so
+# classifying and finding context for each new stimulus and rolling up old temporal contexts all run concurrently. The
+# inputs nothing produces are provided by Agent.get_response: agent, agent_state, memory, stimulus_list,
+# new_stimulus_list, temporal_count and speculate
+_EAGER_CONTEXT_STAGES = [
+    {"name": "classify", "function": "classify_information", "inputs": ["memory", "new_stimulus_list"],
+     "outputs": ["categories"], "fan_out": ["new_stimulus_list"]},
+    {"name": "relevance", "function": "find_stimulus_context", "inputs": ["memory", "new_stimulus_list", "categories"],
+     "outputs": ["stimulus_contexts"], "fan_out": ["new_stimulus_list", "categories"]},
+    {"name": "assign_context", "function": "assign_stimulus_context",
+     "inputs": ["new_stimulus_list", "stimulus_contexts"], "outputs": ["contextualized_list"]},
+]
+_LAZY_CONTEXT_STAGES = [
+    {"name": "assign_context", "function": "defer_stimulus_context", "inputs": ["memory", "new_stimulus_list"],
+     "outputs": ["contextualized_list"]},
+]
+_STATE_STAGES = [
+    {"name": "rollup", "function": "rollup_temporal_context", "inputs": ["agent", "agent_state", "temporal_count"],
+     "outputs": ["rollup_list"]},
+    {"name": "refactor", "function": "refactor_context",
+     "inputs": ["agent_state", "stimulus_list", "memory", "contextualized_list"], "outputs": ["temporal_context"]},
+    {"name": "context_string", "function": "build_context_string",
+     "inputs": ["agent", "temporal_context", "rollup_list"], "outputs": ["context_string"]},
+]
+_DECISION_STAGES = {
+    "two_call": [
+        {"name": "generate_responses", "function": "generate_response_list", "inputs": ["agent", "context_string"],
+         "outputs": ["response_list"]},
+        # Let the world get a head start on the candidates while we choose
+        {"name": "speculate", "function": "speculate", "inputs": ["speculate", "response_list"]},
+        {"name": "choose_response", "function": "choose_response", "inputs": ["agent", "response_list"],
+         "outputs": ["response"]},
+    ],
+    "fused": [
+        {"name": "decide", "function": "decide", "inputs": ["agent", "context_string"], "outputs": ["response"]},
+    ],
+}
+
+
+def get_agent_stages(decision_mode=_DECISION_MODE, lazy_context=_LAZY_CONTEXT):
+    """
+    :return: List of stage dictionaries of an agent tick
+    """
+    assign_stages = _LAZY_CONTEXT_STAGES if lazy_context else _EAGER_CONTEXT_STAGES
+    return assign_stages + _STATE_STAGES + _DECISION_STAGES[decision_mode]
+
+
+# Maximum number of stages (or fanned out calls of a stage) of one agent tick running at once
+_STAGE_MAX_PARALLELISM = 4
+# Every run of main() logs its ticks to a new EventLog in here
+_EVENT_LOG_DIRECTORY = "simulation_log"
+_MAIN_TICKS = 4
+_MEMORY_PROFILE_EVERY = 100  # Ticks of main() between memory samples (each walks every object), 0 to not sample
+# (information table, context dict, information list) built by get_fundamentals, rebuilt for a new information table
+_FUNDAMENTALS = None
+
+
+class Context:
+    """
+    Information with context.
+    Context can only be created, processed, and manipulated during an AgentState transition.
+    """
+
+    def __init__(self, what):
+        self.what = what  # An information object
+
+    def get_contextualized_information(self):
+        return ""
+
+    def get_information(self):
+        return self.what
+
+    def __str__(self):
+        return f""
+
+
+class UnderstoodContext(Context):
+    """
+    An understood answer to why information is
+    """
+
+    def __init__(self, what, why=None):
+        super().__init__(what)
+        if why is None:
+            why = []
+        self.why = why  # A list of information objects describing why the information exists
+
+    def get_contextualized_information(self):
+        return contextualize_information(self.what, self.why, "is how I know why", "the information exists")
+
+    def get_information(self):
+        return self.why
+
+    def __str__(self):
+        return f""
+
+
+class SpatialContext(Context):
+    """
+    A context that is constructed of information about 'where' something is
+    """
+
+    def __init__(self, what, where=None):
+        super().__init__(what)
+        if where is None:
+            where = []
+        self.where = where  # A list of information objects describing where the information is located
+
+    def get_contextualized_information(self):
+        return contextualize_information(self.what, self.where, "is how I know where", "the information is")
+
+    def get_information(self):
+        return self.where
+
+    def __str__(self):
+        return f""
+
+
+class EmotionalContext(Context):
+    """
+    An emotional context is a context that is constructed of information about how something feels
+    """
+
+    def __init__(self, what, feelings=None):
+        super().__init__(what)
+        if feelings is None:
+            feelings = []
+        self.feelings = feelings  # A list of information objects describing how I feel about the information
 
+    def get_contextualized_information(self):
+        return contextualize_information(self.what, self.feelings, "is why I feel", "the information")
 
-class Information:
+    def get_information(self):
+        return self.feelings
+
+    def __str__(self):
+        return f""
+
+
+class InternalContext(Context):
     """
-    Information is constructed of context (list of links to other information).
-    Information can be created, processed, and manipulated by both an agent and the world.
-    The world can only create information that has no context.
-    An agent can only create information that has context.
+    An internal context is a context that is constructed of information about the internal thoughts about something
     """
 
-    def __init__(self, information, context_of_information=None):
-        if context_of_information is None:
-            context_of_information = []
-        self.value = information  # A string of any information
-        self.context_of_information = context_of_information  # A list of keys for other information that provides context
+    def __init__(self, what, thoughts=None):
+        super().__init__(what)
+        if thoughts is None:
+            thoughts = []
+        self.thoughts = thoughts  # A list of information objects describing my thoughts about the information
+
+    def get_contextualized_information(self):
+        return contextualize_information(self.what, self.thoughts, "is why I think", "the information")
+
+    def get_information(self):
+        return self.thoughts
 
     def __str__(self):
-        return self.value
+        return f""
+
+
+class SocialContext(Context):
+    """
+    A context that is constructed of information about 'who' is the something
+    """
+
+    def __init__(self, what, who=None):
+        super().__init__(what)
+        if who is None:
+            who = []
+        self.who = who  # A list of information objects describing who is relevant to this information
+
+    def get_contextualized_information(self):
+        return contextualize_information(self.what, self.who, "is why this person is", "the information")
+
+    def get_information(self):
+        return self.who
+
+    def __str__(self):
+        return f""
+
+
+class TemporalContext(Context):
+    """
+    A temporal context is a single context constructed from two or more AgentStates
+    """
+
+    def __init__(self, what, agent_state_list=None):
+        super().__init__(what)
+        if agent_state_list is None:
+            agent_state_list = []
+        # The relevant information that existed during the AgentStates
+        self.experienced_information = []
+        self._contextualized = None  # (what, experienced information tuple, contextualized string) of the last call
+
+        if len(agent_state_list) > 0:
+            self.process_agent_state_list(agent_state_list)
+        else:
+            context_dict, info_list = get_fundamentals()
+            self.experienced_information = info_list
+
+    def get_contextualized_information(self):
+        """
+        Contextualized once with the LLM, then reused until what or the experienced information changes
+        """
+        if self.get_cached_contextualized_information() is None:
+            self._contextualized = (self.what, tuple(self.experienced_information),
+                                    contextualize_information(self.what, self.experienced_information, "is when",
+                                                              "I experienced the information"))
+        return self._contextualized[2]
+
+    def get_cached_contextualized_information(self):
+        """
+        :return: The contextualized information if it was already made for the current what and experienced
+        information, None otherwise
+        """
+        if self._contextualized is None or self._contextualized[:2] != (self.what, tuple(self.experienced_information)):
+            return None
+        return self._contextualized[2]
+
+    def merge_temporal_context(self, temporal_context):
+        """
+        This should only happen during memory refactoring
+        process another temporal_context as to absorb/compress it into this one
+
+        :param temporal_context: A temporal context object
+        :return: Nothing
+        """
+
+        return self.experienced_information + self.what
+
+    def process_agent_state_list(self, agent_state_list):
+        """
+        Should take any number of agent states and combine them into this single temporal context
+        :param agent_state_list: List of AgentStates
+        :return: Nothing
+        """
+
+        for agent_state in agent_state_list:
+            self.understood_information += (information_from_context(agent_state.understood_context_list))
+            self.spatial_information += (information_from_context(agent_state.spatial_context_list))
+            self.internal_information += (information_from_context(agent_state.internal_context_list))
+            self.emotional_information += (information_from_context(agent_state.emotional_context_list))
+            self.social_information += (information_from_context(agent_state.social_context_list))
 
 
 def information_from_context(context_list):
     """
     Takes a list of any type of context object and returns just the information objects
     :param context_list: Any kind of context object
-    :return:
+    :return: List of information objects, each once
     """
-    information_list = []
+    information_set = InformationSet()
     for context in context_list:  # Extract all information objects from the context
-        if context.what not in information_list:
-            information_list.append(context.what)  # Returns an information object
-        if context.get_information() not in information_list:
-            information_list += context.get_information()  # Returns a list of information objects
+        information_set.add(context.what)
+        information = context.get_information()  # A list of information objects, the base Context returns 'what'
+        if isinstance(information, list):
+            information_set.update(information)
+        else:
+            information_set.add(information)
 
-    return information_list
+    return information_set.to_list()
 
 
+@traced("agent.contextualize_information")
 def contextualize_information(information, context_information, explanation, explanation_details):
     """
     Takes in an information object, a context list, and a user phrase and then produces
@@ -64,26 +331,22 @@ def contextualize_information(information, context_information, explanation, exp
     :param explanation_details: An extra string used to supplement the explanation
     :return:
     """
-    short_context_list = []
-    for info in context_information:
-        if info.value not in [short_context_list]:
-            short_context_list.append(info.value)
+    short_context_list = InformationSet(context_information).values()
 
-    llm_context = "Create a single sentence by combining some context to explain a piece of information. Response must " \
-                  "be in the first person."
     if len(context_information) < 1:  # If there is no context to a piece of information, it is its own context.
         return information.value
     else:
-        user_input = f"The information is: {information.value}.\nThe context is: {short_context_list}.\n" \
-                     f"Create a sentence in which the context describes {explanation} {explanation_details}." \
-                     f" The phrase '{explanation}' must be used in the sentence."
+        llm_context, user_input = render_prompt("contextualize", information=information.value,
+                                                context=short_context_list, explanation=explanation,
+                                                explanation_details=explanation_details)
     #  print(user_input)
-    llm = LlmQuery(llm_context=llm_context, user_input=user_input)
+    llm = LlmQuery(llm_context=llm_context, user_input=user_input, call_site="contextualize")
     llm.get_response_text()
     #  print(f"Response: {llm.response.choices[0].message.content}\n")
     return llm.response.choices[0].message.content
 
 
+@traced("agent.assign_context")
 def assign_context(information_list, memory_object):
     """
     Using a memory object assign context to the information in the list of information objects
@@ -95,46 +358,161 @@ def assign_context(information_list, memory_object):
     # TODO launch multiple threads ? Current approach is serial, parallel implementation is possible
     for list_index, stimulus in enumerate(information_list):
         #  print(f"Getting context for {stimulus.value}")
-        stimulus.context_of_information, context_time_left = memory_object.get_context(stimulus)
+        stimulus.context_of_information = memory_object.get_context(stimulus)
         information_list[list_index] = stimulus
 
     return information_list
 
 
+class ContextResolver:
+    """
+    Finds the context of information on demand, against the memories as they were on the tick the information was
+    given to the agent. One resolver is made per tick and every resolved result is cached on it, so each stimulus is
+    classified and checked for relevance at most once per tick, and not at all if nothing ever reads its context.
+    """
+    _resolving = threading.local()  # Information each thread is currently resolving, to break cycles
+
+    def __init__(self, memory_object):
+        self.memory_object = memory_object
+        self.memories = memory_object.memories.snapshot()  # The memories as of this tick, later ones don't apply
+        self.resolved = {}  # Information -> list of context objects
+        self._lock = threading.Lock()
+
+    def resolve(self, information):
+        """
+        :param information: Information object
+        :return: List of context objects, None if the information is already being resolved on this thread
+        """
+        context_list = self.resolved.get(information)
+        if context_list is not None:
+            return context_list
+
+        resolving = getattr(self._resolving, "information", None)
+        if resolving is None:
+            resolving = self._resolving.information = set()
+        if information in resolving:  # Its own context search reached it again
+            return None
+
+        # Two threads reading the same information at once may both resolve it, neither waits on the other so a
+        # cycle across threads can't deadlock
+        resolving.add(information)
+        try:
+            with span("agent.resolve_context", category="agent"):
+                context_list = self.memory_object.get_context(information, memories=self.memories)
+        finally:
+            resolving.discard(information)
+
+        with self._lock:
+            return self.resolved.setdefault(information, context_list)
+
+
+def defer_context(information_list, memory_object):
+    """
+    Like assign_context, but the context of each information object is only resolved once it is read
+    :param information_list: List of information objects
+    :param memory_object: AgentMemory object
+    :return: The information list
+    """
+    resolver = ContextResolver(memory_object)
+    for stimulus in information_list:
+        stimulus.defer_context(resolver)
+
+    return information_list
+
+
 class AgentState:
     """
-    Holds the current state of an agent
+    Holds the current state of an agent. Its lists are only ever appended to, so a snapshot shares their items
     """
 
     def __init__(self, understood_context=None, spatial_context=None, emotional_context=None,
                  internal_context=None, social_context=None, temporal_context=None):
         # Lists of our current context
-        self.understood_context_list = [understood_context]
-        self.spatial_context_list = [spatial_context]
-        self.emotional_context_list = [emotional_context]
-        self.internal_context_list = [internal_context]
-        self.social_context_list = [social_context]
-        self.temporal_context_list = [temporal_context]
+        self.understood_context_list = PersistentList([understood_context])
+        self.spatial_context_list = PersistentList([spatial_context])
+        self.emotional_context_list = PersistentList([emotional_context])
+        self.internal_context_list = PersistentList([internal_context])
+        self.social_context_list = PersistentList([social_context])
+        self.temporal_context_list = PersistentList([temporal_context])
+
+        # Summaries of the oldest temporal contexts, each covering _ROLLUP_SIZE of them
+        self.rollup_list = PersistentList()
+        self.rolled_up_count = 0  # How many temporal contexts from the start of the list have been rolled up
+
+    def snapshot(self):
+        """
+        Constant time copy of this state. Later changes to either state don't show in the other
+        :return: AgentState
+        """
+        state = AgentState.__new__(AgentState)
+        for name in _AGENT_STATE_LISTS:
+            setattr(state, name, getattr(self, name).snapshot())
+        state.rolled_up_count = self.rolled_up_count
+        return state
 
-    def update_context(self, stimulus_list, memory_object):
+    def diff(self, previous):
+        """
+        :param previous: An earlier AgentState, e.g. a snapshot of this one
+        :return: Dictionary of list name -> list of the items added since the previous state, only the lists that grew
+        """
+        diff = {}
+        for name in _AGENT_STATE_LISTS:
+            added = getattr(self, name).added_since(getattr(previous, name))
+            if added:
+                diff[name] = added
+        return diff
+
+    @traced("agent.update_context")
+    def update_context(self, stimulus_list, memory_object, new_stimulus_list=None):
+        """
+        :param stimulus_list: Every information object the world currently provides
+        :param memory_object: AgentMemory object
+        :param new_stimulus_list: The information objects in stimulus_list that have not been contextualized yet. The
+        rest keep the context they were given on an earlier tick. Defaults to all of stimulus_list
+        """
+        if new_stimulus_list is None:
+            new_stimulus_list = stimulus_list
 
         # Contextualize the new information in the stimulus list as much as we can
-        contextualized_stimulus_list = assign_context(stimulus_list, memory_object)
+        assign_context(new_stimulus_list, memory_object)
 
         # Update and compress our current context with the new information
-        return self._refactor_context(contextualized_stimulus_list, memory_object)
+        return self._refactor_context(stimulus_list, memory_object)
 
+    @traced("agent.refactor_context")
     def _refactor_context(self, stimulus_list, memory_object):
 
         # Add the contextualized information to our AgentState
-        new_temp = TemporalContext(Information("Is currently happening", self.temporal_context_list))
+        # The moment is the agent's own information, its context (our earlier moments) stays off the canonical nodes
+        new_temp = TemporalContext(Information("Is currently happening", self.temporal_context_list.snapshot()))
         new_temp.experienced_information = stimulus_list
         self.temporal_context_list.append(new_temp)
 
         # Compress our current context
         # TODO Launch threads ?
 
-        return 0
+        return new_temp
+
+    @traced("agent.rollup_temporal_context")
+    def rollup_temporal_context(self, prompt_assembler=None, temporal_count=None):
+        """
+        Summarize temporal contexts that have fallen out of the recent window. Each rollup is only created once so
+        building a prompt never has to contextualize more than the recent temporal contexts.
+
+        :param prompt_assembler: Optional PromptAssembler used to budget the compression prompts
+        :param temporal_count: Optional number of temporal contexts to consider, so a rollup running concurrently with
+        the refactor stage doesn't depend on whether this tick's context was appended yet
+        :return: Nothing
+        """
+        if temporal_count is None:
+            temporal_count = len(self.temporal_context_list)
+        while temporal_count - self.rolled_up_count - _RECENT_TEMPORAL_CONTEXTS >= _ROLLUP_SIZE:
+            rollup_contexts = self.temporal_context_list[self.rolled_up_count:self.rolled_up_count + _ROLLUP_SIZE]
+            with priority_context("foreground"):  # The tick's context string waits on the rollup
+                compressed_information, time_overflow = compress_context([context for context in rollup_contexts
+                                                                          if context is not None], prompt_assembler)
+            self.rollup_list.append(compressed_information)
+            self.rolled_up_count += _ROLLUP_SIZE
 
 
 class AgentMemory:
@@ -142,13 +520,25 @@ class AgentMemory:
     An agent's memories
     """
 
-    def __init__(self):
-        self.memories = []  # A list of temporal contexts
-
+    def __init__(self, hierarchical=None):
+        """
+        :param hierarchical: Search memories through a MemoryHierarchy instead of scanning every one of them,
+        _HIERARCHICAL_MEMORY by default
+        """
+        self.memories = PersistentList()  # A list of temporal contexts, each stored once
+        self._stored_contexts = PersistentList()  # Snapshot of the temporal contexts of the latest state stored
+        if hierarchical is None:
+            hierarchical = _HIERARCHICAL_MEMORY
+        # Moments, episodes and eras over the memories, kept up to date with the list when searched
+        self.hierarchy = MemoryHierarchy() if hierarchical else None
+
+    @traced("agent.memory_store")
     def store(self, agent_state, response):
         # TODO Process agent state as to only store context and information
         # TODO include response in memory storage
-        self.memories += agent_state.temporal_context_list
+        # The temporal contexts stored before are already in our memories, only add the ones since
+        self.memories += agent_state.temporal_context_list.added_since(self._stored_contexts)
+        self._stored_contexts = agent_state.temporal_context_list.snapshot()
 
     def refactor(self):
         # TODO refactor
@@ -157,69 +547,163 @@ class AgentMemory:
         for memory in self.memories:  # For now just merge all temporal contexts
             memory.merge_temporal_context(previous_memory)
 
-    def get_context(self, information):
+    @traced("agent.get_context")
+    def get_context(self, information, category=None, memories=None):
         """
         Returns a list of as many relevant context objects we can find in the time allowed for the information object
         :param information: Information we are retrieving context for
+        :param category: Category of the information if already known, see get_category
+        :param memories: Optional list of temporal contexts to search instead of all of our memories. With hierarchical
+        memory it must be a snapshot of our memories, only the memories stored before it was taken are searched
         :return: A list of context objects
         """
-        context_list = []
+        if category is None:
+            category = self.get_category(information)
+
+        if memories is None:
+            memories = self.memories
+        if self.hierarchy is not None:
+            self.hierarchy.sync(self.memories)
+            memories = self.hierarchy.search(information.value, before=len(memories))
+
+        # Asked about all the memories at once, so their questions can be packed together (see LlmQuery.batch)
+        # Information experienced in several memories is only asked about once
+        information_set = InformationSet()
+        for memory in memories:
+            information_set.update(memory.experienced_information)
+        return get_relevant_context(information, information_set.to_list(), category)
+
+    def get_summaries(self, level=1):
+        """
+        Summary information of every node on a level of the memory hierarchy, made with the LLM the first time
+        :param level: 1 for episodes, 2 for eras
+        :return: List of information objects, oldest first
+        """
+        if self.hierarchy is None:
+            raise RuntimeError("Memory summaries need hierarchical memory")
+        self.hierarchy.sync(self.memories)
+        if level >= len(self.hierarchy.levels):
+            return []
+        with priority_context("background"):  # Consolidation, nothing in a tick waits on it
+            return [node.get_summary(summarize_memories) for node in self.hierarchy.levels[level]]
+
+    @traced("agent.get_category")
+    def get_category(self, information):
+        """
+        Ask the LLM which category of information the information is
+        :param information: Information object
+        :return: The category, e.g. 'Spatial'
+        """
         # print(f"Assigning context for {information}")
         # Ask LLM what type of information this is
-        llm_context = "Select one of the following categories of information: Understood, Spatial, Internal, " \
-                      "Emotional, or Social"
-        user_input = f"Understood - Why something exists.\n" \
-                     f"Spatial - Where something exists.\n" \
-                     f"Internal - What I think about something.\n" \
-                     f"Emotional - What I feel about something.\n" \
-                     f"Social - Who is existing\n" \
-                     f"Based on the provided definitions above, respond with a single word that is the category that" \
-                     f"{information} best fits into"
-
-        llm = LlmQuery(llm_context=llm_context, user_input=user_input)
+        llm_context, user_input = render_prompt("category", information=information)
+
+        llm = LlmQuery(llm_context=llm_context, user_input=user_input, call_site="category",
+                       semantic_key=str(information))
         llm.get_response_text()
 
-        category = llm.response.choices[0].message.content
-        for memory in self.memories:
-            for context in get_relevant_context(information, memory.experienced_information, category):
-                if context not in context_list:
-                    context_list.append(context)
+        return llm.response.choices[0].message.content
+
+
+def summarize_memories(items):
+    """
+    Compress the temporal contexts of an episode, or the summaries of the episodes of an era, into one information
+    :param items: List of temporal contexts or information objects
+    :return: Information object
+    """
+    contexts = [item if isinstance(item, Context) else _summary_context(item) for item in items]
+    return compress_context(contexts)[0]
+
 
-        return context_list
+def _summary_context(summary):
+    """
+    Temporal context of an episode or era summary. What was experienced is the summary itself, not the fundamentals a
+    new TemporalContext starts with, and it is described by its own value instead of being contextualized again
+    :param summary: Information object made by summarize_memories
+    :return: TemporalContext
+    """
+    context = TemporalContext(summary)
+    context.experienced_information = [summary]
+    context._contextualized = (summary, (summary,), summary.value)
+    return context
 
 
+def get_fundamentals():
+    """
+    Helper function that returns existential information and context objects used to construct the base of context trees
+    The information is interned, so the base is only built once and every caller shares the same objects.
+    :return:
+    """
+    global _FUNDAMENTALS
+    if _FUNDAMENTALS is not None and _FUNDAMENTALS[0] is get_information_table():
+        table, existence_context_dict, existence_information_list = _FUNDAMENTALS
+        return dict(existence_context_dict), list(existence_information_list)
+
+    existence_context_dict = {}
+    # Basic information all agent's poof into existence with
+    existence_understood = intern_information("Something exists at all")
+    existence_internal = intern_information("I exist")
+    existence_emotional = intern_information("I feel like I exist")
+    existence_spatial = intern_information("I exist somewhere")
+    existence_social = intern_information("There is someone who I am")
+    existence_temporal = intern_information("this current moment")
+    existence_information_list = [existence_temporal, existence_understood, existence_internal, existence_emotional,
+                                  existence_spatial, existence_social]
+
+    # The base context and information forms a closed loop
+    existence_context_dict['understood'] = UnderstoodContext(existence_understood, existence_information_list)
+    existence_context_dict['internal'] = InternalContext(existence_internal, existence_information_list)
+    existence_context_dict['emotional'] = EmotionalContext(existence_emotional, existence_information_list)
+    existence_context_dict['spatial'] = SpatialContext(existence_spatial, existence_information_list)
+    existence_context_dict['social'] = SocialContext(existence_social, existence_information_list)
+
+    for info in existence_information_list:
+        for context in existence_context_dict.values():
+            info.context_of_information.append(context)
+
+    _FUNDAMENTALS = (get_information_table(), existence_context_dict, existence_information_list)
+    return dict(existence_context_dict), list(existence_information_list)
+
+
+@traced("agent.get_relevant_context")
 def get_relevant_context(information, information_list, category):
     """
     Takes an information object and searches an information list for relevant context
     :param information: Information object
     :param information_list: List of information objects that may hold context relevant to the information
     :param category: The category of context
-    :return: List of context objects that are relevant to the information
+    :return: List of context objects that are relevant to the information, each once
     """
-    context_list = []
-    llm_context = "Respond 'Yes' or 'No' to the user's question"
-    # print(information_list)
+    if not information_list:
+        return []
+
+    # Whether the category gives context doesn't depend on the information object, so it is asked once
+    llm_context, user_input = render_prompt("relevance_category", information=information.value, category=category)
+    llm = LlmQuery(llm_context=llm_context, user_input=user_input, call_site="relevance",
+                   semantic_key=(information.value, category))
+    llm.get_response_text()
+    if not is_yes(llm.response.choices[0].message.content):
+        return []
+
+    queries = []
     for info_obj in information_list:
-        # print(info_obj)
         context_str = ""
         for context_obj in info_obj.context_of_information:
             context_str += f"{context_obj.what}, "
 
-        user_input = f"Respond yes or no, is {information.value} relevant to {info_obj.value} within the context of " \
-                     f"{context_str}"
-        llm = LlmQuery(llm_context=llm_context, user_input=user_input)
-        llm.get_response_text()
-        first_response = llm.response.choices[0].message.content.lower()
-
-        user_input = f"Respond yes or no, generally would {information.value} provide {category} context?"
-        llm = LlmQuery(llm_context=llm_context, user_input=user_input)
-        llm.get_response_text()
+        llm_context, user_input = render_prompt("relevance_context", information=information.value,
+                                                other=info_obj.value, context=context_str)
+        queries.append(LlmQuery(llm_context=llm_context, user_input=user_input, call_site="relevance",
+                                semantic_key=(information.value, info_obj.value, context_str)))
+    # The yes/no questions are independent, so they are packed into as few requests as fit
+    LlmQuery.batch(queries)
 
-        if 'yes' in llm.response.choices[0].message.content.lower() and 'yes' in first_response.lower():
-            # print(f"Adding {len(info_obj.context_of_information)} context objects to {information}")
-            context_list += info_obj.context_of_information
+    context_set = ContextSet()
+    for info_obj, llm in zip(information_list, queries):
+        if is_yes(llm.response.choices[0].message.content):
+            context_set.update(info_obj.context_of_information)
 
-    return context_list
+    return context_set.to_list()
 
 
 class Agent:
@@ -227,127 +711,374 @@ class Agent:
     An agent that can independently interact with the world
     """
 
-    def __init__(self):
-        self.previous_agent_state = AgentState()  # The AgentState just before our current one
+    def __init__(self, section_budgets=None, decision_mode=None, stage_config=None, max_parallelism=None,
+                 lazy_context=None, hierarchical_memory=None):
+        """
+        :param section_budgets: Optional token budgets of the prompt sections, see PromptAssembler
+        :param decision_mode: 'two_call' or 'fused', see _DECISION_MODE
+        :param stage_config: Optional list of stage dictionaries replacing the stages of the decision mode, see
+        get_agent_stages and Stage_Executor
+        :param max_parallelism: Optional maximum number of stages running at once, 1 runs them one after the other
+        :param lazy_context: Resolve the context of stimuli only when it is read, see _LAZY_CONTEXT
+        :param hierarchical_memory: Search memories through episodes and eras, see _HIERARCHICAL_MEMORY
+        """
+        if decision_mode is None:
+            decision_mode = _DECISION_MODE
+        if decision_mode not in _DECISION_MODES:
+            raise RuntimeError(f"Unknown decision mode '{decision_mode}', expected one of {_DECISION_MODES}")
+        self.decision_mode = decision_mode
+        if stage_config is None:
+            stage_config = get_agent_stages(decision_mode, _LAZY_CONTEXT if lazy_context is None else lazy_context)
+        self.stage_graph = StageGraph(stage_config,
+                                      max_parallelism if max_parallelism is not None else _STAGE_MAX_PARALLELISM)
+        self.last_stage_run = None  # StageRun of the latest tick, with per stage timings and the critical path
+        self.previous_agent_state = AgentState()  # Snapshot of the AgentState just before our current one
         self.current_agent_state = AgentState()  # The agent's current informational context
-        self.memories = AgentMemory()  # The agent's memories
+        self.state_history = deque(maxlen=_STATE_HISTORY)  # Snapshots of the AgentState after each tick, oldest first
+        self.memories = AgentMemory(hierarchical_memory)  # The agent's memories
         self.stimulus_list = []  # The current stimulus provided by the world
+        self.new_stimulus_list = []  # The part of the stimulus list that is new since the last tick
         self.stimulus_description = ""  # A description of the stimulus list
+        self.response_list = []  # The possible responses generated for the current stimulus
+        self.current_context_string = ""  # Token budgeted description of our current context
+        self.prompt_assembler = PromptAssembler(section_budgets)  # Keeps every prompt at a fixed size
 
         context_dict, info_list = get_fundamentals()
 
         temporal_context = TemporalContext(info_list[0])  # info_list[0] selects the temporal information object
 
-        self.previous_agent_state = AgentState(temporal_context=temporal_context)
-        # print(f"Initialize Agent1: {self.previous_agent_state.temporal_context_list}")
-        self.current_agent_state = self.previous_agent_state  # All we know and have ever known is that we exist
-        # print(f"Initialize Agent2: {self.current_agent_state.temporal_context_list}")
+        self.current_agent_state = AgentState(temporal_context=temporal_context)
+        # print(f"Initialize Agent1: {self.current_agent_state.temporal_context_list}")
+        # All we know and have ever known is that we exist
+        self.previous_agent_state = self.current_agent_state.snapshot()
+        # print(f"Initialize Agent2: {self.previous_agent_state.temporal_context_list}")
+
+    def close(self):
+        """
+        Stop the threads the agent's stages run on
+        :return: Nothing
+        """
+        self.stage_graph.close()
 
-    def process_stimulus(self, stimulus_description, stimulus_list):  # Process an input from the world
+    @traced("agent.process_stimulus")
+    def process_stimulus(self, stimulus_description, stimulus_list, speculate=None,
+                         new_stimulus_list=None):  # Process an input from the world
+        """
+        :param stimulus_description: A description of the stimulus list
+        :param stimulus_list: List of information objects provided by the world
+        :param speculate: Optional callable given the candidate responses as soon as they exist (see
+        WorldState.speculate) so the world can start generating while we choose. Unused by fused decisions
+        :param new_stimulus_list: Optional part of stimulus_list that still needs context, defaults to all of it
+        :return: The chosen response
+        """
 
         self.stimulus_list = stimulus_list
+        self.new_stimulus_list = stimulus_list if new_stimulus_list is None else new_stimulus_list
         self.stimulus_description = stimulus_description  # TODO Propagate stimulus_description into update_context
 
         # Process the stimulus and change our current AgentState
-        response = self.get_response()
+        response = self.get_response(speculate)
+
+        # Snapshot the state we reached, later ticks keep changing the current one
+        agent_state = self.current_agent_state.snapshot()
 
         # Record the response we chose
-        self.memories.store(self.current_agent_state, response)
+        self.memories.store(agent_state, response)
 
         # Refactor our memory if we have any time left to process (will usually happen during downtime)
         # self.memories.refactor()
 
         # Update our previous agent state to create a perfect memory of the 'moment' just before this one
-        self.previous_agent_state = self.current_agent_state
+        self.previous_agent_state = agent_state
+        self.state_history.append(agent_state)
 
         return response
 
-    def get_response(self):
-
-        # Process information to update the AgentState based on our current AgentState and the stimulus
-        self.current_agent_state.update_context(self.stimulus_list, self.memories)
-
-        # Now that we have the updated context determine how the agent could respond
-        response_list = self._generate_response_list()
-
-        # Choose a response based on our AgentState
-        response = self._choose_response(response_list)
+    def process_world_delta(self, stimulus_description, world_delta, speculate=None):
+        """
+        Process only what changed in the world. Information that is unchanged since the last tick is the same object
+        we already contextualized, so only the added information is given context.
 
-        return response
+        :param stimulus_description: A description of the current world state
+        :param world_delta: WorldDelta between the previous and current world state
+        :param speculate: See process_stimulus
+        :return: The chosen response
+        """
+        return self.process_stimulus(stimulus_description, world_delta.unchanged + world_delta.added, speculate,
+                                     world_delta.added)
 
+    @traced("agent.get_response")
+    def get_response(self, speculate=None):
+        """
+        Update our AgentState with the stimulus and decide on a response by running the stages of a tick
+        :param speculate: See process_stimulus
+        :return: The chosen response
+        """
+        agent_state = self.current_agent_state
+        self.last_stage_run = self.stage_graph.run({
+            "agent": self,
+            "agent_state": agent_state,
+            "memory": self.memories,
+            "stimulus_list": self.stimulus_list,
+            "new_stimulus_list": self.new_stimulus_list,
+            "temporal_count": len(agent_state.temporal_context_list),
+            "speculate": speculate,
+        })
+
+        return self.last_stage_run.values["response"]
+
+    @traced("agent.generate_response_list")
     def _generate_response_list(self):
         """
         Using an LLM generate a list of possible responses
         :return:
         """
         response_list = []
-        current_context_string = ""
-        # print(self.current_agent_state.temporal_context_list)
-        for temporal_context in self.current_agent_state.temporal_context_list:
-            current_context_string += f"{temporal_context.get_contextualized_information()}.\n"
+        current_context_string = self.current_context_string
 
         # print(f"Generating response list... Current context string: \n    {current_context_string}\n")
         # TODO this needs to use the function selector LLM since we want to be able to correctly parse actions
-        llm_context = "Create a comma separated list of possible actions to take by pretending to be someone."
-        user_input = f"Given the following information, create a comma separated list of possible responses if you were" \
-                     f" the person described.\n" \
-                     f"Description of what has just happened:\n{self.stimulus_description}\n" \
-                     f"The person's current context is:\n{current_context_string}\n" \
-                     f"As an example, if my information is 'I walked underneath a tree and picked up an acorn' " \
-                     f"then the possible responses might be: 'throw acorn', 'sigh at acorn', 'stare at acorn', " \
-                     f"'do nothing'"
-
-        llm_query = LlmQuery(llm_context=llm_context, user_input=user_input)
+        llm_context, user_input = render_prompt(
+            "generate_responses", stimulus=self.prompt_assembler.fit('stimulus', self.stimulus_description),
+            context=current_context_string)
+
+        llm_query = LlmQuery(llm_context=llm_context, user_input=user_input, call_site="generate_responses")
         llm_query.get_response_text()
 
-        self.response_list = llm_query.response.choices[0].message.content.split(", ")
+        response_list = [response.strip() for response in llm_query.response.choices[0].message.content.split(",")
+                         if response.strip()]
+        self.response_list = response_list
 
         return response_list
 
+    @traced("agent.choose_response")
     def _choose_response(self, response_list):
         """
         Using an LLM choose one of the possible responses to use based on the context
         :param response_list: A list of possible responses to return
         :return:
         """
-        current_context_string = ""
-        for temporal_context in self.current_agent_state.temporal_context_list:
-            current_context_string += f"{temporal_context.get_contextualized_information()}.\n"
+        current_context_string = self.current_context_string
 
-        llm_context = "Pretend you are a person who's internal context will be described by the user. Based on that " \
-                      "context you will choose one of the possible responses provided by the user."
-        user_input = f"The following has just happened:\n{self.stimulus_description}\n" \
-                     f"Pretend you are the person with the following context:\n{current_context_string}\n" \
-                     f"If you were that person given what has just happened, based on the following list of possible" \
-                     f"responses which would you do? Possible responses:\n{response_list}"
+        candidates = self.prompt_assembler.section("candidates", separator=", ")
+        for response in response_list:
+            candidates.add(response)
+        response_string = candidates.render(self.stimulus_description)
 
-        llm_query = LlmQuery(llm_context=llm_context, user_input=user_input)
+        llm_context, user_input = render_prompt(
+            "choose_response", stimulus=self.prompt_assembler.fit('stimulus', self.stimulus_description),
+            context=current_context_string, responses=response_string)
+
+        llm_query = LlmQuery(llm_context=llm_context, user_input=user_input, call_site="choose_response")
         llm_query.get_response_text()
 
         response = llm_query.response.choices[0].message.content
 
+        # The candidate the answer names, so it is the action the world may have speculated on
+        return match_action(response, response_list) or response
+
+    @traced("agent.decide")
+    def _decide(self):
+        """
+        Using a single LLM call generate possible responses and choose one of them. The candidates are kept in
+        self.response_list for logging
+        :return: The chosen response
+        """
+        llm_context, user_input = render_prompt(
+            "decide", stimulus=self.prompt_assembler.fit('stimulus', self.stimulus_description),
+            context=self.current_context_string)
+
+        llm_query = LlmQuery(llm_context=llm_context, user_input=user_input, call_site="decide")
+        llm_query.get_response_text()
+
+        self.response_list, response = _parse_decision(llm_query.response.choices[0].message.content)
+
         return response
 
+    @traced("agent.build_context_string")
+    def _build_context_string(self, rollup=True):
+        """
+        Build the description of our current context used by the response prompts. Older temporal contexts are
+        represented by their rollups and everything is fit into the 'temporal' token budget by relevance to the
+        stimulus and recency. What the stimuli remind us of follows, fit into the 'memories' budget. Reading a
+        stimulus's context resolves it when it is lazy, so only the stimuli that fit search our memories.
+        :param rollup: Roll up old temporal contexts first, False if the rollup stage already did
+        :return: String of contextualized information, one per line
+        """
+        agent_state = self.current_agent_state
+        if rollup:
+            agent_state.rollup_temporal_context(self.prompt_assembler)
+
+        recent_contexts = [context for context in agent_state.temporal_context_list[agent_state.rolled_up_count:]
+                           if context is not None]
+        item_count = len(agent_state.rollup_list) + len(recent_contexts)
+
+        section = self.prompt_assembler.section("temporal")
+        for index, rollup in enumerate(agent_state.rollup_list):
+            section.add(f"{rollup.value}.", recency=(index + 1) / item_count)
+        for index, context in enumerate(recent_contexts):
+            raw_text = " ".join([context.what.value] + [info.value for info in context.experienced_information])
+            # An already contextualized context is estimated by its actual size rather than its raw information
+            cached = context.get_cached_contextualized_information()
+            section.add(raw_text, render=lambda context=context: f"{context.get_contextualized_information()}.",
+                        recency=(len(agent_state.rollup_list) + index + 1) / item_count,
+                        estimate=count_tokens(f"{cached}.") if cached is not None else None)
+        context_string = section.render(self.stimulus_description)
+
+        new_stimuli = set(self.new_stimulus_list)
+        memory_section = self.prompt_assembler.section("memories")
+        for stimulus in self.stimulus_list:
+            memory_section.add(stimulus.value, render=lambda stimulus=stimulus: _describe_context(stimulus),
+                               recency=1.0 if stimulus in new_stimuli else 0.5)
+        memories = memory_section.render(self.stimulus_description)
+
+        return f"{context_string}\n{memories}" if memories else context_string
+
+
+def _describe_context(information):
+    """
+    :return: A line naming what the information's context is about, empty if it has no context
+    """
+    context_list = information.context_of_information
+    if not context_list:
+        return ""
+    reminders = InformationSet(context.what for context in context_list).values()
+    return f"{information.value} reminds me of {', '.join(reminders)}."
+
+
+@register_stage("classify_information")
+def _classify_information(memory, new_stimulus_list):
+    return memory.get_category(new_stimulus_list)
+
+
+@register_stage("find_stimulus_context")
+def _find_stimulus_context(memory, new_stimulus_list, categories):
+    return memory.get_context(new_stimulus_list, categories)
+
+
+@register_stage("assign_stimulus_context")
+def _assign_stimulus_context(new_stimulus_list, stimulus_contexts):
+    for stimulus, context_list in zip(new_stimulus_list, stimulus_contexts):
+        stimulus.context_of_information = context_list
+    return new_stimulus_list
+
+
+@register_stage("defer_stimulus_context")
+def _defer_stimulus_context(memory, new_stimulus_list):
+    return defer_context(new_stimulus_list, memory)
+
+
+@register_stage("rollup_temporal_context")
+def _rollup_temporal_context(agent, agent_state, temporal_count):
+    agent_state.rollup_temporal_context(agent.prompt_assembler, temporal_count)
+    return agent_state.rollup_list
+
+
+@register_stage("refactor_context")
+def _refactor_context(agent_state, stimulus_list, memory, contextualized_list):
+    return agent_state._refactor_context(stimulus_list, memory)
+
+
+@register_stage("build_context_string")
+def _build_context_string(agent, temporal_context, rollup_list):
+    agent.current_context_string = agent._build_context_string(rollup=False)
+    return agent.current_context_string
+
+
+@register_stage("generate_response_list")
+def _generate_response_list(agent, context_string):
+    return agent._generate_response_list()
+
+
+@register_stage("choose_response")
+def _choose_response(agent, response_list):
+    return agent._choose_response(response_list)
 
-def compress_context(list_of_context):
+
+@register_stage("decide")
+def _decide(agent, context_string):
+    return agent._decide()
+
+
+@register_stage("speculate")
+def _speculate(speculate, response_list):
+    if speculate is not None:
+        speculate(response_list)
+
+
+def _parse_decision(text):
+    """
+    Parse the JSON object of a fused decision. A response that isn't the requested JSON is used as the choice itself,
+    candidates that aren't a list are replaced by the choice
+    :param text: Text of the LLM response
+    :return: (list of candidate responses, chosen response) tuple
+    """
+    try:
+        decision = json.loads(text[text.index("{"):text.rindex("}") + 1])
+        choice = str(decision["choice"]).strip()
+        candidates = decision.get("candidates")
+    except (ValueError, KeyError, AttributeError, TypeError):
+        return [], text.strip()
+
+    if not isinstance(candidates, list):  # A string would otherwise become a candidate per character
+        return [choice], choice
+    return [str(candidate).strip() for candidate in candidates], choice
+
+
+@traced("agent.compress_context")
+def compress_context(list_of_context, prompt_assembler=None):
     """
     Takes a list of context objects of the same type and compresses them into a single context object of that type
+    :param list_of_context: List of context objects
+    :param prompt_assembler: Optional PromptAssembler, the 'compress' section budget limits the prompt size
     :return: Returns an information object whose value is a string describing the compressed context
     """
+    if prompt_assembler is None:
+        prompt_assembler = PromptAssembler()
 
-    context_string = ""
-    for context in list_of_context:
-        context_string += f"{context.get_contextualized_information()}. "
-    llm_context = "Combine several pieces of information into a single sentence."
-    user_input = f"Given the following information: \n{context_string}\n" \
-                 f"Return a single sentence that includes all of it."
+    section = prompt_assembler.section("compress", separator=". ")
+    for index, context in enumerate(list_of_context):
+        section.add(context.what.value, render=context.get_contextualized_information,
+                    recency=(index + 1) / len(list_of_context))
+    context_string = f"{section.render()}. "
+    llm_context, user_input = render_prompt("compress", context=context_string)
 
-    llm_query = LlmQuery(llm_context=llm_context, user_input=user_input)
+    llm_query = LlmQuery(llm_context=llm_context, user_input=user_input, call_site="compress")
     llm_query.get_response_text()
 
     return Information(llm_query.response.choices[0].message.content, list_of_context), 0
 
 
+def record_tick(event_log, tick, agent, world, response, agent_name="agent"):
+    """
+    Append what happened during a tick to an event log: a 'world' event with the world the agent responded to and an
+    'agent' event with its context, candidates, response and stage timings
+
+    :param event_log: EventLog open for writing
+    :param tick: Tick number
+    :param agent: Agent that just processed the world
+    :param world: WorldState the agent responded to, before the response is applied
+    :param response: The agent's response
+    :param agent_name: Name the agent's events are logged under
+    :return: Nothing
+    """
+    event_log.append(tick, "world", {
+        "description": world.description,
+        "information": [information.value for information in world.current_information_list],
+        "added": [information.value for information in world.last_delta.added],
+        "removed": [information.value for information in world.last_delta.removed],
+    })
+    event_log.append(tick, "agent", {
+        "context": agent.current_context_string,
+        "stimuli": len(agent.stimulus_list),
+        "new_stimuli": len(agent.new_stimulus_list),
+        "candidates": agent.response_list,
+        "response": response,
+        "timings": agent.last_stage_run.to_dict() if agent.last_stage_run is not None else None,
+    }, agent=agent_name)
+    event_log.flush()
+
+
 def main():
     """
     while(running):
@@ -363,23 +1094,20 @@ def main():
     print(world)
     print("")
 
-    response = cheese_agent.process_stimulus(world.description, world.current_information_list)
-    print(f"Agent response:\n {response}\n")
-    world.get_next_world_state(response)
-    print(world)
-    print("")
-
-    response = cheese_agent.process_stimulus(world.description, world.current_information_list)
-    print(f"Agent response:\n {response}\n")
-    world.get_next_world_state(response)
-    print(world)
-    print("")
-
-    response = cheese_agent.process_stimulus(world.description, world.current_information_list)
-    print(f"Agent response:\n {response}\n")
-    world.get_next_world_state(response)
-    print(world)
-    print("")
-
-    response = cheese_agent.process_stimulus(world.description, world.current_information_list)
-    print(response)
+    log_directory = os.path.join(_EVENT_LOG_DIRECTORY, time.strftime("%Y%m%d-%H%M%S"))
+    with EventLog(log_directory, writable=True) as event_log:
+        profiler = MemoryProfiler((Information, Context), every=_MEMORY_PROFILE_EVERY, event_log=event_log,
+                                  not_owned_types=(ContextResolver, AgentMemory, MemoryHierarchy))
+        for tick in range(_MAIN_TICKS):
+            response = cheese_agent.process_world_delta(world.description, world.last_delta, world.speculate)
+            print(f"Agent response:\n {response}\n")
+            record_tick(event_log, tick, cheese_agent, world, response, "cheese")
+            profiler.maybe_sample(tick, cheese_agent, world)
+
+            world.get_next_world_state(response)
+            print(world)
+            print("")
+    world.close()
+    cheese_agent.close()
+
+    print(f"Event log written to {log_directory}")
@@ -0,0 +1,182 @@
+"""
+Lightweight span based tracing of agent / world phases and LLM calls.
+
+Tracing is off by default. While it is off span() returns a shared no-op object and traced() functions call straight
+through, so the instrumentation costs a single global lookup. Once enabled, every finished span is recorded as a
+Chrome trace-event (open the exported file in chrome://tracing or https://ui.perfetto.dev). Nesting comes from the
+start and end times of spans on the same thread. Every span also records the id of the span it started in (args
+'span_id' and 'parent_id'). The current span is a context variable, so work handed to another thread in a copy of the
+context (stages, hedged LLM calls) stays parented to the span that handed it over.
+"""
+
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+_TRACER = None  # The active Tracer, None while tracing is disabled
+_CURRENT_SPAN = contextvars.ContextVar("trace_span", default=None)
+_SPAN_IDS = itertools.count(1)
+
+
+class _NullSpan:
+    """
+    Stand in for a span while tracing is disabled
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """
+    A named, timed section of work. Use as a context manager
+    """
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+        self.id = next(_SPAN_IDS)
+        self.parent_id = None
+        self._token = None
+
+    def __enter__(self):
+        parent = _CURRENT_SPAN.get()
+        self.parent_id = parent.id if parent is not None else None
+        self._token = _CURRENT_SPAN.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        _CURRENT_SPAN.reset(self._token)
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc_value}"
+        self.tracer.record(self, end)
+        return False
+
+    def set(self, **args):
+        """
+        Attach extra arguments to the span, e.g. token counts only known once the work is done
+        """
+        self.args.update(args)
+
+
+class Tracer:
+    """
+    Collects finished spans and exports them as Chrome trace-event JSON
+    """
+
+    def __init__(self):
+        self.events = []
+        self.origin = time.perf_counter()  # Trace timestamps are relative to when tracing started
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def span(self, name, category="agent", **args):
+        return Span(self, name, category, args)
+
+    def record(self, span, end):
+        event = {
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": (span.start - self.origin) * 1e6,
+            "dur": (end - span.start) * 1e6,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": dict(span.args, span_id=span.id, parent_id=span.parent_id),
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def to_chrome_trace(self):
+        with self._lock:
+            events = list(self.events)
+        thread_names = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": thread.ident,
+                         "args": {"name": thread.name}} for thread in threading.enumerate()]
+        return {"traceEvents": thread_names + events, "displayTimeUnit": "ms"}
+
+    def export(self, path):
+        """
+        Write the trace to a Chrome trace-event JSON file
+        :param path: File path to write to
+        :return: Nothing
+        """
+        with open(path, "w") as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+
+
+def enable_tracing(tracer=None):
+    """
+    Start recording spans
+    :param tracer: Optional Tracer to record into, a new one is created otherwise
+    :return: The active Tracer
+    """
+    global _TRACER
+    _TRACER = tracer if tracer is not None else Tracer()
+    return _TRACER
+
+
+def disable_tracing():
+    """
+    Stop recording spans
+    :return: The Tracer that was active, or None
+    """
+    global _TRACER
+    tracer = _TRACER
+    _TRACER = None
+    return tracer
+
+
+def tracing_enabled():
+    return _TRACER is not None
+
+
+def span(name, category="agent", **args):
+    """
+    Create a span on the active tracer, a no-op span while tracing is disabled
+
+    :param name: Name of the span, e.g. 'agent.get_context'
+    :param category: Trace-event category, e.g. 'agent', 'world' or 'llm'
+    :param args: Extra arguments recorded with the span
+    :return: A context manager
+    """
+    if _TRACER is None:
+        return _NULL_SPAN
+    return _TRACER.span(name, category, **args)
+
+
+def traced(name, category="agent"):
+    """
+    Decorator wrapping every call of a function in a span
+    :param name: Name of the span
+    :param category: Trace-event category
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _TRACER is None:
+                return function(*args, **kwargs)
+            with _TRACER.span(name, category):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
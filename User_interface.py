@@ -1,5 +1,28 @@
+"""
+Live dashboard for a running simulation.
+
+The simulation runs on a worker thread, so multi-second LLM calls never block the Tk mainloop. The worker puts updates
+on a queue that the UI drains from an after() callback every frame, only doing as much work per frame as fits in the
+frame budget. Memory and information lists are virtualized: only the rows that are visible are drawn, so they stay fast
+with tens of thousands of items.
+"""
+
+import queue
+import threading
+import time
 import tkinter as tk
 
+import LLM_Controller as llm
+import State_Control
+import World_Generator
+
+_FRAME_MS = 16  # ~60 fps
+_MAX_UPDATES_PER_FRAME = 50  # Queue items handled per frame, the rest wait for the next frame
+_ROW_HEIGHT = 18
+_FONT = ("TkFixedFont", 9)
+_STATS_EVERY_FRAMES = 15  # In-flight calls and latency stats are refreshed a few times a second
+
+
 def go():
     main_frame = tk.Tk()
 
@@ -22,7 +45,7 @@ def go():
     row_1 = tk.Button(column_frame_1, text="Row 0")
     row_1.grid(row=1, column=0, sticky="ew")
 
-    row_2 = tk.Button(ccolumn_frame_1, text="Row 1")
+    row_2 = tk.Button(column_frame_1, text="Row 1")
     row_2.grid(row=1, column=0, sticky="ew")
 
     row_3 = tk.Button(column_frame_1, text="Row 0, Column 3")
@@ -36,4 +59,284 @@ def go():
 
     pane_window.add(column_frame_1)
 
-    main_frame.mainloop()
\ No newline at end of file
+    main_frame.mainloop()
+
+
+class VirtualList(tk.Frame):
+    """
+    Scrollable list that only draws the visible rows. 'items' can be any list of strings and grow at any time, call
+    refresh() after changing it
+    """
+
+    def __init__(self, parent, title, items=None, follow=False):
+        super().__init__(parent)
+        self.items = items if items is not None else []
+        self.follow = follow  # Keep the newest items in view while the list grows, until the user scrolls up
+        self.first_row = 0
+        self._drawn = None  # (first row, row count, item count) of what is on the canvas
+
+        tk.Label(self, text=title, anchor="w").grid(row=0, column=0, columnspan=2, sticky="ew")
+        self.canvas = tk.Canvas(self, background="white", highlightthickness=0)
+        self.canvas.grid(row=1, column=0, sticky="news")
+        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.grid(row=1, column=1, sticky="ns")
+        self.grid_rowconfigure(1, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self._rows = []  # Reused canvas text items, one per visible row
+        self.canvas.bind("<Configure>", lambda event: self.refresh(force=True))
+        self.canvas.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda event: self.scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda event: self.scroll(1, "units"))
+
+    @property
+    def visible_rows(self):
+        return max(1, self.canvas.winfo_height() // _ROW_HEIGHT)
+
+    def set_items(self, items):
+        self.items = items
+        self.first_row = 0
+        self.refresh(force=True)
+
+    def scroll(self, amount, what):
+        step = self.visible_rows if what == "pages" else 1
+        self._scroll_to(self.first_row + int(amount) * step)
+
+    def _on_scrollbar(self, command, *args):
+        if command == "moveto":
+            self._scroll_to(int(float(args[0]) * len(self.items)))
+        else:
+            self.scroll(args[0], args[1])
+
+    def _scroll_to(self, first_row):
+        last_first_row = max(0, len(self.items) - self.visible_rows)
+        self.first_row = min(max(0, first_row), last_first_row)
+        self.follow = self.first_row == last_first_row
+        self.refresh()
+
+    def refresh(self, force=False):
+        """
+        Redraw the visible rows. Costs the same no matter how many items there are
+        :param force: Redraw even if the visible window and item count haven't changed
+        """
+        row_count = self.visible_rows
+        if self.follow:
+            self.first_row = max(0, len(self.items) - row_count)
+        state = (self.first_row, row_count, len(self.items))
+        if state == self._drawn and not force:
+            return
+        self._drawn = state
+
+        while len(self._rows) < row_count:
+            self._rows.append(self.canvas.create_text(4, len(self._rows) * _ROW_HEIGHT + 2, anchor="nw", font=_FONT))
+        for row, text_item in enumerate(self._rows):
+            index = self.first_row + row
+            text = self.items[index] if row < row_count and index < len(self.items) else ""
+            self.canvas.itemconfigure(text_item, text=text)
+
+        if self.items:
+            self.scrollbar.set(self.first_row / len(self.items),
+                               min(1.0, (self.first_row + row_count) / len(self.items)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+
+class SimulationWorker(threading.Thread):
+    """
+    Runs the agent and world loop and reports every tick on a queue as ('tick', dictionary) or ('error', message)
+    """
+
+    def __init__(self, updates, agent, world=None):
+        """
+        :param updates: Queue the updates are put on
+        :param agent: State_Control.Agent
+        :param world: Optional World_Generator.WorldState. A new one is made on the worker thread by default, making
+        one already asks the LLM
+        """
+        super().__init__(name="simulation", daemon=True)
+        self.updates = updates
+        self.agent = agent
+        self.world = world
+        self.running = threading.Event()  # Cleared while paused
+        self.stopped = threading.Event()
+        self._memories_sent = 0
+        self.running.set()
+
+    def run(self):
+        tick = 0
+        try:
+            if self.world is None:
+                self.world = World_Generator.WorldState("You exist.")
+            while not self.stopped.is_set():
+                if not self.running.wait(timeout=0.1):
+                    continue
+                tick_start = time.perf_counter()
+                world = self.world
+                response = self.agent.process_world_delta(world.description, world.last_delta, world.speculate)
+                update = self._tick_update(tick, response)
+                world.get_next_world_state(response)
+                update["seconds"] = time.perf_counter() - tick_start
+                self.updates.put(("tick", update))
+                tick += 1
+        except Exception as e:
+            self.updates.put(("error", f"{type(e).__name__}: {e}"))
+        finally:
+            if self.world is not None:
+                self.world.close()
+
+    def _tick_update(self, tick, response):
+        """
+        Copy what the UI shows into plain strings, the UI never touches simulation objects. Only the memories stored
+        since the last update are sent
+        """
+        memories = self.agent.memories.memories
+        new_memories = memories[self._memories_sent:]
+        self._memories_sent = len(memories)
+        return {
+            "tick": tick,
+            "description": self.world.description,
+            "information": [information.value for information in self.world.current_information_list],
+            "context": self.agent.current_context_string.split("\n"),
+            "candidates": list(self.agent.response_list),
+            "response": response,
+            "new_memories": [f"{memory.what.value}: {information.value}" for memory in new_memories if memory is not None
+                             for information in memory.experienced_information],
+        }
+
+    def stop(self):
+        self.stopped.set()
+        self.running.set()
+
+
+class Dashboard:
+    """
+    Tk window showing the world, the agent's context and memories, and the LLM calls of a SimulationWorker
+    """
+
+    def __init__(self, root, worker):
+        self.root = root
+        self.worker = worker
+        self.updates = worker.updates
+        self.memory_items = []
+        self.tick_times = []
+        self._frame = 0
+
+        root.title("Simulation")
+        root.geometry("1280x800")
+        root.grid_columnconfigure(0, weight=1)
+        root.grid_rowconfigure(1, weight=1)
+        root.protocol("WM_DELETE_WINDOW", self.close)
+
+        header = tk.Frame(root)
+        header.grid(row=0, column=0, sticky="ew")
+        header.grid_columnconfigure(1, weight=1)
+        self.pause_button = tk.Button(header, text="Pause", width=8, command=self.toggle_pause)
+        self.pause_button.grid(row=0, column=0, padx=4, pady=4)
+        self.status = tk.Label(header, text="Starting...", anchor="w")
+        self.status.grid(row=0, column=1, sticky="ew")
+        self.description = tk.Label(header, text="", anchor="w", justify="left", wraplength=1200)
+        self.description.grid(row=1, column=0, columnspan=2, sticky="ew", padx=4)
+
+        panes = tk.PanedWindow(root, orient="horizontal", sashwidth=4)
+        panes.grid(row=1, column=0, sticky="news")
+
+        world_column = tk.PanedWindow(panes, orient="vertical", sashwidth=4)
+        self.information_list = VirtualList(world_column, "World information")
+        self.candidate_list = VirtualList(world_column, "Candidate responses")
+        world_column.add(self.information_list, stretch="always")
+        world_column.add(self.candidate_list, height=150)
+
+        agent_column = tk.PanedWindow(panes, orient="vertical", sashwidth=4)
+        self.context_list = VirtualList(agent_column, "Agent context")
+        self.memory_list = VirtualList(agent_column, "Agent memories", self.memory_items, follow=True)
+        agent_column.add(self.context_list, height=250)
+        agent_column.add(self.memory_list, stretch="always")
+
+        llm_column = tk.PanedWindow(panes, orient="vertical", sashwidth=4)
+        self.in_flight_list = VirtualList(llm_column, "In-flight LLM calls")
+        self.latency_list = VirtualList(llm_column, "LLM latency by call site")
+        llm_column.add(self.in_flight_list, height=250)
+        llm_column.add(self.latency_list, stretch="always")
+
+        for column in (world_column, agent_column, llm_column):
+            panes.add(column, stretch="always", width=420)
+
+    def toggle_pause(self):
+        if self.worker.running.is_set():
+            self.worker.running.clear()
+            self.pause_button.configure(text="Resume")
+        else:
+            self.worker.running.set()
+            self.pause_button.configure(text="Pause")
+
+    def close(self):
+        self.worker.stop()
+        self.root.destroy()
+
+    def poll(self):
+        """
+        Handle queued updates for at most one frame and schedule the next frame
+        """
+        frame_start = time.perf_counter()
+        latest_tick = None
+        for _ in range(_MAX_UPDATES_PER_FRAME):
+            try:
+                kind, update = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "error":
+                self.status.configure(text=f"Simulation stopped: {update}")
+                continue
+            # Memories accumulate, everything else only needs the latest tick
+            self.memory_items.extend(update["new_memories"])
+            self.tick_times.append(update["seconds"])
+            latest_tick = update
+            if (time.perf_counter() - frame_start) * 1000 > _FRAME_MS / 2:
+                break
+
+        if latest_tick is not None:
+            self._show_tick(latest_tick)
+        self.memory_list.refresh()
+
+        if self._frame % _STATS_EVERY_FRAMES == 0:
+            self._show_llm_stats()
+        self._frame += 1
+
+        self.root.after(_FRAME_MS, self.poll)
+
+    def _show_tick(self, update):
+        recent = self.tick_times[-20:]
+        ticks_per_second = len(recent) / sum(recent) if sum(recent) > 0 else 0.0
+        self.status.configure(text=f"Tick {update['tick']}    {ticks_per_second:.2f} ticks/sec    "
+                                   f"response: {update['response']}    memories: {len(self.memory_items)}")
+        self.description.configure(text=update["description"])
+        self.information_list.set_items(update["information"])
+        self.context_list.set_items(update["context"])
+        self.candidate_list.set_items(update["candidates"])
+
+    def _show_llm_stats(self):
+        in_flight = sorted(llm.get_in_flight_calls(), key=lambda call: -call[2])
+        self.in_flight_list.set_items([f"{seconds:6.2f}s  {call_site:<20} {model}"
+                                       for call_site, model, seconds in in_flight])
+        self.latency_list.set_items([f"{call_site:<20} calls={stats['calls']:<6} p50={stats['p50_latency'] or 0:.3f}s "
+                                     f"p95={stats['p95_latency'] or 0:.3f}s"
+                                     for call_site, stats in sorted(llm.get_route_stats().items())])
+
+
+def run_dashboard(agent=None, world=None):
+    """
+    Run a simulation and show it on a dashboard until the window is closed
+    :param agent: Optional State_Control.Agent, a new one by default
+    :param world: Optional World_Generator.WorldState, a new one by default
+    """
+    worker = SimulationWorker(queue.Queue(), agent if agent is not None else State_Control.Agent(), world)
+    root = tk.Tk()
+    dashboard = Dashboard(root, worker)
+    worker.start()
+    root.after(_FRAME_MS, dashboard.poll)
+    root.mainloop()
+    worker.stop()
+
+
+if __name__ == "__main__":
+    run_dashboard()
@@ -8,48 +8,270 @@
 
 """
 
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import LLM_Controller as llm
-import State_Control as st
+from Information_Table import intern_information
+from LLM_Scheduler import priority_context
+from Prompt_Templates import render_prompt
+from Tracer import traced
+
+# Speculative world generation. While the agent is choosing a response the world can start generating the next world
+# state for the first few candidate responses. A width of 0 turns speculation off.
+_SPECULATION_WIDTH = 0
+# Maximum number of speculative world states that may be generated over the life of the world (None for no limit).
+# Each speculation costs up to two LLM calls (next state + information parsing) whether it is committed or not. A
+# cancelled speculation makes no further calls, but a call it has already sent still runs to the end and is paid for.
+_SPECULATION_BUDGET = None
+
+
+class WorldDelta:
+    """
+    What changed between two consecutive information lists of the world
+    """
+
+    def __init__(self, added=None, removed=None, unchanged=None):
+        self.added = added if added is not None else []  # New information objects
+        self.removed = removed if removed is not None else []  # Information objects no longer in the world
+        self.unchanged = unchanged if unchanged is not None else []  # The same information objects as last tick
+
+    def __str__(self):
+        return f"+{[str(info) for info in self.added]} -{[str(info) for info in self.removed]} " \
+               f"={len(self.unchanged)}"
+
+
+class _Speculation:
+    """
+    The next world state for one candidate action, generated in the background
+    """
+
+    def __init__(self, action):
+        self.action = action  # The candidate action, as the agent gave it
+        self.cancelled = threading.Event()  # Set once the result can't be used, stops it before its next LLM call
+        self.future = None  # Future of (description, information value list), None if cancelled before finishing
 
 
 # TODO create mechanism to force world consistency and information tracking
 class WorldState:
 
-    def __init__(self, initial_world_state, initial_information=None):
+    def __init__(self, initial_world_state, initial_information=None, speculation_width=_SPECULATION_WIDTH,
+                 speculation_budget=_SPECULATION_BUDGET):
         if initial_information is None:
             initial_information = []
         self.description = initial_world_state
         self.current_information_list = []
+        self.information_index = {}  # Information objects currently in the world (a dict used as an ordered set)
+        self.last_delta = WorldDelta()  # Change in information caused by the last world state transition
+        self.speculation_width = speculation_width
+        self.speculation_budget = speculation_budget  # Speculations left to spend, None for no limit
+        # Speculations committed (waited for if still running), cancelled before they started and abandoned while
+        # running (they stop before their next LLM call)
+        self.speculation_stats = {"launched": 0, "committed": 0, "cancelled": 0, "discarded": 0}
+        self._speculations = {}  # Normalized candidate action -> _Speculation
+        self._speculation_executor = None
         self._process_state()
 
     def __str__(self):
         return f"===========\n{self.description} \n {self.current_information_list}"
 
+    @traced("world.get_next_world_state", category="world")
     def get_next_world_state(self, user_action):
-        llm_context = "You will be provided a description of the current world state. You must provide the user" \
-                      "a description of the next world state based on their input."
-        user_input = f"This is the current world state description: {self.description}\n" \
-                     f"Provide a consistent description of the next world state given that {user_action} has just happened."
-        llm_query = llm.LlmQuery(llm_context=llm_context, user_input=user_input)
-        llm_query.get_response_text()
+        speculation = self._take_speculation(user_action)
+        if speculation is not None:
+            self.description, information_values = speculation
+            self._apply_information(information_values)
+            return
 
-        self.description = llm_query.response.choices[0].message.content
+        self.description = self._generate_next_description(self.description, user_action)
         self._process_state()
 
+    @traced("world.speculate", category="world")
+    def speculate(self, candidate_actions):
+        """
+        Start generating the next world state for the first few candidate actions in the background. Any speculation
+        left over from a previous tick is cancelled first.
+
+        :param candidate_actions: List of possible agent responses, most likely first
+        :return: Nothing
+        """
+        self.cancel_speculation()
+        if self.speculation_width < 1:
+            return
+
+        if self._speculation_executor is None:
+            self._speculation_executor = ThreadPoolExecutor(max_workers=self.speculation_width)
+
+        for action in candidate_actions:
+            if len(self._speculations) >= self.speculation_width:
+                break
+            if self.speculation_budget is not None and self.speculation_budget < 1:
+                break
+            key = _normalize_text(action)
+            if not key or key in self._speculations:
+                continue
+
+            if self.speculation_budget is not None:
+                self.speculation_budget -= 1
+            self.speculation_stats["launched"] += 1
+            speculation = _Speculation(action)
+            speculation.future = self._speculation_executor.submit(self._speculate_next_state, speculation,
+                                                                   self.description, action)
+            self._speculations[key] = speculation
+
+    def cancel_speculation(self):
+        """
+        Drop every pending speculation. Speculations that have not started are cancelled, running ones stop before
+        their next LLM call, a call already sent still runs to the end.
+
+        :return: Nothing
+        """
+        for speculation in self._speculations.values():
+            speculation.cancelled.set()
+            if speculation.future.cancel():
+                self.speculation_stats["cancelled"] += 1
+            elif not speculation.future.done():
+                self.speculation_stats["discarded"] += 1
+        self._speculations = {}
+
+    def close(self):
+        """
+        Cancel the pending speculations and stop the speculation threads
+        :return: Nothing
+        """
+        self.cancel_speculation()
+        if self._speculation_executor is not None:
+            self._speculation_executor.shutdown(wait=False, cancel_futures=True)
+            self._speculation_executor = None
+
+    @traced("world.take_speculation", category="world")
+    def _take_speculation(self, user_action):
+        """
+        Find the speculation of the chosen action and cancel the rest. A speculation that is already running is waited
+        for, it has a head start on the call that would otherwise be made now. One that hasn't started is cancelled
+        and the state generated serially
+
+        :param user_action: The response the agent chose
+        :return: (description, information value list) tuple or None if no speculation matched
+        """
+        if not self._speculations:
+            return None
+
+        # Any other candidate's world state is that of a different action
+        action = match_action(user_action, [speculation.action for speculation in self._speculations.values()])
+        speculation = self._speculations.pop(_normalize_text(action), None) if action is not None else None
+        self.cancel_speculation()
+        if speculation is None:
+            return None
+
+        if speculation.future.cancel():
+            self.speculation_stats["cancelled"] += 1
+            return None
+        try:
+            result = speculation.future.result()
+        except Exception as e:
+            # A failed speculation is not fatal, the state will just be generated serially
+            print(f"Speculative world generation failed for '{user_action}': {e}")
+            self.speculation_stats["discarded"] += 1
+            return None
+        self.speculation_stats["committed"] += 1
+        return result
+
+    @traced("world.speculate_next_state", category="world")
+    def _speculate_next_state(self, speculation, description, user_action):
+        """
+        :return: (description, information value list) tuple, None if the speculation was cancelled before the end
+        """
+        # Speculations may never be used, so they queue behind the calls a tick is waiting on
+        with priority_context("background"):
+            if speculation.cancelled.is_set():
+                return None
+            next_description = self._generate_next_description(description, user_action)
+            if speculation.cancelled.is_set():
+                return None
+            return next_description, self._extract_information(next_description)
+
+    @traced("world.generate_next_description", category="world")
+    def _generate_next_description(self, description, user_action):
+        llm_context, user_input = render_prompt("world_next_state", description=description, action=user_action)
+        llm_query = llm.LlmQuery(llm_context=llm_context, user_input=user_input, call_site="world_next_state")
+        llm_query.get_response_text()
+
+        return llm_query.response.choices[0].message.content
+
     def _process_state(self):
-        llm_context = "You will create a comma separated list of 'information pieces' based on the description provided"
-        user_input = f"Turn the follow description into a comma separated list of information.\n" \
-                     f"{self.description}\n" \
-                     f"As an example, if my description is 'A person walked underneath a tree and picked up an acorn' " \
-                     f"then the list created would be: 'person walking', 'underneath a tree', 'picked up an acorn'"
+        self._apply_information(self._extract_information(self.description))
 
-        llm_query = llm.LlmQuery(llm_context=llm_context, user_input=user_input)
+    def _apply_information(self, information_values):
+        """
+        Replace the current information list. Values are interned, so every value that is still in the world keeps its
+        existing Information object (and whatever context agents gave it). The change is recorded in last_delta.
+
+        :param information_values: List of information strings describing the new world state
+        :return: Nothing
+        """
+        information_index = {}
+        delta = WorldDelta()
+        for value in information_values:
+            if not value.strip():
+                continue
+            information = intern_information(value)
+            if information in information_index:
+                continue
+            information_index[information] = None
+            if information in self.information_index:
+                delta.unchanged.append(information)
+            else:
+                delta.added.append(information)
+
+        for information in self.information_index:
+            if information not in information_index:
+                delta.removed.append(information)
+
+        self.information_index = information_index
+        self.current_information_list = list(information_index)
+        self.last_delta = delta
+
+    @traced("world.extract_information", category="world")
+    def _extract_information(self, description):
+        llm_context, user_input = render_prompt("world_parse", description=description)
+
+        llm_query = llm.LlmQuery(llm_context=llm_context, user_input=user_input, call_site="world_parse")
         llm_query.get_response_text()
 
-        self.current_information_list = llm_query.response.choices[0].message.content.split(", ")
-        temp_list = []
-        for info in self.current_information_list:
-            temp_list.append(st.Information(info))
+        return llm_query.response.choices[0].message.content.split(", ")
+
+
+def match_action(choice, candidate_actions):
+    """
+    Map a chosen response onto the candidate it names. A model asked to pick a candidate often wraps it in other words,
+    e.g. 'I would throw the acorn' for 'throw the acorn'
+
+    :param choice: The chosen response
+    :param candidate_actions: List of the candidate actions the choice was made from
+    :return: The candidate equal to the choice after _normalize_text, else the only candidate found in the choice as
+        whole words (a candidate contained in another one found is not counted), None if there is no such candidate
+    """
+    normalized_choice = _normalize_text(choice)
+    for action in candidate_actions:
+        if _normalize_text(action) == normalized_choice:
+            return action
+
+    found = {}
+    for action in candidate_actions:
+        key = _normalize_text(action)
+        if key and re.search(rf"(?<!\w){re.escape(key)}(?!\w)", normalized_choice):
+            found[key] = action
+    named = [key for key in found if not any(key != other and key in other for other in found)]
+    return found[named[0]] if len(named) == 1 else None
 
-        self.current_information_list = temp_list
 
+def _normalize_text(text):
+    """
+    Normalize a string so that trivially different versions of it compare equal, e.g. candidate actions against the
+    chosen response
+    :param text: Any string
+    :return: Lower case string without surrounding quotes, whitespace or trailing punctuation
+    """
+    return text.strip().strip("'\"").strip().rstrip(".!").lower()
@@ -0,0 +1,10 @@
+"""
+Lets the tests import the simulation modules, which live at the top of the repository rather than in a package.
+"""
+
+import os
+import sys
+
+_REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _REPOSITORY not in sys.path:
+    sys.path.insert(0, _REPOSITORY)
@@ -0,0 +1,65 @@
+"""
+Agent service requests, with a stand-in backend instead of the LLM.
+"""
+
+import asyncio
+import json
+from http import HTTPStatus
+
+import pytest
+
+import Benchmark
+import LLM_Controller as llm
+from Agent_Service import AgentService, ServiceError
+from LLM_Scheduler import FairScheduler
+
+
+@pytest.fixture
+def service():
+    previous_backend = llm.set_llm_backend(Benchmark.StandInLLM(seed=0, latency=0.01))
+    service = AgentService(FairScheduler(capacity=2), max_workers=4)
+    service._previous_scheduler = llm.set_llm_scheduler(service.scheduler)
+    yield service
+    service.close()
+    llm.set_llm_backend(previous_backend)
+
+
+def _post(service, agent_id, request):
+    return service.handle("POST", f"/agents/{agent_id}/stimulus", json.dumps(request).encode())
+
+
+def test_two_tenants_share_the_scheduler(service):
+    async def run():
+        requests = [_post(service, "alice", {"description": "A cat walks in", "stimulus": ["a cat"], "weight": 2}),
+                    _post(service, "bob", {"description": "It starts to rain", "stimulus": ["rain"]})]
+        first = await asyncio.gather(*requests)
+        second = await _post(service, "alice", {"description": "The cat sleeps", "stimulus": ["a cat", "a bed"]})
+        return first + [second]
+
+    results = asyncio.run(run())
+    assert [status for status, _ in results] == [HTTPStatus.OK] * 3
+    assert [body["agent"] for _, body in results] == ["alice", "bob", "alice"]
+    assert all(isinstance(body["response"], str) for _, body in results)
+
+    status, stats = asyncio.run(service.handle("GET", "/stats", b""))
+    tenants = stats["scheduler"]["tenants"]
+    assert stats["agents"] == 2
+    assert (tenants["alice"]["weight"], tenants["alice"]["requests"]) == (2.0, 2)
+    assert tenants["bob"]["requests"] == 1
+    assert tenants["alice"]["calls"] > 0 and tenants["bob"]["calls"] > 0
+
+
+@pytest.mark.parametrize("request_body", [
+    {"stimulus": "a cat"},
+    {"stimulus": {"a": "cat"}},
+    {"stimulus": ["a cat"], "weight": 0},
+    {"stimulus": ["a cat"], "weight": -1},
+    {"stimulus": ["a cat"], "weight": "heavy"},
+    {"stimulus": ["a cat"], "weight": [1]},
+    ["a cat"],
+])
+def test_invalid_stimulus_request_is_refused(service, request_body):
+    with pytest.raises(ServiceError) as error:
+        asyncio.run(_post(service, "alice", request_body))
+    assert error.value.status == HTTPStatus.BAD_REQUEST
+    assert service.agents == {}
@@ -0,0 +1,67 @@
+"""
+Writing, binary searching and scanning EventLog segments.
+"""
+
+from Event_Log import EventLog
+
+_SEGMENT_BYTES = 2048  # Small enough that the test log spans several segments
+
+
+def _write(directory, ticks=60, events_per_tick=3):
+    with EventLog(str(directory), writable=True, segment_bytes=_SEGMENT_BYTES) as log:
+        for tick in range(ticks):
+            for number in range(events_per_tick):
+                agent = "cheese" if number % 2 else "mouse"
+                log.append(tick, "agent" if number else "world", {"number": number}, agent=agent)
+
+
+def test_log_spans_several_segments(tmp_path):
+    _write(tmp_path)
+    with EventLog(str(tmp_path)) as log:
+        assert len(log._segments) > 2
+        assert log.last_tick() == 59
+
+
+def test_find_tick_is_the_first_record_of_the_tick(tmp_path):
+    _write(tmp_path)
+    with EventLog(str(tmp_path)) as log:
+        log._refresh()
+        for segment in log._segments:
+            first = segment.first_tick()
+            position = segment.find_tick(first + 1)
+            if position < len(segment):
+                assert segment.record(position)[0] == first + 1
+                assert segment.record(position - 1)[0] == first
+
+
+def test_read_tick_returns_the_tick_across_segments(tmp_path):
+    _write(tmp_path)
+    with EventLog(str(tmp_path)) as log:
+        for tick in (0, 17, 42, 59):
+            events = log.read_tick(tick)
+            assert [event["number"] for event in events] == [0, 1, 2]
+            assert {event["tick"] for event in events} == {tick}
+        assert log.read_tick(60) == []
+
+
+def test_scan_filters_by_type_agent_and_ticks(tmp_path):
+    _write(tmp_path)
+    with EventLog(str(tmp_path)) as log:
+        events = list(log.scan(event_type="agent", agent="cheese", start_tick=10, end_tick=20))
+        assert [event["tick"] for event in events] == list(range(10, 20))
+        assert all(event["type"] == "agent" and event["agent"] == "cheese" for event in events)
+        assert list(log.scan(agent="nobody")) == []
+        assert len(list(log.scan())) == 180
+
+
+def test_reader_sees_events_appended_after_it_opened(tmp_path):
+    with EventLog(str(tmp_path), writable=True, segment_bytes=_SEGMENT_BYTES) as writer:
+        writer.append(0, "world")
+        writer.flush()
+        with EventLog(str(tmp_path)) as reader:
+            assert reader.last_tick() == 0
+            for tick in range(1, 40):
+                writer.append(tick, "world")
+            writer.flush()
+            assert reader.last_tick() == 39
+            assert len(list(reader.scan())) == 40
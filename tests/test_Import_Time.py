@@ -0,0 +1,42 @@
+"""
+Startup cost of the modules every simulation worker imports.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import Benchmark
+
+_REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Most milliseconds importing a module may take in a fresh interpreter, generous enough for a loaded CI machine
+_IMPORT_BUDGET_MS = 500
+
+
+@pytest.mark.parametrize("module", Benchmark._IMPORT_TIMED_MODULES)
+def test_import_within_budget(module):
+    measurement = Benchmark.measure_import_time(module)
+    assert not Benchmark.check_import_budget({module: measurement}, _IMPORT_BUDGET_MS)
+
+
+@pytest.mark.parametrize("module", Benchmark._IMPORT_TIMED_MODULES + ["LLM_Controller"])
+def test_import_loads_no_heavy_modules(module):
+    assert Benchmark.measure_import_time(module, repeats=1)["heavy_modules"] == []
+
+
+@pytest.mark.parametrize("module", ["World_Generator", "LLM_Controller"])
+def test_import_in_either_order(module):
+    # Either module imported first must not fail on an import cycle
+    Benchmark.measure_import_time(module, repeats=1)
+
+
+def test_import_without_unix_only_modules():
+    # Windows has no resource module, importing it must still work
+    script = "import sys; sys.modules['resource'] = None; import State_Control, Memory_Profiler; " \
+             "print(Memory_Profiler.get_rss_bytes())"
+    process = subprocess.run([sys.executable, "-c", script], cwd=_REPOSITORY, capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+    assert process.stdout.strip() == "None"
@@ -0,0 +1,143 @@
+"""
+Routing, parsing, validating and batching LLM responses, with a stand-in backend instead of the LLM.
+"""
+
+import threading
+
+import pytest
+
+import LLM_Controller as llm
+from LLM_Controller import _VALIDATORS, LlmQuery, ResponseObject, RouteStats, _parse_batch_answers, is_yes
+from Semantic_Cache import SemanticCache
+
+
+def _response(text):
+    return ResponseObject({"choices": [{"index": 0, "finish_reason": "stop",
+                                        "message": {"role": "assistant", "content": text}}]})
+
+
+def test_batch_answers_are_keyed_by_task_number():
+    assert _parse_batch_answers('{"1": "yes", "2": "cheese"}') == {"1": "yes", "2": "cheese"}
+
+
+def test_batch_answers_inside_other_text():
+    text = 'Here are the answers:\n{"Task 1": "no", "task 2": ["bread", "cheese"], "3": 4}\nDone.'
+    assert _parse_batch_answers(text) == {"1": "no", "2": "bread, cheese", "3": "4"}
+
+
+@pytest.mark.parametrize("text", ["", "no JSON here", '["yes", "no"]', '{"1": "yes"', "{not json}"])
+def test_batch_answers_of_a_malformed_response_are_empty(text):
+    assert _parse_batch_answers(text) == {}
+
+
+def test_batch_answers_skip_nested_objects():
+    assert _parse_batch_answers('{"1": {"answer": "yes"}, "2": "no"}') == {"2": "no"}
+
+
+def test_routes_stay_on_the_fast_tier_without_cascading():
+    assert not llm._CASCADE_ENABLED
+    assert {route["tier"] for route in llm._MODEL_ROUTES.values()} == {"fast"}
+
+
+def test_route_stats_read_while_recorded():
+    stats = RouteStats()
+    stop = threading.Event()
+
+    def record():
+        while not stop.is_set():
+            stats.record("fast", 0.01)
+            stats.record_escalation()
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(2000):
+            stats.percentile(95)
+            stats.to_dict()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert stats.to_dict()["calls"] == stats.to_dict()["escalations"]
+
+
+def test_percentile_needs_min_samples():
+    stats = RouteStats()
+    for elapsed in (0.3, 0.1, 0.2):
+        stats.record("fast", elapsed)
+    assert stats.percentile(50) == 0.2
+    assert stats.percentile(95, min_samples=4) is None
+
+
+def test_escalation_does_not_inflate_the_tier_hedge_delay():
+    stats = RouteStats()
+    for _ in range(20):
+        stats.record_attempt("fast", 0.1)
+        stats.record_attempt("strong", 0.5)
+        stats.record("strong", 0.6)  # The whole escalated call
+    assert stats.percentile(95, tier="fast") == 0.1
+    assert stats.percentile(95) == 0.6
+    assert stats.to_dict()["p95_attempt_latency_by_tier"] == {"fast": 0.1, "strong": 0.5}
+
+
+@pytest.mark.parametrize("text", ["yes", "No.", "Yes, the cheese is on the table", "no"])
+def test_yes_no_accepts_an_answer(text):
+    assert _VALIDATORS["yes_no"](text)
+
+
+@pytest.mark.parametrize("text", ["", "maybe", "It depends", "I do not know", "Nothing to say", "cannot tell"])
+def test_yes_no_refuses_a_non_answer(text):
+    assert not _VALIDATORS["yes_no"](text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Yes.", True),
+    ("yes, it is relevant", True),
+    ("No, not yes", False),
+    ("It is in my eyes", False),
+    ("I do not know", False),
+    ("", False),
+])
+def test_is_yes_reads_the_first_verdict(text, expected):
+    assert is_yes(text) == expected
+
+
+@pytest.fixture
+def cached_backend():
+    """
+    A backend answering every batch with an empty object, so every task is asked again on its own, behind an enabled
+    semantic cache
+    :return: List of the call sites the backend was called for
+    """
+    calls = []
+
+    def backend(messages=None, call_site="default", **request_options):
+        calls.append(call_site)
+        return _response("{}" if call_site.startswith("batch.") else "yes")
+
+    previous_backend = llm.set_llm_backend(backend)
+    cache = SemanticCache()
+    llm.enable_semantic_cache(cache)
+    yield calls
+    llm.disable_semantic_cache()
+    llm.set_llm_backend(previous_backend)
+
+
+def _relevance_query(text):
+    return LlmQuery(llm_context="Answer yes or no", user_input=f"Is {text} relevant?", call_site="relevance",
+                    semantic_key=text)
+
+
+def test_batch_looks_every_query_up_once(cached_backend):
+    queries = [_relevance_query(text) for text in ("the cheese", "a cat sleeping", "rain on the window")]
+    LlmQuery.batch(queries)
+    assert [query.response.choices[0].message.content for query in queries] == ["yes"] * 3
+    assert cached_backend == ["batch.relevance", "relevance", "relevance", "relevance"]
+    stats = llm.get_semantic_cache_stats()["call_sites"]["relevance"]
+    assert (stats["lookups"], stats["hits"]) == (3, 0)
+
+    LlmQuery.batch([_relevance_query("the cheese")])
+    stats = llm.get_semantic_cache_stats()["call_sites"]["relevance"]
+    assert (stats["lookups"], stats["hits"]) == (4, 1)
+    assert len(cached_backend) == 4
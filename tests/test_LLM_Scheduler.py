@@ -0,0 +1,101 @@
+"""
+Fair sharing and priority classes of FairScheduler.
+"""
+
+import threading
+import time
+
+import pytest
+
+from LLM_Scheduler import FairScheduler, priority_context, tenant_context
+
+
+def _queue_call(scheduler, order, tenant, priority="foreground"):
+    """
+    Start a thread whose call waits for a slot, records its tenant once granted and frees the slot right away.
+    Returns once the call is queued, so calls queue in the order this is called
+    """
+    queued = scheduler.get_stats()["queued"]
+
+    def call():
+        with scheduler.slot(tenant, priority=priority):
+            order.append(tenant)
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while scheduler.get_stats()["queued"] == queued:
+        assert time.monotonic() < deadline, "call never queued"
+        time.sleep(0.001)
+    return thread
+
+
+def _run_queued(scheduler, calls):
+    """
+    Queue (tenant, priority) calls behind a held slot, then free it
+    :return: Tenants in the order their calls were given the slot
+    """
+    order = []
+    scheduler.acquire("holder")
+    threads = [_queue_call(scheduler, order, tenant, priority) for tenant, priority in calls]
+    scheduler.release("holder")
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_tenants_share_slots_whatever_they_queue():
+    scheduler = FairScheduler(capacity=1)
+    order = _run_queued(scheduler, [("a", "foreground")] * 4 + [("b", "foreground")] * 2)
+    assert order == ["a", "b", "a", "b", "a", "a"]
+
+
+def test_weights_share_slots_in_proportion():
+    scheduler = FairScheduler(capacity=1)
+    scheduler.set_weight("heavy", 2)
+    order = _run_queued(scheduler, [("light", "foreground")] * 3 + [("heavy", "foreground")] * 6)
+    assert order[:6].count("heavy") == 4
+
+
+def test_foreground_goes_before_background():
+    scheduler = FairScheduler(capacity=1)
+    order = _run_queued(scheduler, [("maintenance", "background"), ("tick", "foreground")])
+    assert order == ["tick", "maintenance"]
+
+
+def test_background_never_holds_the_foreground_reserve():
+    scheduler = FairScheduler(capacity=4)
+    held = [scheduler.try_acquire("maintenance", "background") for _ in range(4)]
+    assert held.count(None) == 1
+    assert scheduler.try_acquire("tick", "foreground") == ("tick", "foreground")
+    assert scheduler.get_stats()["in_use"] == 4
+
+
+def test_try_acquire_never_queues():
+    scheduler = FairScheduler(capacity=1)
+    scheduler.acquire("a")
+    assert scheduler.try_acquire("b") is None
+    assert scheduler.get_stats()["queued"] == 0
+    scheduler.release("a")
+    assert scheduler.try_acquire("b") == ("b", "foreground")
+
+
+def test_context_sets_tenant_and_priority():
+    scheduler = FairScheduler(capacity=2)
+    with tenant_context("agent"), priority_context("background"):
+        with scheduler.slot():
+            stats = scheduler.get_stats()
+    assert stats["tenants"]["agent"]["in_flight"] == 1
+    assert stats["classes"]["background"]["in_flight"] == 1
+    assert scheduler.get_stats()["in_use"] == 0
+
+
+def test_unknown_priority_is_refused():
+    with pytest.raises(RuntimeError):
+        FairScheduler().acquire("a", "urgent")
+
+
+def test_single_slot_reserves_nothing_for_foreground():
+    scheduler = FairScheduler(capacity=1)
+    assert scheduler.limits == {"foreground": 1, "background": 1}
+    assert scheduler.try_acquire("maintenance", "background") == ("maintenance", "background")
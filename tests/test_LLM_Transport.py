@@ -0,0 +1,121 @@
+"""
+Pooled keep-alive transport, against a local HTTP server instead of an LLM API.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from LLM_Transport import CancelToken, PooledTransport, RequestCancelled, TransportTimeout, cancellable
+
+
+@pytest.fixture
+def server():
+    """
+    A chat completion endpoint. A request option "delay" makes it wait that many seconds before answering, "drop"
+    makes it close the connection after answering without telling the client.
+    :return: Namespace with the server's base_url and the list of requests it received, as (client port, headers)
+    """
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            requests.append((self.client_address[1], dict(self.headers)))
+            time.sleep(payload.get("delay", 0))
+            body = json.dumps({"choices": [{"index": 0, "finish_reason": "stop", "message": {
+                "role": "assistant", "content": "Okay."}}]}).encode()
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except OSError:
+                pass  # The client gave up on the request
+            self.close_connection = self.close_connection or payload.get("drop", False)
+
+        def log_message(self, format, *args):
+            pass
+
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    http_server.daemon_threads = True  # Don't wait for the handler of a cancelled request on close
+    threading.Thread(target=http_server.serve_forever, args=(0.05,), daemon=True).start()
+    yield SimpleNamespace(base_url=f"http://127.0.0.1:{http_server.server_address[1]}/v1", requests=requests)
+    http_server.shutdown()
+    http_server.server_close()
+
+
+@pytest.fixture
+def transport(server):
+    transport = PooledTransport(server.base_url, pool_size=2, call_site_timeouts={"relevance": (1.0, 0.2)})
+    yield transport
+    transport.close()
+
+
+def _ask(transport, call_site="default", **request_options):
+    response = transport(model="stand-in", messages=[{"role": "user", "content": "Hello"}], call_site=call_site,
+                         **request_options)
+    return response.choices[0].message.content
+
+
+def test_connection_is_kept_alive(server, transport):
+    assert [_ask(transport) for _ in range(3)] == ["Okay."] * 3
+    assert len({port for port, _ in server.requests}) == 1
+    health = transport.get_health()
+    assert (health["connections_opened"], health["connections_reused"]) == (1, 2)
+
+
+def test_call_site_is_only_named_when_configured(server, transport):
+    _ask(transport, call_site="relevance")
+    named = PooledTransport(server.base_url, send_call_site=True)
+    _ask(named, call_site="relevance")
+    named.close()
+    assert [headers.get("X-Call-Site") for _, headers in server.requests] == [None, "relevance"]
+
+
+def test_read_timeout_of_the_call_site(transport):
+    with pytest.raises(TransportTimeout):
+        _ask(transport, call_site="relevance", delay=0.5)
+    assert _ask(transport, call_site="default", delay=0.5) == "Okay."
+    assert transport.get_health()["failures"] == 1
+
+
+def test_dead_connection_is_replaced(server, transport):
+    _ask(transport, drop=True)
+    assert _ask(transport) == "Okay."
+    first_port, second_port = (port for port, _ in server.requests)
+    assert first_port != second_port
+    health = transport.get_health()
+    assert (health["connections_opened"], health["connections_dropped"], health["failures"]) == (2, 1, 0)
+
+
+def test_cancelled_request_is_aborted(transport):
+    token = CancelToken()
+    errors = []
+
+    def ask():
+        with cancellable(token):
+            try:
+                _ask(transport, delay=2.0)
+            except RequestCancelled as e:
+                errors.append(e)
+
+    started = time.perf_counter()
+    thread = threading.Thread(target=ask)
+    thread.start()
+    time.sleep(0.2)
+    token.cancel()
+    thread.join()
+    assert len(errors) == 1
+    assert time.perf_counter() - started < 1.5
+    assert transport.get_health()["failures"] == 0
+
+    with cancellable(token), pytest.raises(RequestCancelled):
+        _ask(transport)
@@ -0,0 +1,60 @@
+"""
+Searches over MemoryHierarchy.
+"""
+
+from types import SimpleNamespace
+
+from Information_Table import Information
+from Memory_Hierarchy import MemoryHierarchy
+
+_TOPICS = ["cheese on the kitchen table", "cat sleeping by the door", "rain against the window",
+           "music from the radio"]
+
+
+def _memory(text):
+    return SimpleNamespace(what=Information(text), experienced_information=[Information(text)])
+
+
+def _hierarchy(count, branching=4):
+    # The topic changes every two episodes, as what an agent experiences does
+    memories = [_memory(f"{_TOPICS[position // (2 * branching) % len(_TOPICS)]} {position}")
+                for position in range(count)]
+    hierarchy = MemoryHierarchy(branching=branching, beam=2, search_leaves=4)
+    hierarchy.sync(memories)
+    return hierarchy, memories
+
+
+def test_levels_grow_with_the_memories():
+    hierarchy, memories = _hierarchy(40)
+    stats = hierarchy.get_stats()
+    assert stats["memories"] == 40
+    assert stats["nodes_per_level"][:2] == [40, 10]
+    assert stats["nodes_per_level"][-1] <= 4
+
+
+def test_search_finds_the_matching_memories_in_stored_order():
+    hierarchy, memories = _hierarchy(64)
+    found = hierarchy.search("cat sleeping by the door")
+    assert found
+    assert len(found) <= 4
+    assert all("cat" in memory.what.value for memory in found)
+    assert found == sorted(found, key=memories.index)
+
+
+def test_search_before_only_sees_earlier_memories():
+    hierarchy, memories = _hierarchy(64)
+    found = hierarchy.search("rain against the window", before=20)
+    assert found
+    assert all(memories.index(memory) < 20 for memory in found)
+
+
+def test_small_search_returns_everything():
+    hierarchy, memories = _hierarchy(3)
+    assert hierarchy.search("anything") == memories
+
+
+def test_sync_adds_each_memory_once():
+    hierarchy, memories = _hierarchy(10)
+    hierarchy.sync(memories + [memories[0]])
+    assert len(hierarchy) == 10
+    assert hierarchy.synced == 11
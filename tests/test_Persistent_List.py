@@ -0,0 +1,53 @@
+"""
+Snapshots and copy on write of PersistentList.
+"""
+
+import pytest
+
+from Persistent_List import PersistentList
+
+
+def test_snapshot_is_unaffected_by_later_appends():
+    items = PersistentList([1, 2])
+    snapshot = items.snapshot()
+    items.append(3)
+    items.extend([4, 5])
+    assert snapshot.to_list() == [1, 2]
+    assert items.to_list() == [1, 2, 3, 4, 5]
+
+
+def test_snapshot_shares_the_backing_list_until_written():
+    items = PersistentList([1, 2])
+    snapshot = items.snapshot()
+    assert snapshot._items is items._items
+    items.append(3)
+    assert snapshot._items is items._items  # The original still ends where the backing list does, nothing is copied
+
+
+def test_appending_to_a_diverged_snapshot_copies_only_its_items():
+    items = PersistentList([1, 2])
+    snapshot = items.snapshot()
+    items.append(3)
+    snapshot.append("x")
+    assert snapshot._items is not items._items
+    assert snapshot.to_list() == [1, 2, "x"]
+    assert items.to_list() == [1, 2, 3]
+
+
+def test_added_since_a_snapshot_is_a_slice():
+    items = PersistentList([1, 2])
+    snapshot = items.snapshot()
+    items += [3, 4]
+    assert items.added_since(snapshot) == [3, 4]
+    assert items.added_since([2, 4]) == [1, 3]
+
+
+def test_indexing_stops_at_the_list_length():
+    items = PersistentList([1, 2, 3])
+    snapshot = items.snapshot()
+    items.append(4)
+    assert snapshot[-1] == 3
+    assert snapshot[1:] == [2, 3]
+    assert list(snapshot) == [1, 2, 3]
+    with pytest.raises(IndexError):
+        snapshot[3]
@@ -0,0 +1,32 @@
+"""
+Token budgeted prompt sections.
+"""
+
+from Prompt_Assembler import PromptSection, count_tokens
+
+
+def _render(text, rendered):
+    def render():
+        rendered.append(text)
+        return text
+    return render
+
+
+def test_item_whose_raw_text_is_too_long_is_still_rendered():
+    section = PromptSection("temporal", budget=100)
+    rendered = []
+    section.add("the newest item", recency=1.0)
+    section.add(" ".join(["information"] * 200), render=_render("I had a long day.", rendered), recency=0.5)
+    assert section.render() == "the newest item\nI had a long day."
+    assert rendered == ["I had a long day."]
+
+
+def test_item_estimated_not_to_fit_is_not_rendered():
+    section = PromptSection("temporal", budget=40)
+    rendered = []
+    section.add("the newest item", recency=1.0)
+    long_text = " ".join(["information"] * 50)
+    section.add("a short raw text", render=_render(long_text, rendered), recency=0.5, estimate=count_tokens(long_text))
+    section.add("an older item", render=_render("It rained.", rendered), recency=0.2)
+    assert section.render() == "the newest item\nIt rained."
+    assert rendered == ["It rained."]
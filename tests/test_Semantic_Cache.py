@@ -0,0 +1,45 @@
+"""
+Approximate matching and audits of SemanticCache.
+"""
+
+from LLM_Controller import ResponseObject
+from Semantic_Cache import SemanticCache
+
+
+def _response(text):
+    return ResponseObject({"choices": [{"index": 0, "finish_reason": "stop",
+                                        "message": {"role": "assistant", "content": text}}]})
+
+
+def _cache(key, answer, audit_rate=0.0):
+    cache = SemanticCache(audit_rate=audit_rate)
+    cache.store("relevance", key, _response(answer))
+    return cache
+
+
+def test_reworded_and_reordered_keys_hit():
+    cache = _cache(("is underneath a tree relevant", "a tree, a rock"), "yes")
+    hit = cache.lookup("relevance", "relevance", ("is under a tree relevant", "a rock, a tree"), 0.92)
+    assert hit is not None
+    assert hit.response.choices[0].message.content == "yes"
+
+
+def test_negated_key_never_hits():
+    cache = _cache("the door is open", "yes")
+    assert cache.lookup("relevance", "relevance", "the door is not open", 0.5) is None
+    assert cache.lookup("relevance", "relevance", "the door isn't open", 0.5) is None
+
+
+def test_opposite_verdicts_are_a_false_hit():
+    cache = _cache("is the cheese relevant", "Yes, it is relevant.", audit_rate=1.0)
+    hit = cache.lookup("relevance", "relevance", "is cheese relevant", 0.8)
+    assert hit.audit
+    assert not cache.record_audit(hit, "No, it is not relevant.", by_verdict=True)
+    assert cache.get_stats()["call_sites"]["relevance"]["false_hits"] == 1
+    assert cache.lookup("relevance", "relevance", "is cheese relevant", 0.8) is None  # The false hit was dropped
+
+
+def test_same_verdict_agrees_whatever_the_wording():
+    cache = _cache("is the cheese relevant", "Yes.", audit_rate=1.0)
+    hit = cache.lookup("relevance", "relevance", "is cheese relevant", 0.8)
+    assert cache.record_audit(hit, "yes, the cheese matters here", by_verdict=True)
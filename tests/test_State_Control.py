@@ -0,0 +1,20 @@
+"""
+Parsing the fused decision of an agent.
+"""
+
+import pytest
+
+from State_Control import _parse_decision
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"candidates": ["hide", "run away"], "choice": "run away"}', (["hide", "run away"], "run away")),
+    ('I decided: {"candidates": [" hide "], "choice": "hide"}', (["hide"], "hide")),
+    ('{"candidates": "run away", "choice": "run away"}', (["run away"], "run away")),
+    ('{"candidates": {"1": "hide"}, "choice": "hide"}', (["hide"], "hide")),
+    ('{"choice": "hide"}', (["hide"], "hide")),
+    ('{"candidates": ["hide"]}', ([], '{"candidates": ["hide"]}')),
+    ("I would run away", ([], "I would run away")),
+])
+def test_parse_decision(text, expected):
+    assert _parse_decision(text) == expected
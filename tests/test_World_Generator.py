@@ -0,0 +1,65 @@
+"""
+Speculative world generation, with a stand-in backend instead of the LLM.
+"""
+
+import pytest
+
+import Benchmark
+import LLM_Controller as llm
+from World_Generator import WorldState, match_action
+
+_CANDIDATES = ["throw the acorn", "eat the acorn", "climb the tree"]
+
+
+@pytest.fixture
+def backend_calls():
+    """
+    :return: List of the call sites the stand-in backend was called for
+    """
+    calls = []
+    backend = Benchmark.StandInLLM(seed=0, latency=0.02)
+
+    def recording_backend(call_site="default", **request):
+        calls.append(call_site)
+        return backend(call_site=call_site, **request)
+
+    previous_backend = llm.set_llm_backend(recording_backend)
+    yield calls
+    llm.set_llm_backend(previous_backend)
+
+
+@pytest.mark.parametrize("choice, expected", [
+    ("Throw the acorn.", "throw the acorn"),
+    ("I would throw the acorn", "throw the acorn"),
+    ("I would throw the acorn rather than eat the acorn", None),
+    ("run away", None),
+])
+def test_match_action(choice, expected):
+    assert match_action(choice, _CANDIDATES) == expected
+
+
+def test_running_speculation_is_committed(backend_calls):
+    world = WorldState("A squirrel sits in a park.", speculation_width=2)
+    try:
+        backend_calls.clear()
+        world.speculate(_CANDIDATES)
+        world.get_next_world_state("I would throw the acorn")
+        assert world.speculation_stats["launched"] == 2
+        assert world.speculation_stats["committed"] == 1
+        # Only the speculations generated a next state, none was made serially
+        assert backend_calls.count("world_next_state") == 2
+        assert world.current_information_list
+    finally:
+        world.close()
+
+
+def test_unmatched_choice_is_generated_serially(backend_calls):
+    world = WorldState("A squirrel sits in a park.", speculation_width=2)
+    try:
+        backend_calls.clear()
+        world.speculate(_CANDIDATES)
+        world.get_next_world_state("climb the tree")
+        assert world.speculation_stats["committed"] == 0
+        assert backend_calls.count("world_next_state") >= 1
+    finally:
+        world.close()